@@ -0,0 +1,9 @@
+"""
+Benchmarks of the framework.
+
+Each module can be run with python -m and writes its results as JSON, for example:
+
+    python -m keckdrpframework.benchmarks.bench_dispatch --events 20000 --output dispatch.json
+
+See README.md.
+"""
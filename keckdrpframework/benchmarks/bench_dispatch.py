@@ -0,0 +1,337 @@
+"""
+Benchmark of the dispatch overhead of Framework.main_loop().
+
+The actions do nothing, so the measured time is the time spent by the framework
+to take events from the queues, find and run the actions and push the next events.
+
+Scenarios:
+    noop       N low priority events, one action each
+    mix        N low priority events, each followed by hi_per_low high priority events through the event table
+    recurrent  one recurrent event, run N times, see unit_tests/test_recurrent.py
+    shared     N events in the shared queue of a queue manager, consumed by 1..P worker processes,
+               each prefetching K events at a time, see config.event_prefetch
+    local      N events in a SharedMemoryEventQueue, consumed by 1..P forked worker processes, without queue manager
+
+The time is measured from the start of the main loop until the last action,
+so that the final wait of event_timeout seconds is not included.
+
+Results are written as JSON, to stdout or to the output file.
+
+Created on Oct 18, 2026
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import logging
+import argparse
+import platform
+import threading
+import statistics
+import multiprocessing
+
+from keckdrpframework.core import queues
+from keckdrpframework.core.framework import Framework
+from keckdrpframework.config.framework_config import ConfigClass
+from keckdrpframework.models.arguments import Arguments
+from keckdrpframework.models.event import Event
+from keckdrpframework.pipelines.base_pipeline import BasePipeline
+
+QUEUE_AUTH_CODE = b"dispatch benchmark"
+
+
+class DispatchPipeline(BasePipeline):
+    """
+    Actions that only count the events.
+    """
+
+    event_table = {
+        "noop": ("noop", None, None),
+        "recurrent": ("recurrent", None, None),
+    }
+
+    def __init__(self, context):
+        BasePipeline.__init__(self, context)
+        self.count = 0
+        self.last_time = None
+        self._lock = threading.Lock()
+
+    def noop(self, action, context):
+        with self._lock:
+            self.count += 1
+            self.last_time = time.perf_counter()
+        return None
+
+    def recurrent(self, action, context):
+        self.noop(action, context)
+        if self.count >= action.args.max_count:
+            action.event._recurrent = False
+        return None
+
+
+def _mix_pipeline(hi_per_low):
+    """
+    Returns a pipeline class where each "noop" event is followed by hi_per_low high priority events.
+    """
+    table = dict(DispatchPipeline.event_table)
+    names = ["noop"] + [f"hi{i}" for i in range(hi_per_low)]
+    for name, next_name in zip(names, names[1:] + [None]):
+        table[name] = ("noop", None, next_name)
+    return type("MixPipeline", (DispatchPipeline,), {"event_table": table})
+
+
+def make_config(worker_threads=1, **kwargs):
+    """
+    Returns the configuration of the benchmarks: no tracing of actions, short event timeout.
+    """
+    config = ConfigClass()
+    config.properties.update(print_trace=False, event_timeout=0.2, no_event_event=None, worker_threads=worker_threads)
+    config.properties.update(kwargs)
+    return config
+
+
+def _quiet(framework, verbose):
+    if not verbose:
+        framework.logger.setLevel(logging.WARNING)
+
+
+def _run(framework, expected):
+    """
+    Runs the main loop, returns the elapsed time until the last action.
+    """
+    pipeline = framework.pipeline
+    start = time.perf_counter()
+    framework.main_loop()
+    framework.end()
+    if pipeline.count != expected:
+        raise RuntimeError(f"Expected {expected} actions, got {pipeline.count}")
+    return pipeline.last_time - start
+
+
+def bench_noop(n, worker_threads=1, verbose=False):
+    f = Framework(DispatchPipeline, make_config(worker_threads))
+    _quiet(f, verbose)
+    for i in range(n):
+        f.append_event("noop", Arguments(name=f"ev{i}"))
+    return _run(f, n), n
+
+
+def bench_mix(n, hi_per_low=3, worker_threads=1, verbose=False):
+    f = Framework(_mix_pipeline(hi_per_low), make_config(worker_threads))
+    _quiet(f, verbose)
+    for i in range(n):
+        f.append_event("noop", Arguments(name=f"ev{i}"))
+    total = n * (1 + hi_per_low)
+    return _run(f, total), total
+
+
+def bench_recurrent(n, verbose=False):
+    f = Framework(DispatchPipeline, make_config())
+    _quiet(f, verbose)
+    f.append_event("recurrent", Arguments(name="recurrent", max_count=n), recurrent=True)
+    return _run(f, n), n
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("localhost", 0))
+        return s.getsockname()[1]
+
+
+def _shared_worker(portnr, prefetch, results, verbose):
+    """
+    Target of the worker processes: consumes events from the shared queue until it is empty.
+    """
+    config = make_config(
+        want_multiprocessing=True,
+        queue_manager_hostname="localhost",
+        queue_manager_portnr=portnr,
+        queue_manager_auth_code=QUEUE_AUTH_CODE,
+        event_prefetch=prefetch,
+    )
+    f = Framework(DispatchPipeline, config)
+    _quiet(f, verbose)
+    f.main_loop()
+    results.put((f.pipeline.count, time.time() if f.pipeline.count else None))
+
+
+def bench_shared(n, processes, prefetch=0, verbose=False):
+    """
+    Fills the shared queue with n events, then starts the worker processes.
+    The time is measured from the start of the processes until the last action in any process.
+    """
+    portnr = _free_port()
+    logger = logging.getLogger("bench_dispatch")
+    manager = queues.start_queue_manager("localhost", portnr, QUEUE_AUTH_CODE, logger)
+    try:
+        queue = queues.get_event_queue("localhost", portnr, QUEUE_AUTH_CODE)
+        if queue is None:
+            raise RuntimeError("Failed to start the queue manager")
+        queue.put_many([Event("noop", Arguments(name=f"ev{i}")) for i in range(n)])
+
+        results = multiprocessing.Queue()
+        workers = [
+            multiprocessing.Process(target=_shared_worker, args=(portnr, prefetch, results, verbose)) for i in range(processes)
+        ]
+        start = time.time()
+        for w in workers:
+            w.start()
+        outputs = [results.get() for w in workers]
+        for w in workers:
+            w.join()
+    finally:
+        try:
+            queues.get_event_queue("localhost", portnr, QUEUE_AUTH_CODE).terminate()
+        except Exception:
+            pass
+        manager.join(5)
+
+    count = sum(c for c, t in outputs)
+    if count != n:
+        raise RuntimeError(f"Expected {n} actions, got {count}")
+    return max(t for c, t in outputs if t is not None) - start, n
+
+
+def _local_worker(queue, results, verbose):
+    """
+    Target of the forked worker processes: consumes events from the shared memory queue until it is empty.
+    """
+    f = Framework(DispatchPipeline, make_config(), event_queue=queue)
+    _quiet(f, verbose)
+    f.main_loop()
+    results.put((f.pipeline.count, time.time() if f.pipeline.count else None))
+
+
+def bench_local(n, processes, verbose=False):
+    """
+    Fills a SharedMemoryEventQueue with n events, then forks the worker processes.
+    The time is measured as in bench_shared().
+    """
+    ctx = multiprocessing.get_context("fork")
+    queue = queues.SharedMemoryEventQueue(ctx=ctx)
+    try:
+        queue.put_many([Event("noop", Arguments(name=f"ev{i}")) for i in range(n)])
+        results = ctx.Queue()
+        workers = [ctx.Process(target=_local_worker, args=(queue, results, verbose)) for i in range(processes)]
+        start = time.time()
+        for w in workers:
+            w.start()
+        outputs = [results.get() for w in workers]
+        for w in workers:
+            w.join()
+    finally:
+        queue.close()
+        queue.unlink()
+
+    count = sum(c for c, t in outputs)
+    if count != n:
+        raise RuntimeError(f"Expected {n} actions, got {count}")
+    return max(t for c, t in outputs if t is not None) - start, n
+
+
+def _measure(scenario, repeat, fn, *args, **params):
+    times = []
+    for i in range(repeat):
+        elapsed, events = fn(*args, **params)
+        times.append(elapsed)
+    best = min(times)
+    out = {
+        "scenario": scenario,
+        "events": events,
+        "repeat": repeat,
+        "seconds": times,
+        "best_seconds": best,
+        "median_seconds": statistics.median(times),
+        "events_per_second": events / best,
+        "overhead_us_per_event": best / events * 1e6,
+    }
+    out.update({k: v for k, v in params.items() if k != "verbose"})
+    return out
+
+
+def run_benchmarks(
+    scenarios, events, repeat=3, worker_threads=(1,), processes=(1, 2, 4), hi_per_low=3, prefetch=(0,), verbose=False
+):
+    """
+    Runs the given scenarios, returns the results as a dictionary.
+    """
+    results = []
+    for scenario in scenarios:
+        if scenario == "noop":
+            for wt in worker_threads:
+                results.append(_measure(scenario, repeat, bench_noop, events, worker_threads=wt, verbose=verbose))
+        elif scenario == "mix":
+            for wt in worker_threads:
+                results.append(
+                    _measure(scenario, repeat, bench_mix, events, hi_per_low=hi_per_low, worker_threads=wt, verbose=verbose)
+                )
+        elif scenario == "recurrent":
+            results.append(_measure(scenario, repeat, bench_recurrent, events, verbose=verbose))
+        elif scenario == "shared":
+            for p in processes:
+                for k in prefetch:
+                    results.append(
+                        _measure(scenario, repeat, bench_shared, events, processes=p, prefetch=k, verbose=verbose)
+                    )
+        elif scenario == "local":
+            for p in processes:
+                results.append(_measure(scenario, repeat, bench_local, events, processes=p, verbose=verbose))
+        else:
+            raise ValueError(f"Unknown scenario {scenario}")
+
+    return {
+        "benchmark": "dispatch",
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "results": results,
+    }
+
+
+def _parseArguments(in_args):
+    description = "Benchmark of the framework dispatch overhead"
+    usage = "\n{} [options]\n".format(in_args[0])
+
+    parser = argparse.ArgumentParser(prog=f"{in_args[0]}", description=description, usage=usage)
+    parser.add_argument(
+        "-s",
+        "--scenarios",
+        dest="scenarios",
+        nargs="+",
+        default=["noop", "mix", "recurrent", "shared", "local"],
+        help="Scenarios: noop, mix, recurrent, shared, local",
+    )
+    parser.add_argument("-n", "--events", dest="events", type=int, default=10000, help="Number of events")
+    parser.add_argument("-r", "--repeat", dest="repeat", type=int, default=3, help="Number of runs per scenario")
+    parser.add_argument("-w", "--worker_threads", dest="worker_threads", type=int, nargs="+", default=[1])
+    parser.add_argument("-p", "--processes", dest="processes", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument(
+        "-k", "--prefetch", dest="prefetch", type=int, nargs="+", default=[0], help="Events prefetched by the workers"
+    )
+    parser.add_argument("--hi_per_low", dest="hi_per_low", type=int, default=3, help="High priority events per event")
+    parser.add_argument("-o", "--output", dest="output", type=str, help="Output JSON file, default stdout")
+    parser.add_argument("-v", "--verbose", dest="verbose", action="store_true", help="Keep the framework log")
+    return parser.parse_args(in_args[1:])
+
+
+if __name__ == "__main__":
+    args = _parseArguments(sys.argv)
+    out = run_benchmarks(
+        args.scenarios,
+        args.events,
+        repeat=args.repeat,
+        worker_threads=args.worker_threads,
+        processes=args.processes,
+        hi_per_low=args.hi_per_low,
+        prefetch=args.prefetch,
+        verbose=args.verbose,
+    )
+    text = json.dumps(out, indent=2)
+    if args.output is None:
+        print(text)
+    else:
+        with open(args.output, "w") as fh:
+            fh.write(text)
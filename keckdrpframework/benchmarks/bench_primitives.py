@@ -0,0 +1,223 @@
+"""
+Micro-benchmarks of the numeric primitives.
+
+Runs the hot paths of the example primitives on synthetic images:
+    hist_equal     HistEqual2d._applyAHEC
+    denoise        NoiseRemoval._denoise
+    read_single    SimpleFitsReader.readData, one HDU
+    read_mosaic    SimpleFitsReader.readData, 2x2 amplifiers assembled with DETSIZE/DETSEC/DATASEC
+    average        BaseImg.average of 3 files
+    save_png       SavePng._perform, output format as in examples/fits2png.cfg
+
+For each primitive, image size and dtype, reports the best time of the runs,
+the peak of memory allocated during one run, measured with tracemalloc in a separate run,
+and the throughput in pixels per second.
+
+Results are written as JSON, to stdout or to the output file.
+
+Created on Oct 18, 2026
+"""
+
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import platform
+import tempfile
+import tracemalloc
+from configparser import ConfigParser
+
+import numpy as np
+import astropy.io.fits as pf
+
+from keckdrpframework.config.framework_config import ConfigClass
+from keckdrpframework.core.framework import create_context
+from keckdrpframework.models.action import Action
+from keckdrpframework.models.arguments import Arguments
+from keckdrpframework.models.event import Event
+from keckdrpframework.primitives.base_img import BaseImg
+from keckdrpframework.primitives.hist_equal2d import HistEqual2d
+from keckdrpframework.primitives.noise_removal import NoiseRemoval
+from keckdrpframework.primitives.save_png import SavePng
+from keckdrpframework.primitives.simple_fits_reader import SimpleFitsReader
+
+BENCHMARKS = ("hist_equal", "denoise", "read_single", "read_mosaic", "average", "save_png")
+DTYPES = ("uint16", "float32", "float64")
+SIZES = (1024, 2048, 4096, 8192)
+
+FITS2PNG_CONFIG = os.path.join(os.path.dirname(__file__), "..", "examples", "fits2png.cfg")
+
+
+def make_image(size, dtype, seed=0):
+    """
+    Returns a synthetic size x size image: sky background with noise, a few stars and hot pixels.
+    """
+    rng = np.random.default_rng(seed)
+    img = rng.normal(1000, 30, (size, size))
+    yy, xx = np.mgrid[0:32, 0:32]
+    star = 20000 * np.exp(-((xx - 16) ** 2 + (yy - 16) ** 2) / 8)
+    for y, x in rng.integers(0, size - 32, (max(1, size // 64), 2)):
+        img[y : y + 32, x : x + 32] += star
+    hot = rng.integers(0, size, (size // 4, 2))
+    img[hot[:, 0], hot[:, 1]] = 60000
+    return np.clip(img, 0, 65535).astype(dtype)
+
+
+def write_single(fname, img):
+    pf.writeto(fname, img, overwrite=True)
+
+
+def write_mosaic(fname, img):
+    """
+    Writes img as 4 amplifiers with DETSIZE, DETSEC and DATASEC, as SimpleFitsReader.readData() expects.
+    """
+    h, w = img.shape
+    h2, w2 = h // 2, w // 2
+    hdus = [pf.PrimaryHDU()]
+    for y0 in (0, h2):
+        for x0 in (0, w2):
+            hdr = pf.Header()
+            hdr["DETSIZE"] = f"[1:{w},1:{h}]"
+            hdr["DETSEC"] = f"[{x0 + 1}:{x0 + w2},{y0 + 1}:{y0 + h2}]"
+            hdr["DATASEC"] = f"[1:{w2},1:{h2}]"
+            hdus.append(pf.ImageHDU(img[y0 : y0 + h2, x0 : x0 + w2], header=hdr))
+    pf.HDUList(hdus).writeto(fname, overwrite=True)
+
+
+def make_context(output_dir):
+    config = ConfigClass()
+    config.properties.update(print_trace=False, output_directory=output_dir, temp_directory=output_dir)
+    fits2png = ConfigParser()
+    fits2png.read(FITS2PNG_CONFIG)
+    config.fits2png = fits2png
+    logger = logging.getLogger("bench_primitives")
+    logger.setLevel(logging.WARNING)
+    return create_context(logger=logger, config=config)
+
+
+def make_primitive(klass, context, args):
+    action = Action(Event("bench", args), ("bench", None, None), args=args)
+    return klass(action, context)
+
+
+def _setup(name, size, dtype, context, workdir):
+    """
+    Returns the function to benchmark for the given primitive, image size and dtype.
+    """
+    img = make_image(size, dtype)
+    if name == "hist_equal":
+        prim = make_primitive(HistEqual2d, context, Arguments(name="img", img=img))
+        return lambda: prim._applyAHEC(img)
+
+    if name == "denoise":
+        prim = make_primitive(NoiseRemoval, context, Arguments(name="img", img=img))
+        return lambda: prim._denoise(img)
+
+    if name in ("read_single", "read_mosaic"):
+        fname = os.path.join(workdir, f"{name}.fits")
+        (write_single if name == "read_single" else write_mosaic)(fname, img)
+        prim = make_primitive(SimpleFitsReader, context, Arguments(name=fname))
+        return lambda: prim.readData(fname)
+
+    if name == "average":
+        fnames = []
+        for i in range(3):
+            fnames.append(os.path.join(workdir, f"average_{i}.fits"))
+            write_single(fnames[-1], img)
+        prim = make_primitive(BaseImg, context, Arguments(name=fnames[0]))
+        return lambda: prim.average(fnames)
+
+    if name == "save_png":
+        # Images to save are 8 bits, as from HistEqual2d
+        if img.dtype.kind == "f":
+            img8 = (img / 65535 * 255).astype(np.uint8)
+        else:
+            img8 = (img >> 8).astype(np.uint8)
+        prim = make_primitive(SavePng, context, Arguments(name=os.path.join(workdir, "save.fits"), img=img8))
+        return prim._perform
+
+    raise ValueError(f"Unknown benchmark {name}")
+
+
+def measure(fn, repeat):
+    """
+    Returns the best time of repeat runs, and the peak allocated memory of one more run.
+    """
+    times = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    try:
+        fn()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return times, peak
+
+
+def run_benchmarks(names=BENCHMARKS, sizes=SIZES, dtypes=DTYPES, repeat=3):
+    """
+    Runs the benchmarks, returns the results as a dictionary.
+    """
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        context = make_context(workdir)
+        for name in names:
+            for size in sizes:
+                for dtype in dtypes:
+                    fn = _setup(name, size, dtype, context, workdir)
+                    times, peak = measure(fn, repeat)
+                    best = min(times)
+                    results.append(
+                        {
+                            "primitive": name,
+                            "size": size,
+                            "dtype": dtype,
+                            "pixels": size * size,
+                            "seconds": times,
+                            "best_seconds": best,
+                            "peak_bytes": peak,
+                            "pixels_per_second": size * size / best if best > 0 else None,
+                        }
+                    )
+
+    return {
+        "benchmark": "primitives",
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "results": results,
+    }
+
+
+def _parseArguments(in_args):
+    description = "Micro-benchmarks of the numeric primitives"
+    usage = "\n{} [options]\n".format(in_args[0])
+
+    parser = argparse.ArgumentParser(prog=f"{in_args[0]}", description=description, usage=usage)
+    parser.add_argument(
+        "-b", "--benchmarks", dest="benchmarks", nargs="+", default=list(BENCHMARKS), help=", ".join(BENCHMARKS)
+    )
+    parser.add_argument("-s", "--sizes", dest="sizes", type=int, nargs="+", default=list(SIZES), help="Image sizes")
+    parser.add_argument("-d", "--dtypes", dest="dtypes", nargs="+", default=list(DTYPES), help="Image data types")
+    parser.add_argument("-r", "--repeat", dest="repeat", type=int, default=3, help="Number of timed runs")
+    parser.add_argument("-o", "--output", dest="output", type=str, help="Output JSON file, default stdout")
+    return parser.parse_args(in_args[1:])
+
+
+if __name__ == "__main__":
+    args = _parseArguments(sys.argv)
+    out = run_benchmarks(args.benchmarks, args.sizes, args.dtypes, args.repeat)
+    text = json.dumps(out, indent=2)
+    if args.output is None:
+        print(text)
+    else:
+        with open(args.output, "w") as fh:
+            fh.write(text)
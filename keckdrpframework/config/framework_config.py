@@ -22,6 +22,7 @@ class ConfigClass(ConfigParser):
     config_defaults = {
         "name": "DRP-Example",
         "monitor_interval": 10,  # sec,
+        "ingest_batch_size": 100,
         "event_timeout": 1,
         "print_trace": True,
         "logger_config_file": "logger.cfg",
@@ -42,6 +43,29 @@ class ConfigClass(ConfigParser):
         "queue_manager_hostname": "localhost",
         "queue_manager_portnr": 50101,
         "queue_manager_auth_code": b"a very long authentication code",
+        "queue_manager_shards": 1,
+        "worker_threads": 1,
+        "default_executor": "inline",
+        "thread_pool_size": None,
+        "process_pool_size": None,
+        "async_tasks": 100,
+        "compile_event_table": False,
+        "event_queue_aging_time": None,
+        "event_queue_maxsize": None,
+        "event_queue_high_water": None,
+        "event_queue_hi_high_water": None,
+        "event_queue_backend": "memory",
+        "event_queue_file": None,
+        "shared_memory_min_bytes": 0,
+        "event_prefetch": 0,
+        "event_prefetch_lease": 60,
+        "event_visibility_timeout": None,
+        "event_max_attempts": None,
+        "profile_actions": False,
+        "profile_every_n": 10,
+        "trace_events": False,
+        "trace_max_spans": 100000,
+        "memory_accounting": False,
     }
 
     def __init__(self, cgfile=None, **kwargs):
@@ -122,6 +146,10 @@ class ConfigClass(ConfigParser):
             self.properties[sec] = digestItems(sec, self.properties)
 
     def __getattr__(self, key):
+        if key.startswith("__") or "properties" not in self.__dict__:
+            # Not a configuration parameter, for example while unpickling
+            raise AttributeError(key)
+
         val = self.properties.get(key.lower())
         if val is not None:
             return val
@@ -0,0 +1,218 @@
+"""
+Created on Oct 18, 2026
+
+Framework with an asyncio based action loop.
+
+The event loop takes events from the queues and starts one task per event,
+so that up to config.async_tasks actions are in flight at the same time.
+This helps when most of the time is spent waiting on I/O, for example when ingesting many small files.
+
+Actions can be:
+    - 'async def' methods or functions, they are awaited.
+    - primitives, their async_apply() is awaited.
+      BasePrimitive.async_perform() runs _perform() in the default executor,
+      primitives doing I/O can override async_perform().
+    - regular methods or functions, they run in the default executor of the event loop.
+
+Actions bound to a thread pool or a process pool, see core/executors.py, still run there.
+Pre- and post-conditions that are not coroutines run in the default executor.
+
+Events are fetched from the queues in a thread of their own, so that the round trips to a shared queue
+do not block the event loop, and regular actions running in the default executor do not delay fetching.
+Events are completed in another thread, so that a completion does not wait while the fetching thread
+waits for an event.
+
+If profiling is enabled, sampled actions whose primitive runs _perform() in the default executor are profiled.
+
+"""
+
+import asyncio
+import contextvars
+import functools
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+from keckdrpframework.core.framework import Framework
+from keckdrpframework.core.executors import INLINE
+from keckdrpframework.utils.tracing import use_trace
+
+
+class AsyncFramework(Framework):
+    """
+    Same as Framework, except that main_loop() runs the action loop on asyncio.
+    """
+
+    def main_loop(self):
+        """
+        Runs the asyncio action loop until there are no more events, see Framework.main_loop().
+        """
+        asyncio.run(self.async_main_loop())
+
+    async def async_main_loop(self):
+        """
+        The asyncio action loop.
+        Gets one event at a time and runs its action in a new task.
+        """
+        loop = asyncio.get_running_loop()
+        in_flight = asyncio.Semaphore(self.config.async_tasks or 1)
+        tasks = set()
+        fetcher = self._fetcher = ThreadPoolExecutor(max_workers=1, thread_name_prefix="fetch")
+        completer = self._completer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="complete")
+
+        self.keep_going = True
+        self._worker_exception = None
+
+        while self.keep_going:
+            await in_flight.acquire()
+            try:
+                event = await loop.run_in_executor(fetcher, self._next_event)
+            except BrokenPipeError:
+                self.logger.error("Failed to get retrieve events. Queue may be closed.")
+                in_flight.release()
+                break
+
+            if event is None:
+                in_flight.release()
+                self.logger.info("No new events - do nothing")
+                if await loop.run_in_executor(fetcher, self._is_idle):
+                    self.logger.debug("No pending events or actions, terminating")
+                    self.keep_going = False
+                    if self.queue_manager is not None:
+                        try:
+                            self.event_queue.terminate()
+                        except:
+                            pass
+                continue
+
+            task = asyncio.create_task(self._async_run_event(event))
+            tasks.add(task)
+
+            def task_done(t):
+                tasks.discard(t)
+                in_flight.release()
+
+            task.add_done_callback(task_done)
+
+        if tasks:
+            await asyncio.gather(*tasks)
+        fetcher.shutdown(wait=False)
+        completer.shutdown()
+
+        self.keep_going = False
+        self.logger.info("Exiting main loop")
+
+        if self._worker_exception is not None:
+            raise self._worker_exception
+
+    async def _async_run_event(self, event):
+        """
+        Runs the action for the given event, as done in Framework._action_loop().
+        The event is completed in the completer thread, which does the round trips to the queues.
+        """
+        loop = asyncio.get_running_loop()
+        action = ""
+        success = False
+        error = None
+        try:
+            action = self.event_to_action(event, self.context)
+            await self.async_execute(action, self.context)
+            success = action.output is not None
+            with self._lock:
+                self.on_state(action, self.context)
+                if self.context.state == "stop":
+                    self.keep_going = False
+        except Exception as e:
+            error = e
+            if self.testing:
+                self.logger.info("Reraising exception (testing mode)")
+                self._worker_exception = e
+                self.keep_going = False
+            else:
+                self.logger.error(f"Framework async_main_loop: Exception while processing action {action}, {e}")
+                try:
+                    self.on_error(action, self.context, e)
+                except Exception as e2:
+                    self.logger.error(f"Exception in on_error, {e2}")
+                if self.config.print_trace:
+                    traceback.print_exc()
+
+        if action:
+            await loop.run_in_executor(self._completer, self._action_completed, success, action)
+        else:
+            # No action was built for the event
+            await loop.run_in_executor(self._completer, self._drop_event, event, error)
+
+    async def _async_call(self, method, action, context):
+        """
+        Calls a pre- or post-condition, in the default executor if it is not a coroutine.
+        """
+        if asyncio.iscoroutinefunction(method):
+            return await method(action, context)
+        loop = asyncio.get_running_loop()
+        # In the trace of the action, see use_trace()
+        call = functools.partial(contextvars.copy_context().run, method, action, context)
+        return await loop.run_in_executor(None, call)
+
+    async def _async_call_action(self, action_method, action, context):
+        """
+        Runs the action and returns its output.
+        """
+        if asyncio.iscoroutinefunction(action_method):
+            return await action_method(action, context)
+
+        loop = asyncio.get_running_loop()
+        if self.executors.get_executor_name(action, action_method) != INLINE:
+            # submit() waits for a free worker of the pool, not in the event loop
+            future = await loop.run_in_executor(None, self.executors.submit, action, action_method, context)
+            return await asyncio.wrap_future(future)
+
+        klass = getattr(action_method, "primitive_class", None)
+        if klass is not None and hasattr(klass, "async_apply"):
+            return await klass(action, context).async_apply()
+
+        return await loop.run_in_executor(None, action_method, action, context)
+
+    async def async_execute(self, action, context):
+        """
+        Executes one action, same as Framework.execute(), but awaits the action.
+        If tracing is enabled, the action is recorded as a span of the event's trace.
+        If profiling is enabled, the action is sampled, see BasePrimitive.async_apply().
+        """
+        if self.profiler is not None and self.profiler.sample(action.name):
+            action.profile = True
+        if self.tracer is not None:
+            with self.tracer.span(action.name, action.event.trace_id, event=action.event.name):
+                return await self._async_execute(action, context)
+        with use_trace(action.event.trace_id):
+            return await self._async_execute(action, context)
+
+    async def _async_execute(self, action, context):
+        pipeline = self.pipeline
+        action_name = action.name
+        try:
+            # Pre condition
+            pre_condition, action_method, post_condition = pipeline.get_action_methods(action_name)
+            start = time.perf_counter()
+            pre_ok = await self._async_call(pre_condition, action, context)
+            self._observe(action, "pre", start)
+            if pre_ok:
+                if self.config.print_trace:
+                    self.logger.debug("Executing action " + action.name)
+
+                start = time.perf_counter()
+                action_output = await self._async_call_action(action_method, action, context)
+                self._observe(action, "action", start)
+                new_args = self._set_output(action, action_output)
+                start = time.perf_counter()
+                post_ok = await self._async_call(post_condition, action, context)
+                self._observe(action, "post", start)
+                self._continue_chain(action, context, new_args, post_ok)
+            else:
+                # Failed pre-condition
+                if self.config.pre_condition_failed_stop:
+                    self._set_state(context, "stop")
+                else:
+                    self.store_arguments = action.args
+        except Exception as e:
+            self._action_failed(action, context, e)
@@ -0,0 +1,162 @@
+"""
+Created on Oct 18, 2026
+
+Executors for actions.
+
+By default an action runs inline, ie. in the thread of the action loop.
+An action can also be bound to a thread pool or to a process pool.
+CPU-heavy primitives bound to the process pool run in parallel, without holding the GIL of the framework process.
+
+The executor of an action is, in this order of precedence:
+    - the optional 4th element of the event table entry, for example
+          "file_ready": ("hist_equal2d", "histeq_done", "histeq_done", "process")
+    - the class attribute 'executor' of the primitive
+    - the configuration parameter default_executor
+
+Process-bound actions must be primitives, ie. classes with the BasePrimitive interface.
+The action, including its arguments, is pickled and sent to a worker process,
+where the primitive is instantiated with a process-local context.
+Events pushed by the primitive in the worker process are not seen by the framework.
+The framework continues the chain with the output of the primitive.
+
+Each pool runs at most as many actions as it has workers: submit() waits for a free worker,
+so that the action loop does not take more events from the queue than the pool can run.
+Events then stay in the queue, where they count for backpressure, instead of piling up in the pool.
+
+"""
+
+import os
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+from keckdrpframework.core import queues
+from keckdrpframework.models.processing_context import ProcessingContext
+from keckdrpframework.utils.drpf_logger import getLogger
+
+INLINE = "inline"
+THREAD = "thread"
+PROCESS = "process"
+
+EXECUTORS = (INLINE, THREAD, PROCESS)
+
+# The context of a process pool worker, created on first use
+_process_context = None
+
+
+def _get_process_context(config):
+    """
+    Returns the context used by primitives running in a process pool worker.
+    """
+    global _process_context
+    if _process_context is None:
+        logger = getLogger(config.logger_config_file, name="DRPF")
+        _process_context = ProcessingContext(queues.SimpleEventQueue(), queues.SimpleEventQueue(), logger, config)
+    else:
+        _process_context.config = config
+    return _process_context
+
+
+def run_primitive(klass, action, config):
+    """
+    Target of the process pool.
+    Instantiates the primitive in the worker process and returns the output of apply().
+    """
+    context = _get_process_context(config)
+    return klass(action, context).apply()
+
+
+class ActionExecutors:
+    """
+    Holds the thread pool and the process pool of a framework.
+    The pools are created on first use and persist until shutdown() is called.
+    """
+
+    def __init__(self, config, logger):
+        self.config = config
+        self.logger = logger
+        self._pools = {}
+        # One semaphore per pool, counting the free workers
+        self._slots = {}
+        self._lock = threading.Lock()
+
+    def get_executor_name(self, action, action_method):
+        """
+        Returns the name of the executor for the given action.
+        action_method is the function returned by pipeline.get_action().
+        """
+        klass = getattr(action_method, "primitive_class", None)
+        name = getattr(action, "executor", None)
+        if name is None:
+            name = getattr(klass, "executor", None)
+        if name is None:
+            name = self.config.default_executor or INLINE
+
+        if name not in EXECUTORS:
+            self.logger.warning(f"Unknown executor {name} for action {action.name}, running inline")
+            return INLINE
+
+        if name == PROCESS and klass is None:
+            self.logger.warning(f"Action {action.name} is not a primitive, cannot run in process pool, using thread pool")
+            return THREAD
+        return name
+
+    def pool_size(self, name):
+        """
+        Returns the number of workers of the pool for the given executor name.
+        """
+        if name == PROCESS:
+            return self.config.process_pool_size or os.cpu_count() or 1
+        # Same default as ThreadPoolExecutor
+        return self.config.thread_pool_size or min(32, (os.cpu_count() or 1) + 4)
+
+    def _get_pool(self, name):
+        """
+        Returns the pool for the given executor name and its semaphore, creates them if needed.
+        """
+        with self._lock:
+            pool = self._pools.get(name)
+            if pool is None:
+                size = self.pool_size(name)
+                if name == PROCESS:
+                    pool = ProcessPoolExecutor(max_workers=size)
+                else:
+                    pool = ThreadPoolExecutor(max_workers=size, thread_name_prefix="action_pool")
+                self._pools[name] = pool
+                self._slots[name] = threading.BoundedSemaphore(size)
+            return pool, self._slots[name]
+
+    def submit(self, action, action_method, context):
+        """
+        Submits the action to its pool, waiting until a worker of the pool is free.
+        Returns a concurrent.futures.Future, or None if the action must run inline.
+        In the thread pool, the action runs in a copy of the caller's context variables,
+        so that the events it creates continue the trace of its event, see use_trace().
+        """
+        name = self.get_executor_name(action, action_method)
+        if name == INLINE:
+            return None
+
+        pool, slots = self._get_pool(name)
+        slots.acquire()
+        try:
+            if name == PROCESS:
+                future = pool.submit(run_primitive, action_method.primitive_class, action, self.config)
+            else:
+                future = pool.submit(contextvars.copy_context().run, action_method, action, context)
+        except BaseException:
+            slots.release()
+            raise
+        future.add_done_callback(lambda fut: slots.release())
+        return future
+
+    def shutdown(self, wait=True):
+        """
+        Shuts down the pools.
+        """
+        with self._lock:
+            pools = list(self._pools.values())
+            self._pools = {}
+            self._slots = {}
+        for pool in pools:
+            pool.shutdown(wait=wait)
@@ -7,6 +7,7 @@ This is the main module implementing the framework.
 """
 
 import datetime
+import queue
 import threading
 import signal
 import traceback
@@ -14,8 +15,10 @@ import time
 import importlib
 import sys
 import os
+from collections import deque
 
 from keckdrpframework.core import queues
+from keckdrpframework.core.executors import ActionExecutors, INLINE
 
 # Server Task import
 from keckdrpframework.core.server_task import DRPFServerHandler
@@ -26,6 +29,10 @@ from keckdrpframework.models.action import Action
 from keckdrpframework.models.event import Event
 from keckdrpframework.models.data_set import DataSet
 from keckdrpframework.utils.drpf_logger import getLogger
+from keckdrpframework.utils.metrics import MetricsRegistry
+from keckdrpframework.utils.profiling import ActionProfiler
+from keckdrpframework.utils.tracing import Tracer, use_trace
+from keckdrpframework.utils.memory import MemoryTracker
 
 from keckdrpframework.config.framework_config import ConfigClass
 
@@ -69,11 +76,16 @@ class Framework(object):
         User should define their own on_error() function.
         See test_run_example.py.
 
+    The number of concurrent action loops is set by config.worker_threads.
+    With more than one worker thread, pipeline methods and primitives must be thread safe.
+
     """
 
-    def __init__(self, pipeline_name, configFile, testing=False):
+    def __init__(self, pipeline_name, configFile, testing=False, event_queue=None):
         """
         pipeline_name: name of the pipeline class containing recipes
+        event_queue: optional event queue shared with other processes, for instance a SharedMemoryEventQueue
+        created by the parent of the worker processes. By default, the queue is created from the configuration.
 
         Creates the event_queue and the action queue
         """
@@ -91,12 +103,17 @@ class Framework(object):
         self.logger.info("Initialization Framework cwd={}".format(os.getcwd()))
 
         self.wait_for_event = False
-        # The high priority event queue is local to the process
-        self.event_queue_hi = queues.SimpleEventQueue()
 
         # The regular event queue can be local or shared via queue manager
         self.queue_manager = None
-        self.event_queue = self._get_event_queue()
+        self._local_queue = None
+        self.event_queue = self._get_event_queue() if event_queue is None else event_queue
+
+        # The high priority event queue is local to the process
+        if self._local_queue is not None:
+            self.event_queue_hi = self._local_queue.level(0)
+        else:
+            self.event_queue_hi = queues.SimpleEventQueue()
 
         # The done_queue
         self.done_queue = None
@@ -114,11 +131,69 @@ class Framework(object):
             raise Exception(f"Failed to initialize pipeline {pipeline_name}")
 
         self.pipeline = pipeline
+        if self.config.compile_event_table:
+            # Raises exception if the event table is not valid
+            pipeline.compile_event_table()
 
         self.keep_going = True
         self.init_signal()
         self.store_arguments = Arguments()
 
+        # Serializes updates of store_arguments and context.state between worker threads
+        self._lock = threading.RLock()
+        self._worker_exception = None
+
+        # Partition keys being processed, events set aside for these keys and events ready to run
+        self._active_keys = set()
+        self._deferred_events = dict()
+        self._ready_events = deque()
+
+        # Events taken from a shared event queue and not completed, their leases are renewed by _heartbeat_loop()
+        self._running_events = dict()
+        self._heartbeat_thread = None
+
+        # Thread and process pools for actions not running inline
+        self.executors = ActionExecutors(self.config, self.logger)
+
+        # Timings and counts, see get_metrics()
+        self.metrics = MetricsRegistry()
+        self._init_metrics()
+
+        # Sampled cProfile of actions, see utils/profiling.py
+        self.profiler = None
+        if self.config.profile_actions:
+            self.profiler = ActionProfiler(self.config.temp_directory, self.config.profile_every_n, self.logger)
+        self.context.profiler = self.profiler
+
+        # Spans of event chains, see utils/tracing.py
+        self.tracer = None
+        if self.config.trace_events:
+            self.tracer = Tracer(self.config.trace_max_spans)
+        self.context.tracer = self.tracer
+
+        # Memory used by actions, see utils/memory.py
+        self.memory_tracker = None
+        if self.config.memory_accounting:
+            self.memory_tracker = MemoryTracker(self.metrics, self.logger)
+
+    def _init_metrics(self):
+        """
+        Registers the metrics recorded by the framework.
+        """
+        m = self.metrics
+        self._queue_wait = m.histogram("drpf_event_queue_wait_seconds", "Time from event creation to its action, by event")
+        self._action_time = m.histogram("drpf_action_seconds", "Execution time by action and phase (pre, action, post)")
+        self._events_done = m.counter("drpf_events_total", "Completed events by action and status")
+        self._events_retried = m.counter("drpf_events_retried_total", "Events taken again after an expired lease")
+        self._queue_depth = m.gauge("drpf_queue_depth", "Pending events by queue")
+        self._queue_in_progress = m.gauge("drpf_queue_in_progress", "Events in progress by queue")
+
+    def _observe(self, action, phase, start):
+        """
+        Records the time since start, a time.perf_counter() value, for the given phase of the action.
+        """
+        self._action_time.observe(time.perf_counter() - start, action=action.name, phase=phase)
+
     def _get_queue_manager(self, cfg):
         """
         Tries to get an event queue. 
@@ -130,43 +205,83 @@ class Framework(object):
         auth_code = cfg.queue_manager_auth_code
 
         self.logger.debug(f"Getting shared event queue from {hostname}:{portnr}")
-        queue = queues.get_event_queue(hostname, portnr, auth_code)
+        shards = cfg.queue_manager_shards or 1
+        queue = queues.get_event_queue(hostname, portnr, auth_code, shards)
         if queue is None:
             self.logger.debug("Starting Queue Manager")
-            self.queue_manager = queues.start_queue_manager(hostname, portnr, auth_code, self.logger)
-            queue = queues.get_event_queue(hostname, portnr, auth_code)
+            self.queue_manager = queues.start_queue_manager(
+                hostname, portnr, auth_code, self.logger, **queues.queue_manager_options(cfg)
+            )
+            queue = queues.get_event_queue(hostname, portnr, auth_code, shards)
             if queue is not None:
                 self.logger.debug("Got event queue from Queue Manager")
             return queue
         else:
             return queue
 
+    def _event_queue_file(self):
+        return queues.event_queue_file(self.config)
+
     def _get_event_queue(self):
         """
         If multiprocessing is desired then returns the shared queue,
-        otherwise returns the Simple_event_queue, which will only work within a single process.
+        otherwise returns the low priority level of a PriorityEventQueue, which will only work within a single process.
+        The high priority level of that queue is then used as event_queue_hi.
+        With the sqlite backend, returns a SqliteEventQueue, and event_queue_hi is a separate in-memory queue.
         """
         cfg = self.config
         want_multi = cfg.getValue("want_multiprocessing", False)
 
         if want_multi:
-            return self._get_queue_manager(cfg)
+            queue = self._get_queue_manager(cfg)
+            if queue is not None and cfg.shared_memory_min_bytes:
+                queue = queues.SharedArrayEventQueue(queue, cfg.shared_memory_min_bytes, cfg.event_max_attempts)
+            if queue is not None and cfg.event_prefetch:
+                queue = queues.BatchingQueueClient(queue, prefetch=cfg.event_prefetch, lease=cfg.event_prefetch_lease)
+            return queue
+
+        if cfg.event_queue_backend == "sqlite":
+            return queues.SqliteEventQueue(
+                self._event_queue_file(),
+                maxsize=cfg.event_queue_maxsize,
+                high_water=cfg.event_queue_high_water,
+                visibility_timeout=cfg.event_visibility_timeout,
+                max_attempts=cfg.event_max_attempts,
+            )
 
-        return queues.SimpleEventQueue()
+        self._local_queue = queues.PriorityEventQueue(
+            levels=2,
+            aging_time=cfg.event_queue_aging_time,
+            maxsize=[None, cfg.event_queue_maxsize],
+            high_water=[cfg.event_queue_hi_high_water, cfg.event_queue_high_water],
+        )
+        return self._local_queue.level(1)
 
     def get_event(self):
         """
         Retrieves and returns an event from the queues.
         First it checks the high priority queue, if fails then checks the regular event queue.
+        When both queues are local, they are levels of the same PriorityEventQueue,
+        and a new event in either of them ends the wait immediately.
+        With a shared event queue, a new high priority event waits until the wait on the shared queue times out.
+        While the high priority queue is over its high water mark, only high priority events are taken.
 
         If there are no more events, then it returns the no_event_event, which is defined in the configuration.
         """
         try:
+            if self._local_queue is not None:
+                if self.event_queue_hi.backpressure():
+                    return self.event_queue_hi.get(block=True, timeout=self.config.event_timeout)
+                ev = self._local_queue.get(block=True, timeout=self.config.event_timeout)
+                if ev.id in self.event_queue.get_in_progress():
+                    self.wait_for_event = False
+                return ev
             try:
                 return self.event_queue_hi.get(block=False)
             except:
                 ev = self.event_queue.get(block=True, timeout=self.config.event_timeout)
                 self.wait_for_event = False
+                self._track_shared_event(ev)
                 return ev
         except Exception as e:
             if self.wait_for_event:
@@ -178,24 +293,136 @@ class Framework(object):
             ev.args = Arguments(name=ev.name, time=datetime.datetime.ctime(datetime.datetime.now()))
             return ev
 
-    def _push_event(self, event_name, args):
+    def _track_shared_event(self, event):
+        """
+        Records an event taken from the shared event queue, so that its lease is renewed until it is completed.
+        """
+        with self._lock:
+            self._running_events[event.id] = event
+        attempts = getattr(event, "attempts", 0)
+        if attempts > 1:
+            self._events_retried.inc(event=event.name)
+            self.logger.warning(f"Event {event.name} taken again after an expired lease, attempt {attempts}")
+
+    def _heartbeat_loop(self, interval):
+        """
+        Renews the leases of the running events every interval seconds, while the main loop runs.
+        With a BatchingQueueClient, the buffered acknowledgements are sent at the same time,
+        also while no events are running, so that completed events are not re-queued when their leases expire.
+        """
+        eq = self.event_queue
+        while self.keep_going:
+            time.sleep(interval)
+            with self._lock:
+                running = dict(self._running_events)
+            try:
+                if not running:
+                    if isinstance(eq, queues.BatchingQueueClient):
+                        eq.flush()
+                    continue
+                lost = eq.renew(list(running), self._lease())
+            except Exception as e:
+                self.logger.warning(f"Failed to renew the leases of {len(running)} events, {e}")
+                continue
+            for event_id in lost:
+                ev = running.get(event_id)
+                name = ev.name if ev is not None else event_id
+                self.logger.warning(f"Lease of event {name} expired, it may run twice")
+
+    def _lease(self):
+        """
+        Returns the lease in seconds of the events taken from the shared event queue, or None.
+        Prefetched events are leased for config.event_prefetch_lease, see BatchingQueueClient,
+        the others for config.event_visibility_timeout.
+        """
+        eq = self.event_queue
+        if isinstance(eq, queues.BatchingQueueClient) and eq.prefetch:
+            return eq.lease
+        return self.config.event_visibility_timeout
+
+    def _start_heartbeat(self):
+        """
+        Starts the renewal of leases if the events of the shared event queue are leased, see _lease().
+        The interval is a third of the lease.
+        """
+        lease = self._lease()
+        if self._local_queue is not None or not lease:
+            return
+        if self._heartbeat_thread is not None and self._heartbeat_thread.is_alive():
+            return
+        self._heartbeat_thread = threading.Thread(name="heartbeat", target=self._heartbeat_loop, args=(lease / 3,))
+        self._heartbeat_thread.daemon = True
+        self._heartbeat_thread.start()
+
+    def _next_event(self):
+        """
+        Returns the next event to process or None, see get_event().
+
+        Events with the same partition key are processed one at a time and in order.
+        If the key of an event is already being processed, that event is set aside
+        until the events before it are completed. See _claim_event() and _release_event().
+        """
+        while True:
+            with self._lock:
+                if self._ready_events:
+                    return self._ready_events.popleft()
+            event = self.get_event()
+            if event is None or self._claim_event(event):
+                return event
+
+    def _claim_event(self, event):
+        """
+        Marks the partition key of the event as active.
+        Returns False if the key is already active, in that case the event is deferred.
+        """
+        key = event.key
+        if key is None:
+            return True
+        with self._lock:
+            if key in self._active_keys:
+                self._deferred_events.setdefault(key, deque()).append(event)
+                return False
+            self._active_keys.add(key)
+            return True
+
+    def _release_event(self, event):
+        """
+        Called when the event is completed.
+        The next deferred event with the same key, if any, is made ready. The key stays active for that event.
+        """
+        key = event.key
+        if key is None:
+            return
+        with self._lock:
+            deferred = self._deferred_events.get(key)
+            if deferred:
+                self._ready_events.append(deferred.popleft())
+                if not deferred:
+                    del self._deferred_events[key]
+            else:
+                self._active_keys.discard(key)
+
+    def _push_event(self, event_name, args, parent=None):
         """
         Pushes high priority events
 
         Normal events go to the lower priority queue
         This method is only used in execute.
+        The new event inherits the partition key of the parent event.
 
         """
         self.logger.debug(f"Push event {event_name}, {args.name}")
-        self.event_queue_hi.put(Event(event_name, args))
+        event = Event(event_name, args) if parent is None else parent.derive(event_name, args)
+        self.event_queue_hi.put(event)
 
-    def append_event(self, event_name, args, recurrent=False):
+    def append_event(self, event_name, args, recurrent=False, coalesce_key=None, debounce=0):
         """
         Appends low priority event to the end of the queue
+        See Event for coalesce_key and debounce.
         """
         if args is None:
             args = self.store_arguments
-        self.event_queue.put(Event(event_name, args, recurrent))
+        self.event_queue.put(Event(event_name, args, recurrent, coalesce_key=coalesce_key, debounce=debounce))
 
     def event_to_action(self, event, context):
         """
@@ -207,6 +434,10 @@ class Framework(object):
         The actual event_to_action method is defined in the pipeline and it depends on the incoming event and context.state.
 
         """
+        wait = (datetime.datetime.utcnow() - event._timestamp).total_seconds()
+        self._queue_wait.observe(wait, event=event.name)
+        if self.tracer is not None:
+            self.tracer.record_wait(event)
         event_info = self.pipeline.event_to_action(event, context)
         self.logger.debug(f"Event to action {event_info}")
         return Action(event, event_info, args=event.args)
@@ -216,63 +447,303 @@ class Framework(object):
         Executes one action
         The input for the action is in action.args.
         The action returns action_output and it is passed to the next event if action is successful.
+
+        Returns True if the action has been submitted to a thread or process pool.
+        In that case, the action is completed in _deferred_action_done() when the pool is done with it.
+
+        If profiling is enabled and the action is sampled, the execution is profiled.
+        Primitives running in the thread pool are profiled by BasePrimitive.apply().
+        Events created by the action continue the trace of its event.
+        If tracing is enabled, the execution is recorded as a span of that trace.
+        If memory accounting is enabled, the peak allocation and the RSS change are recorded,
+        unless the action has been submitted to a pool.
         """
+        tracker = self.memory_tracker
+        if tracker is None:
+            return self._traced_execute(action, context)
+        state = tracker.start()
+        submitted = False
+        try:
+            submitted = self._traced_execute(action, context)
+            return submitted
+        finally:
+            if not submitted:
+                tracker.stop(action, state)
+
+    def _traced_execute(self, action, context):
+        event = action.event
+        if self.tracer is not None:
+            arg_name = getattr(action.args, "name", None)
+            with self.tracer.span(action.name, event.trace_id, event=event.name, arg_name=arg_name):
+                return self._profiled_execute(action, context)
+        with use_trace(event.trace_id):
+            return self._profiled_execute(action, context)
+
+    def _profiled_execute(self, action, context):
+        profiler = self.profiler
+        if profiler is not None and profiler.sample(action.name):
+            action.profile = True
+            if self._runs_inline(action):
+                with profiler.profile(action.name):
+                    return self._execute(action, context)
+        return self._execute(action, context)
+
+    def _runs_inline(self, action):
+        try:
+            action_method = self.pipeline.get_action_methods(action.name)[1]
+            return self.executors.get_executor_name(action, action_method) == INLINE
+        except Exception:
+            # Reported by _execute()
+            return True
+
+    def _execute(self, action, context):
         pipeline = self.pipeline
         action_name = action.name
         try:
             # Pre condition
-            if pipeline.get_pre_action(action_name)(action, context):
+            pre_condition, action_method, post_condition = pipeline.get_action_methods(action_name)
+            start = time.perf_counter()
+            pre_ok = pre_condition(action, context)
+            self._observe(action, "pre", start)
+            if pre_ok:
                 if self.config.print_trace:
                     self.logger.debug("Executing action " + action.name)
 
-                # Run action
-                action_output = pipeline.get_action(action_name)(action, context)
-                action.output = action_output
-                if action_output is not None:
-                    self.store_arguments = action_output
+                # Run action, inline or in a pool
+                start = time.perf_counter()
+                future = self.executors.submit(action, action_method, context)
+                if future is not None:
+                    future.add_done_callback(lambda fut: self._deferred_action_done(fut, action, context, start))
+                    return True
+
+                action_output = action_method(action, context)
+                self._observe(action, "action", start)
+                self._post_action(action, context, action_output)
+            else:
+                # Failed pre-condition
+                if self.config.pre_condition_failed_stop:
+                    self._set_state(context, "stop")
                 else:
                     self.store_arguments = action.args
+        except Exception as e:
+            self._action_failed(action, context, e)
+        return False
 
-                # Post condition
-                if pipeline.get_post_action(action_name)(action, context):
-                    if not action.new_event is None:
-                        # Post new event
-                        new_args = self.store_arguments if action_output is None else action_output
-                        self._push_event(action.new_event, new_args)
+    def _post_action(self, action, context, action_output):
+        """
+        Stores the output of the action, checks the post condition, 
+        then pushes the next event and changes state.
+        """
+        new_args = self._set_output(action, action_output)
+        start = time.perf_counter()
+        post_ok = self.pipeline.get_action_methods(action.name)[2](action, context)
+        self._observe(action, "post", start)
+        self._continue_chain(action, context, new_args, post_ok)
 
-                    if not action.next_state is None:
-                        # New state
-                        context.state = action.next_state
+    def _set_output(self, action, action_output):
+        """
+        Stores the output of the action.
+        Returns the arguments for the next event.
+        """
+        action.output = action_output
+        # Kept local, store_arguments may be updated by other worker threads
+        new_args = action.args if action_output is None else action_output
+        self.store_arguments = new_args
+        return new_args
 
-                    if self.config.print_trace:
-                        self.logger.debug("Action " + action.name + " done")
-                    return
-                else:
-                    # Post-condition failed
-                    context.state = "stop"
+    def _continue_chain(self, action, context, new_args, post_ok):
+        """
+        Pushes the next event and changes state if the post condition was successful.
+        """
+        if post_ok:
+            if not action.new_event is None:
+                # Post new event
+                self._push_event(action.new_event, new_args, action.event)
+
+            if not action.next_state is None:
+                # New state
+                self._set_state(context, action.next_state)
+
+            if self.config.print_trace:
+                self.logger.debug("Action " + action.name + " done")
+        else:
+            # Post-condition failed
+            self._set_state(context, "stop")
+
+    def _action_failed(self, action, context, e):
+        """
+        Handles exceptions raised by pre-condition, action or post-condition.
+        """
+        if self.testing:
+            raise e  # reraise so that testing infrastructure catches it
+        else:
+            self.logger.error(f"Exception {e} while invoking {action.name}")
+            self._set_state(context, "stop")
+            self.on_error(action, context, e)
+            if self.config.print_trace:
+                traceback.print_exc()
+
+    def _deferred_action_done(self, future, action, context, start=None):
+        """
+        Called when a thread or process pool has finished running the action.
+        Does what the action loop does after execute() for inline actions.
+        The recorded action time includes the time spent waiting in the pool.
+        """
+        success = False
+        if start is not None:
+            self._observe(action, "action", start)
+        try:
+            try:
+                self._post_action(action, context, future.result())
+            except Exception as e:
+                self._action_failed(action, context, e)
+            success = action.output is not None
+            with self._lock:
+                self.on_state(action, context)
+                if context.state == "stop":
+                    self.keep_going = False
+        except Exception as e:
+            if self.testing:
+                # Re-raised by main_loop()
+                self._worker_exception = e
+                self.keep_going = False
             else:
-                # Failed pre-condition
-                if self.config.pre_condition_failed_stop:
-                    context.state = "stop"
+                self.logger.error(f"Framework: Exception while completing action {action}, {e}")
+        self._action_completed(success, action)
+
+    def _get_batch(self, event, action):
+        """
+        If the action is a primitive with batch_size > 1, takes more events with the same name
+        from the queue of the given event, waiting at most batch_wait seconds.
+        Returns the list of actions for these additional events, or None.
+        """
+        klass = getattr(self.pipeline.get_action_methods(action.name)[1], "primitive_class", None)
+        batch_size = getattr(klass, "batch_size", 1) or 1
+        if batch_size <= 1:
+            return None
+
+        # event_queue_hi is local, checking it first saves a round trip to a shared event queue
+        eq = self.event_queue_hi if event.id in self.event_queue_hi.get_in_progress() else self.event_queue
+        deadline = time.time() + (klass.batch_wait or 0)
+        events = []
+        while True:
+            for ev in eq.get_matching(event.name, batch_size - 1 - len(events)):
+                if self._local_queue is None and eq is self.event_queue:
+                    self._track_shared_event(ev)
+                # Events whose partition key is busy are deferred
+                if self._claim_event(ev):
+                    events.append(ev)
+            remaining = deadline - time.time()
+            if len(events) >= batch_size - 1 or remaining <= 0:
+                break
+            time.sleep(min(0.05, remaining))
+
+        actions = []
+        for ev in events:
+            try:
+                actions.append(self.event_to_action(ev, self.context))
+            except Exception as e:
+                self._drop_event(ev, e)
+                if self.testing:
+                    raise
+        return actions
+
+    def execute_batch(self, actions, context):
+        """
+        Executes a batch of actions with the same batch-capable primitive.
+        Pre- and post-conditions are checked for each action, the primitive's apply_batch()
+        is called once for all actions whose pre-condition is met.
+        Batches always run inline.
+        """
+        pre_condition, action_method, post_condition = self.pipeline.get_action_methods(actions[0].name)
+        ready = []
+        for action in actions:
+            try:
+                start = time.perf_counter()
+                pre_ok = pre_condition(action, context)
+                self._observe(action, "pre", start)
+                if pre_ok:
+                    ready.append(action)
+                elif self.config.pre_condition_failed_stop:
+                    self._set_state(context, "stop")
                 else:
                     self.store_arguments = action.args
+            except Exception as e:
+                self._action_failed(action, context, e)
+
+        if not ready:
+            return
+
+        if self.config.print_trace:
+            self.logger.debug(f"Executing action {ready[0].name}, batch of {len(ready)}")
+        try:
+            # One observation for the whole batch
+            start = time.perf_counter()
+            outputs = action_method.primitive_class.apply_batch(ready, context)
+            self._observe(ready[0], "action", start)
         except Exception as e:
-            if self.testing:
-                raise  # reraise so that testing infrastructure catches it
+            self._action_failed(ready[0], context, e)
+            return
+
+        for action, output in zip(ready, outputs):
+            try:
+                self._post_action(action, context, output)
+            except Exception as e:
+                self._action_failed(action, context, e)
+
+    def _run_batch(self, actions, context):
+        """
+        Runs a batch of actions, then does what the action loop does after execute() for each of them.
+        If memory accounting is enabled, the peak allocation and the RSS change of the whole batch
+        are recorded once, for the first action.
+        """
+        tracker = self.memory_tracker
+        state = tracker.start() if tracker is not None else None
+        try:
+            profiler = self.profiler
+            if profiler is not None and profiler.sample(actions[0].name):
+                with profiler.profile(actions[0].name):
+                    self._traced_batch(actions, context)
             else:
-                self.logger.error(f"Exception {e} while invoking {action_name}")
-                context.state = "stop"
-                self.on_error(action, context, e)
-                if self.config.print_trace:
-                    traceback.print_exc()
+                self._traced_batch(actions, context)
+        finally:
+            if tracker is not None:
+                tracker.stop(actions[0], state)
+        for action in actions:
+            success = action.output is not None
+            with self._lock:
+                self.on_state(action, context)
+                if context.state == "stop":
+                    self.keep_going = False
+            self._action_completed(success, action)
+
+    def _traced_batch(self, actions, context):
+        """
+        Runs execute_batch() in the trace of the first event, recorded as one span if tracing is enabled.
+        """
+        if self.tracer is None:
+            with use_trace(actions[0].event.trace_id):
+                return self.execute_batch(actions, context)
+        with self.tracer.span(actions[0].name, actions[0].event.trace_id, batch_size=len(actions)):
+            return self.execute_batch(actions, context)
+
+    def _set_state(self, context, state):
+        """
+        Changes context.state.
+        The lock keeps state transitions and on_state() of concurrent workers apart.
+        """
+        with self._lock:
+            context.state = state
 
     def _action_completed(self, successful, action):
         event = action.event
-        id = event.id
         try:
             argname = event.args.name
         except:
             argname = "Undef"
+        self._events_done.inc(action=action.name, status="completed" if successful else "failed")
+        if self.memory_tracker is not None:
+            self.memory_tracker.record_output(action, self.store_arguments)
         if successful:
             self.logger.info(
                 f"Event completed: name {event.name}, action {action.name}, arg name {argname}, recurr {event._recurrent}"
@@ -281,34 +752,100 @@ class Framework(object):
             self.logger.info(
                 f"Event failed: name {event.name}, action {action.name}, arg name {argname}, recurr {event._recurrent}"
             )
+        self._release_event(event)
+        self._discard_event(event, event._recurrent)
+
+    def _drop_event(self, event, e):
+        """
+        Called instead of _action_completed() when no action could be built for the event.
+        The event is released and discarded, a recurrent event is not queued again.
+        """
+        self.logger.error(f"Event dropped: name {event.name}, no action, {e}")
+        self._events_done.inc(action=event.name, status="failed")
+        self._release_event(event)
+        self._discard_event(event, False)
+
+    def _discard_event(self, event, recurrent):
+        """
+        Removes the event from in progress in the queue it was taken from.
+        If recurrent, the event is queued again, see _requeue_recurrent().
+        """
+        id = event.id
+        with self._lock:
+            self._running_events.pop(id, None)
         try:
-            if self.event_queue.get_in_progress().get(id):
-                self.event_queue.discard(id)
-                if event._recurrent:
-                    self.append_event(event.name, event.args, event._recurrent)
-            elif self.event_queue_hi.get_in_progress().get(id):
+            if self.event_queue_hi.get_in_progress().get(id):
                 self.event_queue_hi.discard(id)
+            elif self._local_queue is None or self.event_queue.get_in_progress().get(id):
+                # A shared event queue is not asked, saving a round trip, discarding an unknown id does nothing
+                if recurrent:
+                    self._requeue_recurrent(event)
+                else:
+                    self.event_queue.discard(id)
         except Exception as e:
             self.logger.error(f"Exception occured while in _action_completed, {e}")
 
-    def main_loop(self):
+    def _requeue_recurrent(self, event):
         """
-        This is the main action loop.
-
-        This method can be called directly to run in the main thread.
-        To run in a thread, use start_action_loop(). 
+        Queues a recurrent event again, then discards the completed one,
+        so that the event is never missing from both.
+        The queue may be full, waiting for space would block the worker that drains it:
+        the completed event is then re-appended, which is allowed beyond maxsize.
+        """
+        try:
+            self.event_queue.put(Event(event.name, event.args, event._recurrent), block=False)
+        except queue.Full:
+            self.logger.warning(f"Event queue full, re-appending recurrent event {event.name}")
+            self.event_queue.re_append(event.id)
+            return
+        self.event_queue.discard(event.id)
+
+    def _is_idle(self):
+        """
+        Returns True if there are no pending events and no events in progress.
+        Events stay in progress until _action_completed(), so this also accounts
+        for actions still running in other worker threads and for deferred events.
+        With a shared event queue, only the events taken by this process are counted, see _running_events.
+        The events in progress in other processes are counted only if they are leased, see _lease():
+        an event held by a process that died is then re-queued when its lease expires,
+        otherwise it would stay in progress for ever.
+        """
+        if self._ready_events:
+            return False
+        data_set = self.context.data_set
+        if data_set is not None and data_set.backlog:
+            return False
+        hi = self.event_queue_hi
+        if hi.qsize() > 0 or hi.in_progress_count() > 0:
+            return False
+        eq = self.event_queue
+        if eq.qsize() > 0:
+            return False
+        if self._local_queue is not None:
+            return eq.in_progress_count() == 0
+        with self._lock:
+            if self._running_events:
+                return False
+        if self._lease():
+            return eq.in_progress_count() == 0
+        return True
+
+    def _action_loop(self):
+        """
+        Takes events from the queues and executes the associated actions until keep_going is False.
+        There are config.worker_threads of these loops running concurrently, see main_loop().
         """
         success = False
-        self.keep_going = True
         while self.keep_going:
             try:
                 action = ""
                 success = False
-                event = self.get_event()
+                event = None
+                event = self._next_event()
                 if event is None:
                     self.logger.info("No new events - do nothing")
 
-                    if self.event_queue.qsize() == 0 and self.event_queue_hi.qsize() == 0:
+                    if self._is_idle():
                         self.logger.debug(f"No pending events or actions, terminating")
                         self.keep_going = False
                         if self.queue_manager is not None:
@@ -319,13 +856,25 @@ class Framework(object):
                     continue
 
                 action = self.event_to_action(event, self.context)
-                self.execute(action, self.context)
+                batch = self._get_batch(event, action)
+                if batch:
+                    # Completed by _run_batch()
+                    self._run_batch([action] + batch, self.context)
+                    continue
+                if self.execute(action, self.context):
+                    # Running in a pool, completed by _deferred_action_done()
+                    continue
                 success = action.output is not None
-                self.on_state(action, self.context)
-                if self.context.state == "stop":
+                with self._lock:
+                    self.on_state(action, self.context)
+                    must_stop = self.context.state == "stop"
+                if must_stop:
+                    self._action_completed(success, action)
+                    self.keep_going = False
                     break
             except BrokenPipeError as bpe:
                 self.logger.error(f"Failed to get retrieve events. Queue may be closed.")
+                self.keep_going = False
                 break
             except Exception as e:
                 if self.testing:
@@ -336,9 +885,55 @@ class Framework(object):
                     self.on_error(action, self.context, e)
                     if self.config.print_trace:
                         traceback.print_exc()
+                    if not action and event is not None:
+                        # No action was built for the event
+                        self._drop_event(event, e)
+                        continue
 
             self._action_completed(success, action)
 
+    def _worker_helper(self):
+        """
+        Target of the worker threads.
+        Exceptions raised in testing mode are kept and re-raised by main_loop().
+        """
+        try:
+            self._action_loop()
+        except Exception as e:
+            self._worker_exception = e
+            self.keep_going = False
+
+    def main_loop(self):
+        """
+        This is the main action loop.
+
+        This method can be called directly to run in the main thread.
+        To run in a thread, use start_action_loop(). 
+
+        If config.worker_threads is greater than 1, then this number of action loops
+        are started in separate threads, all taking events from the same queues.
+        This method returns when all of them have terminated.
+        """
+        self.keep_going = True
+        self._worker_exception = None
+        n_workers = self.config.worker_threads or 1
+        self._start_heartbeat()
+
+        if n_workers <= 1:
+            self._action_loop()
+        else:
+            threads = []
+            for i in range(n_workers):
+                thr = threading.Thread(name=f"action_loop_{i}", target=self._worker_helper)
+                thr.daemon = True
+                thr.start()
+                threads.append(thr)
+            for thr in threads:
+                thr.join()
+
+        if self._worker_exception is not None:
+            raise self._worker_exception
+
         self.keep_going = False
         self.logger.info("Exiting main loop")
 
@@ -379,7 +974,13 @@ class Framework(object):
         """
         Releases the event_queue.
         Needed when a client ingest_data and then quits.
+        Also shuts down the thread and process pools, stops the memory accounting and writes the profiles.
         """
+        self.executors.shutdown(wait=False)
+        if self.profiler is not None:
+            self.profiler.dump()
+        if self.memory_tracker is not None:
+            self.memory_tracker.close()
         try:
             self.event_queue.close()
         except:
@@ -392,8 +993,68 @@ class Framework(object):
         while self.keep_going:
             time.sleep(1)
 
-    def get_pending_events(self):
-        return self.event_queue.get_pending(), self.event_queue_hi.get_pending()
+    def get_pending_events(self, start=0, count=None):
+        """
+        Returns the pending events of the low and high priority queues, count events from position start.
+        """
+        return self.event_queue.get_pending(start, count), self.event_queue_hi.get_pending(start, count)
+
+    def get_queue_summary(self, start=0, count=100, max_len=200):
+        """
+        Returns the size, the counts by name and one page of descriptions of the pending events
+        of the low and high priority queues, see queues.describe_event().
+        Unlike get_pending_events(), the cost does not depend on the depth of the queues.
+        """
+        out = dict()
+        for name, q in (("event_queue", self.event_queue), ("event_queue_hi", self.event_queue_hi)):
+            out[name] = {
+                "size": q.qsize(),
+                "counts": q.get_counts(),
+                "pending": q.get_pending_summary(start, count, max_len),
+            }
+        return out
+
+    def _update_queue_metrics(self):
+        for name, q in (("event_queue", self.event_queue), ("event_queue_hi", self.event_queue_hi)):
+            try:
+                self._queue_depth.set(q.qsize(), queue=name)
+                self._queue_in_progress.set(q.in_progress_count(), queue=name)
+            except Exception as e:
+                self.logger.warning(f"Failed to get size of {name}, {e}")
+
+    def get_metrics(self):
+        """
+        Returns the metrics as a dictionary, see MetricsRegistry.snapshot().
+        The metrics include queue wait times, pre/action/post times by action,
+        counts of completed and failed events, and queue depths.
+        """
+        self._update_queue_metrics()
+        return self.metrics.snapshot()
+
+    def export_trace(self, filename=None, trace_id=None):
+        """
+        Returns the recorded spans in the Chrome trace event format, see Tracer.export_chrome_trace().
+        Returns None if tracing is not enabled.
+        """
+        if self.tracer is None:
+            return None
+        return self.tracer.export_chrome_trace(filename, trace_id)
+
+    def get_memory_stats(self):
+        """
+        Returns the memory used per action name, see MemoryTracker.get_stats().
+        Returns None if memory accounting is not enabled.
+        """
+        if self.memory_tracker is None:
+            return None
+        return self.memory_tracker.get_stats()
+
+    def get_metrics_text(self):
+        """
+        Returns the metrics in the Prometheus text format.
+        """
+        self._update_queue_metrics()
+        return self.metrics.to_prometheus()
 
     #
     # Methods to handle data set
@@ -413,8 +1074,7 @@ class Framework(object):
                 self.logger.info(f"ingest {files}")
                 ds.append_item(files)
             else:
-                for f in files:
-                    ds.append_item(f)
+                ds.append_items(files)
 
         # for ditem in ds.data_table.index:
         #    self.logger.info("File ingestion: pushing next file event to the queue")
@@ -423,6 +1083,9 @@ class Framework(object):
         self.context.data_set = ds
         if monitor:
             self.context.data_set.start_monitor()
+        elif ds.backlog:
+            # Ingestion was paused by a full event queue, finish in the background
+            self.context.data_set.start_monitor(backlog_only=True)
 
     def start(self, qm_only=False, ingest_data_only=False, wait_for_event=False, continuous=False):
         if qm_only:
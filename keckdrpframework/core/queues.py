@@ -2,9 +2,12 @@
 Created on Jul 8, 2019
 
 This module implements the event queue interface.
-In the first version, the queue is simply the Python queue.Queue.
+In the first version, the queue was simply the Python queue.Queue.
+Now the queue is a PriorityEventQueue, which can have several priority levels.
+Within a single process, the framework uses one PriorityEventQueue for both
+the high and the low priority events.
 
-Python Queue is thread safe, but limited to a single process.
+The queues are thread safe, but limited to a single process.
 
 The current implementation uses a Manager process, multiprocessing.Manager(), which allows sharing of objects over a network.
 The access is shared by using a proxy. A shared Queue() can be created as a proxy object.
@@ -17,102 +20,2295 @@ To start a group of processes on multiple hosts, the only requirements is that t
 queue manager server process is started first. The clients can use the same configuration file
 and run on same or different hosts. 
 
+Each call to the shared queue is a round trip to the queue manager.
+put_many(), get_many() and ack_many() handle many events in one call, and BatchingQueueClient
+buffers the calls of a client, so that ingesting or draining many events takes few round trips.
+
+SqliteEventQueue stores the queue in a SQLite file, so that pending events survive a restart
+of the queue manager. See config.event_queue_backend.
+
+When all the workers run on one host, SharedMemoryEventQueue is shared by processes forked from
+the process that creates it, without a queue manager: each call is a lock and a copy in shared memory
+instead of a round trip. The workers get it with Framework(..., event_queue=queue).
+
+With config.queue_manager_shards > 1, there are several queue managers on consecutive ports,
+and ShardedEventQueue spreads the events over them by key, so that no single manager serves all the workers.
+
 Possible alternatives:
 ------------
 Multiprocessing Queue from the module multiprocessing.Queue.
 This method is limited to run in a single host.
 
-Implementation using a database (ie. MySql), where a queue is a table in the database.
-Multiple processes can share the access to that queue even from different hosts.
+Implementation using a database (ie. MySql), where a queue is a table in the database.
+Multiple processes can share the access to that queue even from different hosts.
+
+Shared objects must be 'pickleable'.  
+
+@author: skwok
+"""
+
+import os
+import queue
+import time
+import copy
+import pickle
+import struct
+import sqlite3
+import zlib
+import threading
+import itertools
+import traceback
+from collections import Counter, deque
+from contextlib import contextmanager
+import multiprocessing
+from multiprocessing.managers import BaseManager
+from multiprocessing import Process, shared_memory
+
+from keckdrpframework.utils import shared_arrays
+
+
+def _per_level(value, levels):
+    """
+    Returns a list with one value per level, value is either one value or such a list.
+    """
+    if value is None or isinstance(value, (int, float)):
+        return [value] * levels
+    return list(value)
+
+
+def _count(counts, name, delta):
+    """
+    Adds delta to counts[name], and drops the names whose count is down to zero.
+    """
+    n = counts[name] + delta
+    if n > 0:
+        counts[name] = n
+    else:
+        counts.pop(name, None)
+
+
+def describe_event(event, max_len=200):
+    """
+    Returns a short description of an event as a dictionary,
+    with the arguments summarized in at most max_len characters, see Arguments.summary().
+    """
+    args = event.args
+    return {
+        "id": event.id,
+        "name": event.name,
+        "args": args.summary(max_len) if hasattr(args, "summary") else str(args)[:max_len],
+        "attempts": getattr(event, "attempts", 0),
+        "trace_id": getattr(event, "trace_id", None),
+    }
+
+
+class PriorityEventQueue:
+    """
+    Event queue with several priority levels. Level 0 is the highest priority.
+
+    get() returns the oldest event of the highest priority level that is not empty.
+    If aging_time is set, waiting events gain one level of priority per aging_time seconds,
+    so that events in low priority levels are not starved by a steady flow of high priority events.
+
+    A put() at any level wakes up immediately a consumer waiting in get().
+
+    The dictionary 'in_progress' contains events that have been taken from the queue and not yet discarded.
+    See SimpleEventQueue.
+
+    level(n) returns a view of the queue restricted to level n, with the interface of SimpleEventQueue.
+
+    Events with a coalesce_key are coalesced: if an event with the same key is still pending,
+    the new event is not queued, instead its arguments replace the arguments of the pending event,
+    which keeps its place in the queue.
+    Events with a debounce time are held back until no event with the same key has been put
+    for that many seconds. Then the last one is queued.
+
+    maxsize and high_water bound the queue. Both are numbers of pending events,
+    either one value for all levels or a list with one value per level. None or 0 means no limit.
+    When a level holds maxsize events, put() waits for space or raises queue.Full, like queue.Queue.put().
+    backpressure() signals that a level has reached high_water, and is cleared once that level
+    is down to half of high_water. Producers such as DataSet use it to pause ingestion.
+
+    With a visibility_timeout, in seconds, events taken from the queue are leased:
+    an event that is not discarded before its lease expires is re-queued, for instance when the worker
+    that took it has died. Workers extend the leases of their running events with renew().
+    Each event counts how many times it was taken, in event.attempts. With max_attempts,
+    an event whose lease expires after that many attempts is not re-queued but kept in get_failed().
+
+    For monitoring, get_counts() returns the number of events by name, counted as the events move,
+    peek() describes the head of the queue, and get_pending() and get_pending_summary() return one page
+    of the queue, so that looking at a deep queue does not copy it.
+    """
+
+    def __init__(
+        self, levels=2, aging_time=None, maxsize=None, high_water=None, visibility_timeout=None, max_attempts=None
+    ):
+        self.levels = levels
+        self.aging_time = aging_time
+        self.visibility_timeout = visibility_timeout
+        self.max_attempts = max_attempts
+        self.maxsize = _per_level(maxsize, levels)
+        self.high_water = _per_level(high_water, levels)
+        self._pressure = [False] * levels
+        # Entries are (put_time, event)
+        self._queues = [deque() for i in range(levels)]
+        self._in_progress_levels = [dict() for i in range(levels)]
+        self._lock = threading.RLock()
+        self._not_empty = threading.Condition(self._lock)
+        self._not_full = threading.Condition(self._lock)
+        # Pending events by coalesce_key, and debounced events as key: [deadline, level, event]
+        self._coalesced = dict()
+        self._debounced = dict()
+        # Leased events in progress as event_id: (deadline, level)
+        self._leases = dict()
+        # Events given up after max_attempts, as (level, event)
+        self._failed = []
+        # Number of pending and in progress events by name, per level
+        self._pending_names = [Counter() for i in range(levels)]
+        self._in_progress_names = [Counter() for i in range(levels)]
+
+    def level(self, priority):
+        """
+        Returns a view of this queue for the given priority level.
+        """
+        return EventQueueLevel(self, priority)
+
+    def _select_level(self):
+        """
+        Returns the level of the next event, taking aging into account, or None if the queue is empty.
+        Must be called with the lock held.
+        """
+        self._flush_timers()
+        best, best_prio = None, None
+        now = time.time()
+        for level, q in enumerate(self._queues):
+            if not q:
+                continue
+            prio = level
+            if self.aging_time:
+                prio -= (now - q[0][0]) / self.aging_time
+            if best is None or prio < best_prio:
+                best, best_prio = level, prio
+        return best
+
+    def _ready_level(self, levels):
+        """
+        Returns the level of the next event among the given levels, None for all levels,
+        or None if these levels are empty.
+        Must be called with the lock held.
+        """
+        if levels is None:
+            return self._select_level()
+        self._flush_timers()
+        for level in levels:
+            if self._queues[level]:
+                return level
+        return None
+
+    def _wait_level(self, levels, block, timeout):
+        """
+        Waits until one of the given levels has an event, then returns that level.
+        levels is None for all levels.
+        Raises queue.Empty, like queue.Queue.get().
+        Must be called with the lock held.
+        """
+        level = self._ready_level(levels)
+        if level is not None or not block:
+            if level is None:
+                raise queue.Empty
+            return level
+
+        if timeout is None:
+            while level is None:
+                self._not_empty.wait(self._timer_wait(None))
+                level = self._ready_level(levels)
+            return level
+
+        if timeout < 0:
+            raise ValueError("'timeout' must be a non-negative number")
+        endtime = time.time() + timeout
+        while level is None:
+            remaining = endtime - time.time()
+            if remaining <= 0.0:
+                raise queue.Empty
+            self._not_empty.wait(self._timer_wait(remaining))
+            level = self._ready_level(levels)
+        return level
+
+    def put(self, value, priority=None, block=True, timeout=None):
+        """
+        Appends the event to the given priority level, default is the lowest priority.
+        If the level is full, see maxsize, block and timeout are as for queue.Queue.put().
+        """
+        if priority is None:
+            priority = self.levels - 1
+        key = getattr(value, "coalesce_key", None)
+        with self._lock:
+            if key is not None:
+                debounce = getattr(value, "debounce", 0)
+                pending = self._debounced.get(key)
+                if pending is not None:
+                    # Newer event replaces the held back one and restarts the delay
+                    pending[0] = time.time() + debounce
+                    if pending[2].name != value.name:
+                        _count(self._pending_names[pending[1]], pending[2].name, -1)
+                        _count(self._pending_names[pending[1]], value.name, 1)
+                    pending[2] = value
+                    return
+                pending = self._coalesced.get(key)
+                if pending is not None:
+                    pending.args = value.args
+                    return
+                self._wait_not_full(priority, block, timeout)
+                if debounce:
+                    self._debounced[key] = [time.time() + debounce, priority, value]
+                    _count(self._pending_names[priority], value.name, 1)
+                    self._not_empty.notify_all()
+                    return
+                self._coalesced[key] = value
+            else:
+                self._wait_not_full(priority, block, timeout)
+
+            self._queues[priority].append((time.time(), value))
+            _count(self._pending_names[priority], value.name, 1)
+            # All waiters, some may be waiting in wait_for_event() and not take the event
+            self._not_empty.notify_all()
+
+    def put_many(self, values, priority=None, block=True, timeout=None):
+        """
+        Appends the events as put(), in a single call.
+        With a shared queue, this is one round trip to the queue manager instead of one per event.
+        Returns the number of events.
+        """
+        values = list(values)
+        with self._lock:
+            for value in values:
+                self.put(value, priority, block, timeout)
+        return len(values)
+
+    def _level_size(self, level):
+        """
+        Returns the number of pending events at the given level, including debounced events.
+        Must be called with the lock held.
+        """
+        held = sum(1 for d in self._debounced.values() if d[1] == level) if self._debounced else 0
+        return len(self._queues[level]) + held
+
+    def _wait_not_full(self, level, block, timeout):
+        """
+        Waits until there is space at the given level.
+        Raises queue.Full, like queue.Queue.put().
+        Must be called with the lock held.
+        """
+        maxsize = self.maxsize[level]
+        if not maxsize:
+            return
+        endtime = None if timeout is None else time.time() + timeout
+        while self._level_size(level) >= maxsize:
+            if not block:
+                raise queue.Full
+            remaining = None if endtime is None else endtime - time.time()
+            if remaining is not None and remaining <= 0:
+                raise queue.Full
+            self._not_full.wait(remaining)
+
+    def backpressure(self, priority=None):
+        """
+        Returns True if the given level, or any level if priority is None, is over its high water mark.
+        The signal stays on until the level is down to half of the high water mark.
+        """
+        with self._lock:
+            self._flush_timers()
+            out = False
+            for level in range(self.levels) if priority is None else (priority,):
+                high_water = self.high_water[level]
+                if not high_water:
+                    continue
+                size = self._level_size(level)
+                if size >= high_water:
+                    self._pressure[level] = True
+                elif size <= high_water // 2:
+                    self._pressure[level] = False
+                out = out or self._pressure[level]
+            return out
+
+    def _flush_timers(self):
+        """
+        Queues the debounced events whose delay has expired,
+        and re-queues the events in progress whose lease has expired.
+        Must be called with the lock held.
+        """
+        if self._leases:
+            self._expire_leases()
+        if not self._debounced:
+            return
+        now = time.time()
+        for key, (deadline, priority, event) in list(self._debounced.items()):
+            if deadline <= now:
+                del self._debounced[key]
+                self._coalesced[key] = event
+                self._queues[priority].append((now, event))
+
+    def _timer_wait(self, timeout):
+        """
+        Returns how long to wait, at most timeout, so that debounced events and expired leases are queued on time.
+        """
+        if not self._debounced and not self._leases:
+            return timeout
+        deadlines = [d[0] for d in self._debounced.values()] + [d for d, level in self._leases.values()]
+        wait = max(0, min(deadlines) - time.time())
+        return wait if timeout is None else min(wait, timeout)
+
+    def _expire_leases(self):
+        """
+        Re-queues the events whose lease has expired, at the head of their level.
+        Must be called with the lock held.
+        """
+        now = time.time()
+        expired = [[] for i in range(self.levels)]
+        for event_id, (deadline, level) in list(self._leases.items()):
+            if deadline > now:
+                continue
+            del self._leases[event_id]
+            ev = self._in_progress_levels[level].pop(event_id, None)
+            if ev is None:
+                continue
+            _count(self._in_progress_names[level], ev.name, -1)
+            if self.max_attempts and getattr(ev, "attempts", 0) >= self.max_attempts:
+                self._failed.append((level, ev))
+            else:
+                expired[level].append((now, ev))
+                _count(self._pending_names[level], ev.name, 1)
+        for level, entries in enumerate(expired):
+            if entries:
+                # Keeps the order in which the events were taken
+                self._queues[level].extendleft(reversed(entries))
+                self._not_empty.notify_all()
+
+    def _taken(self, level, event, lease=None):
+        """
+        Moves an event taken from the queue to in_progress and counts the attempt.
+        With a lease, in seconds, default visibility_timeout, the event is re-queued if it is not discarded in time.
+        Must be called with the lock held.
+        """
+        event.attempts = getattr(event, "attempts", 0) + 1
+        self._in_progress_levels[level][event.id] = event
+        _count(self._pending_names[level], event.name, -1)
+        _count(self._in_progress_names[level], event.name, 1)
+        if lease is None:
+            lease = self.visibility_timeout
+        if lease is not None:
+            self._leases[event.id] = (time.time() + lease, level)
+        if self.maxsize[level]:
+            self._not_full.notify_all()
+        key = getattr(event, "coalesce_key", None)
+        if key is not None and self._coalesced.get(key) is event:
+            del self._coalesced[key]
+
+    def _get(self, levels, block, timeout):
+        with self._lock:
+            level = self._wait_level(levels, block, timeout)
+            put_time, event = self._queues[level].popleft()
+            self._taken(level, event)
+            return event
+
+    def get(self, block=True, timeout=0):
+        """
+        Returns the next event, see queue.Queue.get() for block and timeout.
+        """
+        return self._get(None, block, timeout)
+
+    def _get_many(self, levels, max_n, block, timeout, lease=None):
+        with self._lock:
+            out = []
+            if max_n <= 0:
+                return out
+            try:
+                level = self._wait_level(levels, block, timeout)
+            except queue.Empty:
+                return out
+            while level is not None and len(out) < max_n:
+                put_time, event = self._queues[level].popleft()
+                self._taken(level, event, lease)
+                out.append(event)
+                level = self._ready_level(levels)
+            return out
+
+    def get_many(self, max_n, block=True, timeout=0, lease=None):
+        """
+        Takes up to max_n events in priority order, waiting for the first one as get().
+        Returns an empty list instead of raising queue.Empty.
+        The events are added to in_progress.
+        With a lease, in seconds, events that are not discarded within the lease are re-queued.
+        """
+        return self._get_many(None, max_n, block, timeout, lease)
+
+    def _get_matching(self, levels, name, max_n):
+        with self._lock:
+            out = []
+            for level in range(self.levels) if levels is None else levels:
+                q = self._queues[level]
+                if len(out) >= max_n or not q:
+                    continue
+                keep = deque()
+                for entry in q:
+                    event = entry[1]
+                    if len(out) < max_n and event.name == name:
+                        self._taken(level, event)
+                        out.append(event)
+                    else:
+                        keep.append(entry)
+                self._queues[level] = keep
+            return out
+
+    def get_matching(self, name, max_n):
+        """
+        Takes up to max_n events with the given name out of the queue, without waiting.
+        Used to collect batches of events. The events are added to in_progress.
+        """
+        return self._get_matching(None, name, max_n)
+
+    def wait_for_event(self, timeout=None):
+        """
+        Waits until the queue is not empty, at most timeout seconds.
+        Returns True if there are events in the queue.
+        """
+        with self._lock:
+            endtime = None if timeout is None else time.time() + timeout
+            while self._select_level() is None:
+                remaining = None if endtime is None else endtime - time.time()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._not_empty.wait(self._timer_wait(remaining))
+            return True
+
+    def head(self):
+        """
+        Returns the head of the queue.
+        """
+        with self._lock:
+            level = self._select_level()
+            if level is None:
+                return None
+            return self._queues[level][0][1]
+
+    def peek(self, max_len=200):
+        """
+        Returns the description of the head of the queue, see describe_event(), or None.
+        Unlike head(), the event and its arguments are not copied to the caller.
+        """
+        event = self.head()
+        return None if event is None else describe_event(event, max_len)
+
+    def qsize(self):
+        """
+        Returns the number of pending events, including debounced events not yet queued.
+        """
+        with self._lock:
+            self._flush_timers()
+            return sum(len(q) for q in self._queues) + len(self._debounced)
+
+    def terminate(self):
+        os._exit(0)
+
+    def discard(self, event_id):
+        """
+        Rmmoves event from in_progress list.
+        """
+        with self._lock:
+            self._leases.pop(event_id, None)
+            for level in range(self.levels):
+                ev = self._pop_in_progress(level, event_id)
+                if ev is not None:
+                    return ev
+        return None
+
+    def _pop_in_progress(self, level, event_id):
+        """
+        Removes the event from in_progress at the given level and returns it, or None.
+        Must be called with the lock held.
+        """
+        ev = self._in_progress_levels[level].pop(event_id, None)
+        if ev is not None:
+            self._leases.pop(event_id, None)
+            _count(self._in_progress_names[level], ev.name, -1)
+        return ev
+
+    def ack_many(self, event_ids):
+        """
+        Discards the events with the given ids from in_progress, in a single call.
+        Returns the number of events discarded.
+        """
+        with self._lock:
+            return sum(1 for event_id in event_ids if self.discard(event_id) is not None)
+
+    def renew(self, event_ids, lease=None):
+        """
+        Extends the leases of the given events in progress, by lease seconds, default visibility_timeout, from now.
+        Returns the ids of the events that are no longer in progress, because their lease has expired.
+        """
+        with self._lock:
+            if self._leases:
+                self._expire_leases()
+            if lease is None:
+                lease = self.visibility_timeout
+            now = time.time()
+            lost = []
+            for event_id in event_ids:
+                held = self._leases.get(event_id)
+                if held is not None:
+                    if lease is not None:
+                        self._leases[event_id] = (now + lease, held[1])
+                elif not any(event_id in in_progress for in_progress in self._in_progress_levels):
+                    lost.append(event_id)
+            return lost
+
+    def get_failed(self):
+        """
+        Returns a copy of the list of events given up after max_attempts.
+        """
+        with self._lock:
+            if self._leases:
+                self._expire_leases()
+            return [ev for level, ev in self._failed]
+
+    def exchange(self, values=(), event_ids=(), max_n=0, block=True, timeout=0, priority=None, lease=None):
+        """
+        put_many(values), ack_many(event_ids) and get_many(max_n) in a single call.
+        This is one round trip to a shared queue, see BatchingQueueClient.
+        Returns the events taken.
+        """
+        if values:
+            self.put_many(values, priority)
+        if event_ids:
+            self.ack_many(event_ids)
+        return self.get_many(max_n, block, timeout, lease)
+
+    def re_append(self, event_id):
+        """
+        Re-appends event to the event_queue, at its original priority level.
+        The event was already accepted, so it is re-appended even if the level is full.
+        """
+        with self._lock:
+            self._leases.pop(event_id, None)
+            for level in range(self.levels):
+                ev = self._pop_in_progress(level, event_id)
+                if ev is not None:
+                    self._re_append(ev, level)
+                    return ev
+        return None
+
+    def _re_append(self, event, level):
+        self._queues[level].append((time.time(), event))
+        _count(self._pending_names[level], event.name, 1)
+        self._not_empty.notify_all()
+
+    def _iter_pending(self, levels):
+        """
+        Iterates over the pending events of the given levels, highest priority first, then the debounced events.
+        Must be called with the lock held.
+        """
+        queued = (ev for level in levels for put_time, ev in self._queues[level])
+        held = (d[2] for d in self._debounced.values() if d[1] in levels)
+        return itertools.chain(queued, held)
+
+    def _page(self, events, start, count):
+        return list(itertools.islice(events, start, None if count is None else start + count))
+
+    def get_pending(self, start=0, count=None):
+        """
+        Returns a copy of the queue's content, highest priority first, then the debounced events.
+        With start and count, returns only count events from position start.
+        """
+        with self._lock:
+            self._flush_timers()
+            return self._page(self._iter_pending(range(self.levels)), start, count)
+
+    def get_pending_summary(self, start=0, count=100, max_len=200):
+        """
+        Returns the descriptions of count pending events from position start, see describe_event().
+        """
+        with self._lock:
+            return [describe_event(ev, max_len) for ev in self.get_pending(start, count)]
+
+    def get_in_progress_summary(self, start=0, count=100, max_len=200):
+        """
+        Returns the descriptions of count events in progress from position start, see describe_event().
+        """
+        with self._lock:
+            if self._leases:
+                self._expire_leases()
+            events = (ev for in_progress in self._in_progress_levels for ev in in_progress.values())
+            return [describe_event(ev, max_len) for ev in self._page(events, start, count)]
+
+    def _counts(self, levels):
+        pending, in_progress = Counter(), Counter()
+        for level in levels:
+            pending.update(self._pending_names[level])
+            in_progress.update(self._in_progress_names[level])
+        return {"pending": dict(pending), "in_progress": dict(in_progress)}
+
+    def get_counts(self):
+        """
+        Returns the number of pending events and of events in progress by name,
+        as {"pending": {name: n}, "in_progress": {name: n}}.
+        The counts are kept up to date as events move, this does not go through the queue.
+        """
+        with self._lock:
+            self._flush_timers()
+            return self._counts(range(self.levels))
+
+    def get_in_progress(self):
+        """
+        Returns the in_progress dict.
+        With several levels, this is a copy that merges all levels.
+        """
+        if self._leases:
+            with self._lock:
+                self._expire_leases()
+        if self.levels == 1:
+            return self._in_progress_levels[0]
+        with self._lock:
+            out = dict()
+            for in_progress in self._in_progress_levels:
+                out.update(in_progress)
+            return out
+
+    def in_progress_count(self):
+        """
+        Returns the number of events in progress, without copying them.
+        """
+        with self._lock:
+            if self._leases:
+                self._expire_leases()
+            return sum(len(in_progress) for in_progress in self._in_progress_levels)
+
+
+class EventQueueLevel:
+    """
+    One priority level of a PriorityEventQueue.
+    Has the same interface as SimpleEventQueue.
+    """
+
+    def __init__(self, parent, priority):
+        self.parent = parent
+        self.priority = priority
+
+    def put(self, value, block=True, timeout=None):
+        self.parent.put(value, self.priority, block, timeout)
+
+    def put_many(self, values, block=True, timeout=None):
+        return self.parent.put_many(values, self.priority, block, timeout)
+
+    def backpressure(self):
+        return self.parent.backpressure(self.priority)
+
+    def get(self, block=True, timeout=0):
+        return self.parent._get((self.priority,), block, timeout)
+
+    def get_many(self, max_n, block=True, timeout=0, lease=None):
+        return self.parent._get_many((self.priority,), max_n, block, timeout, lease)
+
+    def get_matching(self, name, max_n):
+        return self.parent._get_matching((self.priority,), name, max_n)
+
+    def wait_for_event(self, timeout=None):
+        """
+        Waits for events at any level of the parent queue.
+        """
+        return self.parent.wait_for_event(timeout)
+
+    def head(self):
+        with self.parent._lock:
+            q = self.parent._queues[self.priority]
+            return q[0][1] if q else None
+
+    def peek(self, max_len=200):
+        event = self.head()
+        return None if event is None else describe_event(event, max_len)
+
+    def qsize(self):
+        parent = self.parent
+        with parent._lock:
+            parent._flush_timers()
+            return parent._level_size(self.priority)
+
+    def terminate(self):
+        self.parent.terminate()
+
+    def discard(self, event_id):
+        with self.parent._lock:
+            return self.parent._pop_in_progress(self.priority, event_id)
+
+    def ack_many(self, event_ids):
+        with self.parent._lock:
+            return sum(1 for event_id in event_ids if self.discard(event_id) is not None)
+
+    def renew(self, event_ids, lease=None):
+        return self.parent.renew(event_ids, lease)
+
+    def get_failed(self):
+        parent = self.parent
+        with parent._lock:
+            if parent._leases:
+                parent._expire_leases()
+            return [ev for level, ev in parent._failed if level == self.priority]
+
+    def exchange(self, values=(), event_ids=(), max_n=0, block=True, timeout=0, lease=None):
+        if values:
+            self.put_many(values)
+        if event_ids:
+            self.ack_many(event_ids)
+        return self.get_many(max_n, block, timeout, lease)
+
+    def re_append(self, event_id):
+        with self.parent._lock:
+            ev = self.discard(event_id)
+            if ev is not None:
+                self.parent._re_append(ev, self.priority)
+            return ev
+
+    def get_pending(self, start=0, count=None):
+        parent = self.parent
+        with parent._lock:
+            parent._flush_timers()
+            return parent._page(parent._iter_pending((self.priority,)), start, count)
+
+    def get_pending_summary(self, start=0, count=100, max_len=200):
+        with self.parent._lock:
+            return [describe_event(ev, max_len) for ev in self.get_pending(start, count)]
+
+    def get_in_progress(self):
+        return self.parent._in_progress_levels[self.priority]
+
+    def in_progress_count(self):
+        parent = self.parent
+        with parent._lock:
+            if parent._leases:
+                parent._expire_leases()
+            return len(parent._in_progress_levels[self.priority])
+
+    def get_in_progress_summary(self, start=0, count=100, max_len=200):
+        parent = self.parent
+        with parent._lock:
+            if parent._leases:
+                parent._expire_leases()
+            events = parent._in_progress_levels[self.priority].values()
+            return [describe_event(ev, max_len) for ev in parent._page(iter(events), start, count)]
+
+    def get_counts(self):
+        parent = self.parent
+        with parent._lock:
+            parent._flush_timers()
+            return parent._counts((self.priority,))
+
+
+class SimpleEventQueue(PriorityEventQueue):
+    """
+    This class represents the event queue in in both single process and multi-processing modes.
+    
+    The event queue is a FIFO queue, a PriorityEventQueue with one level.
+    The framework code takes events from this queue and calls the associated action.
+
+    The dictionary 'in_progress' contains events that are in progress.
+    When an event is taken from the event queue, that event is added to in_progress.
+    If the event is handled successfully, the event is removed from in_progress,
+    unless it is a recurrent event. In that case, the event is re-inserted to the queue.
+
+    Otherwise, if there is an error, the event can be re-inserted into the event queue,
+    or discarded, depending on the event handler.
+
+    This is instantiated when the proxy server is started.
+    Clients/consumers should call get_queue() to get the proxy of the queue.
+    """
+
+    def __init__(self, maxsize=None, high_water=None, visibility_timeout=None, max_attempts=None):
+        PriorityEventQueue.__init__(
+            self,
+            levels=1,
+            maxsize=maxsize,
+            high_water=high_water,
+            visibility_timeout=visibility_timeout,
+            max_attempts=max_attempts,
+        )
+
+
+class SharedArrayEventQueue:
+    """
+    Wraps a shared event queue, so that large arrays in the arguments of events
+    are passed in shared memory, see utils/shared_arrays.py.
+
+    put() moves the arrays of at least min_bytes into shared memory segments.
+    get() maps the segments. The segments are unlinked on the final ack of the event:
+    when it is discarded while still in progress, so that it cannot be taken again,
+    or when it was taken max_attempts times. The workers that mapped the segments keep their arrays.
+    An event whose lease has expired is queued again with the same segments,
+    so the late discard of the worker that took it only closes them. So does re_append().
+    The events with segments are acknowledged one by one, to know which ones were still in progress.
+    All other methods are those of the wrapped queue.
+    """
+
+    def __init__(self, queue, min_bytes, max_attempts=None):
+        self.queue = queue
+        self.min_bytes = min_bytes
+        self.max_attempts = max_attempts
+        self.segments = shared_arrays.SharedSegments()
+        # Event id: names of the segments attached for that event, attempts of the event
+        self._attached = dict()
+
+    def __getattr__(self, name):
+        if name == "queue":
+            raise AttributeError(name)
+        return getattr(self.queue, name)
+
+    def put(self, value, *args, **kwargs):
+        event, names = shared_arrays.export_event(value, self.min_bytes)
+        try:
+            self.queue.put(event, *args, **kwargs)
+        except Exception:
+            shared_arrays.unlink(names)
+            raise
+
+    def _import(self, event):
+        names = self.segments.import_event(event)
+        if names:
+            self._attached[event.id] = (names, getattr(event, "attempts", 0) or 0)
+        return event
+
+    def _export_many(self, values):
+        events, names = [], []
+        for value in values:
+            event, event_names = shared_arrays.export_event(value, self.min_bytes)
+            events.append(event)
+            names.extend(event_names)
+        return events, names
+
+    def put_many(self, values, *args, **kwargs):
+        events, names = self._export_many(values)
+        try:
+            return self.queue.put_many(events, *args, **kwargs)
+        except Exception:
+            shared_arrays.unlink(names)
+            raise
+
+    def get(self, *args, **kwargs):
+        return self._import(self.queue.get(*args, **kwargs))
+
+    def get_many(self, max_n, *args, **kwargs):
+        return [self._import(ev) for ev in self.queue.get_many(max_n, *args, **kwargs)]
+
+    def get_matching(self, name, max_n):
+        return [self._import(ev) for ev in self.queue.get_matching(name, max_n)]
+
+    def _release(self, event_id, acked):
+        """
+        Closes the segments of the event, unlinks them if this is the final ack of the event.
+        """
+        entry = self._attached.pop(event_id, None)
+        if entry:
+            names, attempts = entry
+            final = acked or (self.max_attempts and attempts >= self.max_attempts)
+            self.segments.release(names, unlink=bool(final))
+
+    def discard(self, event_id):
+        ev = self.queue.discard(event_id)
+        self._release(event_id, ev is not None)
+        return ev
+
+    def _ack_attached(self, event_ids):
+        """
+        Discards the events with segments one by one.
+        Returns the number of events discarded and the ids of the other events.
+        """
+        n = sum(1 for event_id in event_ids if event_id in self._attached and self.discard(event_id) is not None)
+        return n, [event_id for event_id in event_ids if event_id not in self._attached]
+
+    def ack_many(self, event_ids):
+        n, event_ids = self._ack_attached(list(event_ids))
+        return n + self.queue.ack_many(event_ids) if event_ids else n
+
+    def exchange(self, values=(), event_ids=(), max_n=0, *args, **kwargs):
+        events, names = self._export_many(values)
+        _, event_ids = self._ack_attached(list(event_ids))
+        try:
+            out = self.queue.exchange(events, event_ids, max_n, *args, **kwargs)
+        except Exception:
+            shared_arrays.unlink(names)
+            raise
+        return [self._import(ev) for ev in out]
+
+    def re_append(self, event_id):
+        ev = self.queue.re_append(event_id)
+        self._release(event_id, False)
+        return ev
+
+
+class SqliteEventQueue:
+    """
+    Event queue stored in a SQLite database file, with the interface of SimpleEventQueue.
+
+    The pending and in progress events survive a restart of the process that holds the queue,
+    for instance the queue manager. The database is in WAL mode, so that other processes,
+    such as tools/event_queue_info.py, can read it while the queue is in use.
+
+    Each event is a row with its priority, name, state and lease, the event itself is pickled.
+    put_many() inserts all the events in one transaction.
+    get() takes the next event and leases it in one transaction, see visibility_timeout in PriorityEventQueue.
+    Coalescing, debouncing, maxsize and high_water are as in PriorityEventQueue.
+
+    Events in progress without a lease when the database is opened are pending again,
+    the process that took them is gone with the previous queue.
+
+    Only put() and the calls that take or release events write to the database.
+    The other calls are plain reads, which do not block the writers in WAL mode,
+    and expired leases are only looked for once the earliest lease has passed.
+    """
+
+    PENDING, IN_PROGRESS, FAILED = 0, 1, 2
+
+    # Polling interval in seconds of get() while waiting, for events put by other processes.
+    # It is doubled after each empty poll, up to max_poll_interval.
+    poll_interval = 0.1
+    max_poll_interval = 1.0
+
+    def __init__(
+        self, filename, levels=1, maxsize=None, high_water=None, visibility_timeout=None, max_attempts=None
+    ):
+        self.filename = filename
+        self.levels = levels
+        self.maxsize = _per_level(maxsize, levels)
+        self.high_water = _per_level(high_water, levels)
+        self.visibility_timeout = visibility_timeout
+        self.max_attempts = max_attempts
+        self._pressure = [False] * levels
+        self._lock = threading.RLock()
+        self._changed = threading.Condition(self._lock)
+
+        dirname = os.path.dirname(filename)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+        self._db = sqlite3.connect(filename, timeout=30, isolation_level=None, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        with self._transaction() as db:
+            db.execute(
+                """CREATE TABLE IF NOT EXISTS events (
+                    seq INTEGER PRIMARY KEY,
+                    id TEXT NOT NULL UNIQUE,
+                    name TEXT,
+                    priority INTEGER NOT NULL,
+                    state INTEGER NOT NULL,
+                    available REAL NOT NULL,
+                    lease REAL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    coalesce_key TEXT,
+                    event BLOB NOT NULL)"""
+            )
+            db.execute("CREATE INDEX IF NOT EXISTS events_priority ON events (state, priority, seq)")
+            db.execute("CREATE INDEX IF NOT EXISTS events_name ON events (state, name, seq)")
+            db.execute("CREATE INDEX IF NOT EXISTS events_lease ON events (state, lease)")
+            db.execute(
+                "CREATE INDEX IF NOT EXISTS events_coalesce ON events (coalesce_key) WHERE coalesce_key IS NOT NULL"
+            )
+            db.execute(
+                "UPDATE events SET state = ? WHERE state = ? AND lease IS NULL", (self.PENDING, self.IN_PROGRESS)
+            )
+            self._next_expiry = self._min_lease(db)
+
+    @contextmanager
+    def _transaction(self):
+        """
+        Runs the enclosed statements in one transaction, holding the lock.
+        """
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._db
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+            self._db.execute("COMMIT")
+
+    def _load(self, blob, attempts=None):
+        event = pickle.loads(blob)
+        if attempts is not None:
+            event.attempts = attempts
+        return event
+
+    def _min_lease(self, db):
+        sql = "SELECT MIN(lease) FROM events WHERE state = ?"
+        return db.execute(sql, (self.IN_PROGRESS,)).fetchone()[0]
+
+    def _expire_leases(self, db, now):
+        """
+        Makes the events whose lease has expired pending again, or failed after max_attempts.
+        """
+        if self.max_attempts:
+            db.execute(
+                "UPDATE events SET state = ?, lease = NULL WHERE state = ? AND lease <= ? AND attempts >= ?",
+                (self.FAILED, self.IN_PROGRESS, now, self.max_attempts),
+            )
+        db.execute(
+            "UPDATE events SET state = ?, lease = NULL WHERE state = ? AND lease <= ?",
+            (self.PENDING, self.IN_PROGRESS, now),
+        )
+        self._next_expiry = self._min_lease(db)
+
+    def _expiry_due(self, now):
+        """
+        Returns True if the earliest lease has passed. Renewed or released leases keep _next_expiry
+        earlier than needed, which only costs an extra look at the leases.
+        """
+        return self._next_expiry is not None and self._next_expiry <= now
+
+    def _expire_due_leases(self, now):
+        """
+        Expires the leases in a write transaction, only if the earliest lease has passed.
+        """
+        with self._lock:
+            if self._expiry_due(now):
+                with self._transaction() as db:
+                    self._expire_leases(db, now)
+
+    def _wait_time(self, delay, remaining):
+        """
+        Returns how long to wait for new events: delay, but not past the timeout,
+        the end of a debounce delay or the earliest lease.
+        """
+        now = time.time()
+        sql = "SELECT MIN(available) FROM events WHERE state = ? AND available > ?"
+        for t in (self._db.execute(sql, (self.PENDING, now)).fetchone()[0], self._next_expiry):
+            if t is not None:
+                delay = min(delay, max(t - now, 0))
+        return delay if remaining is None else min(delay, remaining)
+
+    def _level_size(self, db, level):
+        sql = "SELECT COUNT(*) FROM events WHERE state = ? AND priority = ?"
+        return db.execute(sql, (self.PENDING, level)).fetchone()[0]
+
+    def _wait_not_full(self, level, block, timeout):
+        """
+        Waits until there is space at the given level, raises queue.Full like queue.Queue.put().
+        Must be called with the lock held.
+        """
+        maxsize = self.maxsize[level]
+        if not maxsize:
+            return
+        endtime = None if timeout is None else time.time() + timeout
+        while self._level_size(self._db, level) >= maxsize:
+            remaining = None if endtime is None else endtime - time.time()
+            if not block or (remaining is not None and remaining <= 0):
+                raise queue.Full
+            self._changed.wait(self.poll_interval if remaining is None else min(self.poll_interval, remaining))
+
+    def _insert(self, db, value, priority, now):
+        available = now + (getattr(value, "debounce", 0) or 0)
+        key = getattr(value, "coalesce_key", None)
+        blob = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        db.execute(
+            "INSERT INTO events (id, name, priority, state, available, coalesce_key, event) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (value.id, value.name, priority, self.PENDING, available, key, blob),
+        )
+
+    def _coalesce(self, db, value, now):
+        """
+        Merges value into the pending event with the same coalesce_key, if any.
+        Returns True if merged.
+        """
+        key = getattr(value, "coalesce_key", None)
+        if key is None:
+            return False
+        row = db.execute(
+            "SELECT seq, available, event FROM events WHERE coalesce_key = ? AND state = ?", (key, self.PENDING)
+        ).fetchone()
+        if row is None:
+            return False
+        seq, available, blob = row
+        if available > now:
+            # Newer event replaces the held back one and restarts the delay
+            debounce = getattr(value, "debounce", 0) or 0
+            db.execute(
+                "UPDATE events SET id = ?, name = ?, available = ?, event = ? WHERE seq = ?",
+                (value.id, value.name, now + debounce, pickle.dumps(value, pickle.HIGHEST_PROTOCOL), seq),
+            )
+        else:
+            pending = self._load(blob)
+            pending.args = value.args
+            blob = pickle.dumps(pending, pickle.HIGHEST_PROTOCOL)
+            db.execute("UPDATE events SET event = ? WHERE seq = ?", (blob, seq))
+        return True
+
+    def put(self, value, priority=None, block=True, timeout=None):
+        """
+        Appends the event to the given priority level, default is the lowest priority.
+        """
+        if priority is None:
+            priority = self.levels - 1
+        with self._lock:
+            now = time.time()
+            with self._transaction() as db:
+                if self._coalesce(db, value, now):
+                    return
+            self._wait_not_full(priority, block, timeout)
+            with self._transaction() as db:
+                self._insert(db, value, priority, time.time())
+            self._changed.notify_all()
+
+    def put_many(self, values, priority=None, block=True, timeout=None):
+        """
+        Appends the events as put(). Without coalescing and maxsize, they are inserted in one transaction.
+        Returns the number of events.
+        """
+        values = list(values)
+        if priority is None:
+            priority = self.levels - 1
+        if self.maxsize[priority] or any(getattr(v, "coalesce_key", None) is not None for v in values):
+            for value in values:
+                self.put(value, priority, block, timeout)
+            return len(values)
+        with self._transaction() as db:
+            now = time.time()
+            for value in values:
+                self._insert(db, value, priority, now)
+            self._changed.notify_all()
+        return len(values)
+
+    def backpressure(self, priority=None):
+        """
+        Returns True if the given level, or any level if priority is None, is over its high water mark.
+        See PriorityEventQueue.backpressure().
+        """
+        with self._lock:
+            out = False
+            for level in range(self.levels) if priority is None else (priority,):
+                high_water = self.high_water[level]
+                if not high_water:
+                    continue
+                size = self._level_size(self._db, level)
+                if size >= high_water:
+                    self._pressure[level] = True
+                elif size <= high_water // 2:
+                    self._pressure[level] = False
+                out = out or self._pressure[level]
+            return out
+
+    def _take(self, max_n, lease, name=None):
+        """
+        Takes up to max_n available events, highest priority first, and marks them in progress.
+        """
+        if lease is None:
+            lease = self.visibility_timeout
+        with self._lock:
+            now = time.time()
+            self._expire_due_leases(now)
+            # Nothing to take: no write transaction
+            if name is None:
+                sql, params = "SELECT 1 FROM events WHERE state = ? AND available <= ? LIMIT 1", ()
+            else:
+                sql, params = "SELECT 1 FROM events WHERE state = ? AND available <= ? AND name = ? LIMIT 1", (name,)
+            if self._db.execute(sql, (self.PENDING, now) + params).fetchone() is None:
+                return []
+        with self._transaction() as db:
+            now = time.time()
+            if name is None:
+                rows = db.execute(
+                    "SELECT seq, attempts, event FROM events WHERE state = ? AND available <= ? "
+                    "ORDER BY priority, seq LIMIT ?",
+                    (self.PENDING, now, max_n),
+                ).fetchall()
+            else:
+                rows = db.execute(
+                    "SELECT seq, attempts, event FROM events WHERE state = ? AND name = ? AND available <= ? "
+                    "ORDER BY priority, seq LIMIT ?",
+                    (self.PENDING, name, now, max_n),
+                ).fetchall()
+            deadline = None if lease is None else now + lease
+            db.executemany(
+                "UPDATE events SET state = ?, lease = ?, attempts = attempts + 1 WHERE seq = ?",
+                [(self.IN_PROGRESS, deadline, seq) for seq, attempts, blob in rows],
+            )
+            if rows and deadline is not None:
+                self._next_expiry = deadline if self._next_expiry is None else min(self._next_expiry, deadline)
+        if rows and any(self.maxsize):
+            self._changed.notify_all()
+        return [self._load(blob, attempts + 1) for seq, attempts, blob in rows]
+
+    def get_many(self, max_n, block=True, timeout=0, lease=None):
+        """
+        Takes up to max_n events, waiting for the first one as get().
+        Returns an empty list instead of raising queue.Empty.
+        """
+        if max_n <= 0:
+            return []
+        endtime = None if timeout is None else time.time() + timeout
+        delay = self.poll_interval
+        with self._lock:
+            while True:
+                events = self._take(max_n, lease)
+                if events or not block:
+                    return events
+                remaining = None if endtime is None else endtime - time.time()
+                if remaining is not None and remaining <= 0:
+                    return events
+                self._changed.wait(self._wait_time(delay, remaining))
+                delay = min(2 * delay, self.max_poll_interval)
+
+    def get(self, block=True, timeout=0):
+        """
+        Returns the next event, see queue.Queue.get() for block and timeout.
+        """
+        events = self.get_many(1, block, timeout)
+        if not events:
+            raise queue.Empty
+        return events[0]
+
+    def get_matching(self, name, max_n):
+        """
+        Takes up to max_n events with the given name, without waiting.
+        """
+        if max_n <= 0:
+            return []
+        return self._take(max_n, None, name)
+
+    def wait_for_event(self, timeout=None):
+        """
+        Waits until the queue is not empty, at most timeout seconds.
+        Returns True if there are events in the queue.
+        """
+        endtime = None if timeout is None else time.time() + timeout
+        delay = self.poll_interval
+        with self._lock:
+            while self.head() is None:
+                remaining = None if endtime is None else endtime - time.time()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._changed.wait(self._wait_time(delay, remaining))
+                delay = min(2 * delay, self.max_poll_interval)
+            return True
+
+    def head(self):
+        """
+        Returns the head of the queue.
+        """
+        with self._lock:
+            now = time.time()
+            self._expire_due_leases(now)
+            row = self._db.execute(
+                "SELECT attempts, event FROM events WHERE state = ? AND available <= ? ORDER BY priority, seq LIMIT 1",
+                (self.PENDING, now),
+            ).fetchone()
+        return None if row is None else self._load(row[1], row[0])
+
+    def qsize(self):
+        """
+        Returns the number of pending events, including debounced events not yet available.
+        """
+        with self._lock:
+            self._expire_due_leases(time.time())
+            return self._db.execute("SELECT COUNT(*) FROM events WHERE state = ?", (self.PENDING,)).fetchone()[0]
+
+    def terminate(self):
+        os._exit(0)
+
+    def discard(self, event_id):
+        """
+        Removes event from in_progress.
+        """
+        with self._transaction() as db:
+            row = db.execute(
+                "SELECT attempts, event FROM events WHERE id = ? AND state = ?", (event_id, self.IN_PROGRESS)
+            ).fetchone()
+            if row is None:
+                return None
+            db.execute("DELETE FROM events WHERE id = ?", (event_id,))
+        return self._load(row[1], row[0])
+
+    def ack_many(self, event_ids):
+        """
+        Discards the events with the given ids from in_progress, in one transaction.
+        Returns the number of events discarded.
+        """
+        with self._transaction() as db:
+            before = db.total_changes
+            db.executemany(
+                "DELETE FROM events WHERE id = ? AND state = ?",
+                [(event_id, self.IN_PROGRESS) for event_id in event_ids],
+            )
+            return db.total_changes - before
+
+    def renew(self, event_ids, lease=None):
+        """
+        Extends the leases of the given events in progress, see PriorityEventQueue.renew().
+        Returns the ids of the events that are no longer in progress.
+        """
+        if lease is None:
+            lease = self.visibility_timeout
+        with self._transaction() as db:
+            now = time.time()
+            if self._expiry_due(now):
+                self._expire_leases(db, now)
+            lost = []
+            for event_id in event_ids:
+                sql = "SELECT lease FROM events WHERE id = ? AND state = ?"
+                row = db.execute(sql, (event_id, self.IN_PROGRESS)).fetchone()
+                if row is None:
+                    lost.append(event_id)
+                elif row[0] is not None and lease is not None:
+                    db.execute("UPDATE events SET lease = ? WHERE id = ?", (now + lease, event_id))
+            return lost
+
+    def exchange(self, values=(), event_ids=(), max_n=0, block=True, timeout=0, priority=None, lease=None):
+        """
+        put_many(values), ack_many(event_ids) and get_many(max_n) in a single call.
+        """
+        if values:
+            self.put_many(values, priority)
+        if event_ids:
+            self.ack_many(event_ids)
+        return self.get_many(max_n, block, timeout, lease)
+
+    def re_append(self, event_id):
+        """
+        Re-appends event to the end of the queue, at its original priority level.
+        """
+        with self._transaction() as db:
+            row = db.execute(
+                "SELECT attempts, event FROM events WHERE id = ? AND state = ?", (event_id, self.IN_PROGRESS)
+            ).fetchone()
+            if row is None:
+                return None
+            db.execute(
+                "UPDATE events SET seq = (SELECT MAX(seq) + 1 FROM events), state = ?, lease = NULL, available = ? "
+                "WHERE id = ?",
+                (self.PENDING, time.time(), event_id),
+            )
+            self._changed.notify_all()
+        return self._load(row[1], row[0])
+
+    def _select(self, state, order="priority, seq", params=(), start=0, count=None):
+        with self._lock:
+            self._expire_due_leases(time.time())
+            sql = f"SELECT attempts, event FROM events WHERE state = ? ORDER BY {order} LIMIT ? OFFSET ?"
+            return self._db.execute(sql, (state,) + params + (-1 if count is None else count, start)).fetchall()
+
+    def peek(self, max_len=200):
+        """
+        Returns the description of the head of the queue, see describe_event(), or None.
+        """
+        event = self.head()
+        return None if event is None else describe_event(event, max_len)
+
+    def get_pending(self, start=0, count=None):
+        """
+        Returns a copy of the queue's content, highest priority first, then the debounced events.
+        With start and count, returns only count events from position start.
+        """
+        rows = self._select(self.PENDING, "available > ?, priority, seq", (time.time(),), start, count)
+        return [self._load(blob, attempts) for attempts, blob in rows]
+
+    def get_pending_summary(self, start=0, count=100, max_len=200):
+        """
+        Returns the descriptions of count pending events from position start, see describe_event().
+        """
+        return [describe_event(ev, max_len) for ev in self.get_pending(start, count)]
+
+    def get_in_progress(self):
+        """
+        Returns a dict of the events in progress, by event id.
+        """
+        events = (self._load(blob, attempts) for attempts, blob in self._select(self.IN_PROGRESS))
+        return {ev.id: ev for ev in events}
+
+    def in_progress_count(self):
+        """
+        Returns the number of events in progress, counted without loading them.
+        """
+        with self._lock:
+            self._expire_due_leases(time.time())
+            return self._db.execute("SELECT COUNT(*) FROM events WHERE state = ?", (self.IN_PROGRESS,)).fetchone()[0]
 
-Shared objects must be 'pickleable'.  
+    def get_in_progress_summary(self, start=0, count=100, max_len=200):
+        """
+        Returns the descriptions of count events in progress from position start, see describe_event().
+        """
+        rows = self._select(self.IN_PROGRESS, start=start, count=count)
+        return [describe_event(self._load(blob, attempts), max_len) for attempts, blob in rows]
 
-@author: skwok
-"""
+    def get_counts(self):
+        """
+        Returns the number of pending events and of events in progress by name,
+        as {"pending": {name: n}, "in_progress": {name: n}}, counted with the index on (state, name).
+        """
+        with self._lock:
+            self._expire_due_leases(time.time())
+            rows = self._db.execute(
+                "SELECT state, name, COUNT(*) FROM events WHERE state IN (?, ?) GROUP BY state, name",
+                (self.PENDING, self.IN_PROGRESS),
+            ).fetchall()
+        out = {"pending": dict(), "in_progress": dict()}
+        for state, name, n in rows:
+            out["pending" if state == self.PENDING else "in_progress"][name] = n
+        return out
 
-import os
-import queue
-import time
-import copy
-import traceback
-from multiprocessing.managers import BaseManager
-from multiprocessing import Process
+    def get_failed(self):
+        """
+        Returns the events given up after max_attempts.
+        """
+        return [self._load(blob, attempts) for attempts, blob in self._select(self.FAILED, "seq")]
+
+    def close(self):
+        with self._lock:
+            self._db.close()
 
 
-class SimpleEventQueue:
+class SharedMemoryEventQueue:
     """
-    This class represents the event queue in in both single process and multi-processing modes.
-    
-    The event queue is the FIFO queue, the Python standard queue.Queue().
-    The framework code takes events from this queue and calls the associated action.
+    Event queue in a shared memory ring buffer, for worker processes on one host.
 
-    The dictionary 'in_progress' contains events that are in progress.
-    When an event is taken from the event queue, that event is added to in_progress.
-    If the event is handled successfully, the event is removed from in_progress,
-    unless it is a recurrent event. In that case, the event is re-inserted to the queue.
+    The queue is created by the parent process and passed to the worker processes,
+    either inherited by fork or as an argument of multiprocessing.Process.
+    There is no queue manager, put() and get() copy the pickled event in and out of the ring
+    with a multiprocessing lock held.
 
-    Otherwise, if there is an error, the event can be re-inserted into the event queue,
-    or discarded, depending on the event handler.
+    Each record in the ring is the length of the event, the event name and the pickled event.
+    capacity is the size of the ring in bytes, put() waits for space as when maxsize events are queued.
+    maxsize and high_water are as in SimpleEventQueue, backpressure() is shared by all processes.
 
-    This is instantiated when the proxy server is started.
-    Clients/consumers should call get_queue() to get the proxy of the queue.
+    The events taken by a process are in the in_progress dict of that process, so that discard()
+    and re_append() work as with SimpleEventQueue in Framework._action_completed().
+    The number of events in progress in all processes is kept in the ring header.
+    An event taken by a process that dies is lost, there are no leases, renew() only reports
+    the events that are not in progress in this process.
+    Events are neither coalesced nor debounced, and there is one priority level.
+
+    terminate() wakes up the processes waiting in get(), which then raise queue.Empty
+    once the queue is empty. The creator of the queue removes the shared memory with unlink().
     """
 
-    def __init__(self):
-        self.queue = queue.Queue()
+    # head, tail and used are in bytes; count, in_progress, pressure and closed flags
+    _HEADER = struct.Struct("<qqqqqqq")
+    # Record: total length, length of the name
+    _RECORD = struct.Struct("<IH")
+    levels = 1
+
+    def __init__(self, capacity=64 * 1024 * 1024, maxsize=None, high_water=None, ctx=None):
+        ctx = multiprocessing.get_context() if ctx is None else ctx
+        self.capacity = capacity
+        self.maxsize = maxsize
+        self.high_water = high_water
+        self._shm = shared_memory.SharedMemory(create=True, size=self._HEADER.size + capacity)
+        self._HEADER.pack_into(self._shm.buf, 0, 0, 0, 0, 0, 0, 0, 0)
+        self._lock = ctx.RLock()
+        self._not_empty = ctx.Condition(self._lock)
+        self._not_full = ctx.Condition(self._lock)
         self._in_progress = dict()
 
-    def put(self, value):
-        self.queue.put(value)
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_shm"] = self._shm.name
+        state["_in_progress"] = dict()
+        return state
 
-    def get(self, block=True, timeout=0):
-        event = self.queue.get(block=block, timeout=timeout)
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._shm = shared_memory.SharedMemory(name=state["_shm"])
+        shared_arrays._untrack(self._shm)
+
+    @property
+    def name(self):
+        return self._shm.name
+
+    def _header(self):
+        return list(self._HEADER.unpack_from(self._shm.buf, 0))
+
+    def _set_header(self, header):
+        self._HEADER.pack_into(self._shm.buf, 0, *header)
+
+    def _write(self, pos, data):
+        """
+        Copies data into the ring at pos, wrapping around, returns the position after data.
+        """
+        base, size = self._HEADER.size, len(data)
+        n = min(size, self.capacity - pos)
+        buf = self._shm.buf
+        buf[base + pos : base + pos + n] = data[:n]
+        if n < size:
+            buf[base : base + size - n] = data[n:]
+        return (pos + size) % self.capacity
+
+    def _read(self, pos, size):
+        base = self._HEADER.size
+        n = min(size, self.capacity - pos)
+        buf = self._shm.buf
+        data = bytes(buf[base + pos : base + pos + n])
+        if n < size:
+            data += bytes(buf[base : base + size - n])
+        return data
+
+    def _records(self, header):
+        """
+        Iterates over the pending records as (position, total length, name), oldest first.
+        Must be called with the lock held.
+        """
+        pos = header[0]
+        for i in range(header[3]):
+            total, name_len = self._RECORD.unpack(self._read(pos, self._RECORD.size))
+            name = self._read((pos + self._RECORD.size) % self.capacity, name_len).decode()
+            yield pos, total, name
+            pos = (pos + total) % self.capacity
+
+    def _load(self, pos, total, name):
+        offset = self._RECORD.size + len(name.encode())
+        return pickle.loads(self._read((pos + offset) % self.capacity, total - offset))
+
+    def _encode(self, value):
+        name = str(value.name).encode()
+        data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        total = self._RECORD.size + len(name) + len(data)
+        if total > self.capacity:
+            raise ValueError(f"Event {value.name} of {total} bytes does not fit in the queue")
+        return self._RECORD.pack(total, len(name)) + name + data
+
+    def _append(self, record, block, timeout, check_maxsize=True):
+        """
+        Waits for space and appends the record. Must be called with the lock held.
+        """
+        endtime = None if timeout is None else time.time() + timeout
+        while True:
+            header = self._header()
+            full = check_maxsize and self.maxsize and header[3] >= self.maxsize
+            if not full and header[2] + len(record) <= self.capacity:
+                break
+            if not block:
+                raise queue.Full
+            remaining = None if endtime is None else endtime - time.time()
+            if remaining is not None and remaining <= 0:
+                raise queue.Full
+            self._not_full.wait(remaining)
+        header[1] = self._write(header[1], record)
+        header[2] += len(record)
+        header[3] += 1
+        self._set_header(header)
+        self._not_empty.notify_all()
+
+    def put(self, value, priority=None, block=True, timeout=None):
+        """
+        Appends the event, see queue.Queue.put() for block and timeout. There is one priority level.
+        """
+        record = self._encode(value)
+        with self._lock:
+            self._append(record, block, timeout)
+
+    def put_many(self, values, priority=None, block=True, timeout=None):
+        """
+        Appends the events as put(), holding the lock once. Returns the number of events.
+        """
+        records = [self._encode(value) for value in values]
+        with self._lock:
+            for record in records:
+                self._append(record, block, timeout)
+        return len(records)
+
+    def backpressure(self, priority=None):
+        """
+        Returns True if the queue is over its high water mark, until it is down to half of it.
+        """
+        if not self.high_water:
+            return False
+        with self._lock:
+            header = self._header()
+            if header[3] >= self.high_water:
+                header[5] = 1
+            elif header[3] <= self.high_water // 2:
+                header[5] = 0
+            self._set_header(header)
+            return bool(header[5])
+
+    def _taken(self, event):
+        event.attempts = getattr(event, "attempts", 0) + 1
         self._in_progress[event.id] = event
         return event
 
+    def _pop(self, header):
+        """
+        Takes the oldest record, returns the event. Must be called with the lock held.
+        """
+        pos, total, name = next(self._records(header))
+        event = self._load(pos, total, name)
+        header[0] = (pos + total) % self.capacity
+        header[2] -= total
+        header[3] -= 1
+        header[4] += 1
+        return self._taken(event)
+
+    def _wait(self, block, timeout):
+        """
+        Waits until there is an event, returns the header. Raises queue.Empty.
+        Must be called with the lock held.
+        """
+        header = self._header()
+        if header[3] or not block:
+            if not header[3]:
+                raise queue.Empty
+            return header
+        endtime = None if timeout is None else time.time() + timeout
+        while not header[3]:
+            remaining = None if endtime is None else endtime - time.time()
+            if header[6] or (remaining is not None and remaining <= 0):
+                raise queue.Empty
+            self._not_empty.wait(remaining)
+            header = self._header()
+        return header
+
+    def get(self, block=True, timeout=0):
+        """
+        Returns the next event, see queue.Queue.get() for block and timeout.
+        """
+        with self._lock:
+            header = self._wait(block, timeout)
+            event = self._pop(header)
+            self._set_header(header)
+            self._not_full.notify_all()
+            return event
+
+    def get_many(self, max_n, block=True, timeout=0, lease=None):
+        """
+        Takes up to max_n events, waiting for the first one as get().
+        Returns an empty list instead of raising queue.Empty. lease is not supported.
+        """
+        with self._lock:
+            if max_n <= 0:
+                return []
+            try:
+                header = self._wait(block, timeout)
+            except queue.Empty:
+                return []
+            out = [self._pop(header) for i in range(min(max_n, header[3]))]
+            self._set_header(header)
+            self._not_full.notify_all()
+            return out
+
+    def get_matching(self, name, max_n):
+        """
+        Takes up to max_n events with the given name, without waiting.
+        The other records are moved to close the gaps, only the names are read to select the events.
+        """
+        with self._lock:
+            header = self._header()
+            records = list(self._records(header))
+            taken = [r for r in records if r[2] == name][:max_n]
+            if not taken:
+                return []
+            out = [self._taken(self._load(*r)) for r in taken]
+            taken_pos = set(r[0] for r in taken)
+            kept = [self._read(pos, total) for pos, total, rname in records if pos not in taken_pos]
+            pos = header[0]
+            for record in kept:
+                pos = self._write(pos, record)
+            header[1] = pos
+            header[2] = sum(len(record) for record in kept)
+            header[3] = len(kept)
+            header[4] += len(out)
+            self._set_header(header)
+            self._not_full.notify_all()
+            return out
+
+    def wait_for_event(self, timeout=None):
+        """
+        Waits until the queue is not empty, at most timeout seconds.
+        Returns True if there are events in the queue.
+        """
+        with self._lock:
+            try:
+                self._wait(True, timeout)
+                return True
+            except queue.Empty:
+                return False
+
     def head(self):
         """
         Returns the head of the queue.
         """
-        try:
-            return list(self.queue.queue)[0]
-        except:
-            return None
+        with self._lock:
+            header = self._header()
+            if not header[3]:
+                return None
+            return self._load(*next(self._records(header)))
+
+    def peek(self, max_len=200):
+        """
+        Returns the description of the head of the queue, see describe_event(), or None.
+        """
+        event = self.head()
+        return None if event is None else describe_event(event, max_len)
 
     def qsize(self):
-        return self.queue.qsize()
+        """
+        Returns the number of pending events in all processes.
+        """
+        with self._lock:
+            return self._header()[3]
 
     def terminate(self):
-        os._exit(0)
-
-    def discard(self, event_id):
         """
-        Rmmoves event from in_progress list.
+        Wakes up the processes waiting for events, they stop waiting once the queue is empty.
         """
-        ev = self._in_progress.get(event_id)
+        with self._lock:
+            header = self._header()
+            header[6] = 1
+            self._set_header(header)
+            self._not_empty.notify_all()
+
+    def _done(self, event_id):
+        ev = self._in_progress.pop(event_id, None)
         if ev is not None:
-            del self._in_progress[event_id]
+            header = self._header()
+            header[4] -= 1
+            self._set_header(header)
         return ev
 
+    def discard(self, event_id):
+        """
+        Removes event from in_progress.
+        """
+        with self._lock:
+            return self._done(event_id)
+
+    def ack_many(self, event_ids):
+        """
+        Discards the events with the given ids from in_progress. Returns the number of events discarded.
+        """
+        with self._lock:
+            return sum(1 for event_id in event_ids if self._done(event_id) is not None)
+
+    def renew(self, event_ids, lease=None):
+        """
+        There are no leases. Returns the ids of the events that are not in progress in this process.
+        """
+        return [event_id for event_id in event_ids if event_id not in self._in_progress]
+
+    def get_failed(self):
+        return []
+
+    def exchange(self, values=(), event_ids=(), max_n=0, block=True, timeout=0, priority=None, lease=None):
+        """
+        put_many(values), ack_many(event_ids) and get_many(max_n) in a single call.
+        """
+        if values:
+            self.put_many(values, priority)
+        if event_ids:
+            self.ack_many(event_ids)
+        return self.get_many(max_n, block, timeout, lease)
+
     def re_append(self, event_id):
         """
-        Re-appends event to the event_queue.
+        Re-appends event to the end of the queue.
+        The event was already accepted, so it is re-appended even if maxsize events are queued.
         """
-        ev = self.discard(event_id)
-        self.put(ev)
+        with self._lock:
+            ev = self._done(event_id)
+            if ev is not None:
+                self._append(self._encode(ev), True, None, check_maxsize=False)
+            return ev
 
-    def get_pending(self):
+    def get_pending(self, start=0, count=None):
         """
-        Returns a copy of the queue's content
+        Returns a copy of the queue's content, or count events from position start.
         """
-        return list(self.queue.queue)
+        with self._lock:
+            header = self._header()
+            records = itertools.islice(self._records(header), start, None if count is None else start + count)
+            return [self._load(*r) for r in records]
+
+    def get_pending_summary(self, start=0, count=100, max_len=200):
+        """
+        Returns the descriptions of count pending events from position start, see describe_event().
+        """
+        return [describe_event(ev, max_len) for ev in self.get_pending(start, count)]
 
     def get_in_progress(self):
         """
-        Returns the in_progress dict
+        Returns the in_progress dict of this process.
         """
         return self._in_progress
 
+    def get_in_progress_summary(self, start=0, count=100, max_len=200):
+        events = itertools.islice(list(self._in_progress.values()), start, start + count)
+        return [describe_event(ev, max_len) for ev in events]
+
+    def in_progress_total(self):
+        """
+        Returns the number of events in progress in all processes.
+        """
+        with self._lock:
+            return self._header()[4]
+
+    def in_progress_count(self):
+        """
+        Returns the number of events in progress in all processes, unlike get_in_progress().
+        """
+        return self.in_progress_total()
+
+    def get_counts(self):
+        """
+        Returns the number of pending events by name, read from the record headers,
+        and the number of events in progress in this process by name.
+        """
+        with self._lock:
+            pending = Counter(name for pos, total, name in self._records(self._header()))
+        in_progress = Counter(ev.name for ev in list(self._in_progress.values()))
+        return {"pending": dict(pending), "in_progress": dict(in_progress)}
+
+    def close(self):
+        self._shm.close()
+
+    def unlink(self):
+        """
+        Removes the shared memory segment, called by the process that created the queue.
+        """
+        self._shm.unlink()
+
+
+class BatchingQueueClient:
+    """
+    Client of a shared event queue that saves round trips to the queue manager.
+
+    discard() buffers the event ids, they are sent with one ack_many() once batch_size ids are buffered.
+    put() sends the event at once, with the buffered ids, so that other workers can take it.
+    With batch_puts, put() buffers the events in the same way as the ids, for producers of many events.
+    get() and get_many() send the buffered events and ids in the same call, see PriorityEventQueue.exchange().
+    flush() sends the buffers. It is called before any other method of the wrapped queue,
+    so that for instance qsize() counts the buffered events.
+
+    With prefetch > 0, get() takes up to prefetch events at once and returns them one by one.
+    The prefetched events are leased for lease seconds: if they are not discarded in time,
+    for instance because this worker died, the queue manager re-queues them for other workers.
+    A prefetched event whose lease has expired before get() returns it is dropped, it is in the queue again.
+    The lease must therefore cover the processing of the prefetched events,
+    otherwise an event may be processed twice.
+    The ids buffered by discard() are not acknowledged until they are sent: their leases run meanwhile.
+    renew() sends them first, and Framework flushes the buffers while no events are running,
+    see Framework._heartbeat_loop().
+    """
+
+    def __init__(self, queue, batch_size=100, prefetch=0, lease=60, batch_puts=False):
+        self.queue = queue
+        self.batch_size = batch_size
+        self.batch_puts = batch_puts
+        self.prefetch = prefetch
+        self.lease = lease if prefetch else None
+        self._lock = threading.Lock()
+        self._puts = []
+        self._acks = []
+        # Prefetched events as (lease deadline, event)
+        self._prefetched = deque()
+
+    def __getattr__(self, name):
+        if name in ("queue", "_lock", "_puts", "_acks", "_prefetched"):
+            raise AttributeError(name)
+        attr = getattr(self.queue, name)
+        self.flush()
+        return attr
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _take_buffers(self):
+        with self._lock:
+            puts, acks = self._puts, self._acks
+            self._puts, self._acks = [], []
+        return puts, acks
+
+    def _buffer(self, buf, value):
+        with self._lock:
+            buf.append(value)
+            full = len(buf) >= self.batch_size
+        if full:
+            self.flush()
+
+    def put(self, value, priority=None, block=True, timeout=None):
+        """
+        Sends the event with the buffered ones, or buffers it with batch_puts.
+        With a priority, or block False or a timeout, the event is sent at once,
+        after the buffered ones, so that queue.Full is raised to the caller.
+        """
+        self.put_many([value], priority, block, timeout)
+
+    def put_many(self, values, priority=None, block=True, timeout=None):
+        """
+        Same as put() for several events. Returns the number of events.
+        """
+        values = list(values)
+        if priority is not None or not block or timeout is not None:
+            self.flush()
+            return self.queue.put_many(values, priority, block, timeout)
+        with self._lock:
+            self._puts.extend(values)
+            full = len(self._puts) >= self.batch_size
+        if full or not self.batch_puts:
+            self.flush()
+        return len(values)
+
+    def discard(self, event_id):
+        self._buffer(self._acks, event_id)
+
+    def ack_many(self, event_ids):
+        with self._lock:
+            self._acks.extend(event_ids)
+            full = len(self._acks) >= self.batch_size
+        if full:
+            self.flush()
+
+    def renew(self, event_ids, lease=None):
+        """
+        Sends the buffers, so that the completed events are acknowledged, then renews the leases of event_ids.
+        """
+        self.flush()
+        return self.queue.renew(event_ids, lease)
+
+    def _exchange(self, max_n, block, timeout):
+        puts, acks = self._take_buffers()
+        if self.lease is None:
+            return self.queue.exchange(puts, acks, max_n, block, timeout)
+        # The local deadline starts before the request, so it is not later than the one in the queue manager
+        deadline = time.time() + self.lease
+        events = self.queue.exchange(puts, acks, max_n, block, timeout, lease=self.lease)
+        return [(deadline, ev) for ev in events]
+
+    def _take_prefetched(self, max_n):
+        out = []
+        now = time.time()
+        with self._lock:
+            while self._prefetched and len(out) < max_n:
+                deadline, ev = self._prefetched.popleft()
+                if deadline > now:
+                    out.append(ev)
+        return out
+
+    def get_many(self, max_n, block=True, timeout=0):
+        if self.lease is None:
+            return self._exchange(max_n, block, timeout)
+        out = self._take_prefetched(max_n)
+        if out:
+            return out
+        leased = self._exchange(max(max_n, self.prefetch), block, timeout)
+        with self._lock:
+            self._prefetched.extend(leased[max_n:])
+        return [ev for deadline, ev in leased[:max_n]]
+
+    def get(self, block=True, timeout=0):
+        out = self.get_many(1, block, timeout)
+        if not out:
+            raise queue.Empty
+        return out[0]
+
+    def flush(self):
+        """
+        Sends the buffered events and event ids, if any.
+        """
+        puts, acks = self._take_buffers()
+        if puts or acks:
+            self.queue.exchange(puts, acks, 0)
+
+    def close(self):
+        """
+        Sends the buffers and returns the prefetched events to the queue.
+        """
+        self.flush()
+        with self._lock:
+            prefetched, self._prefetched = self._prefetched, deque()
+        now = time.time()
+        for deadline, ev in prefetched:
+            if deadline > now:
+                self.queue.re_append(ev.id)
+
+
+class ShardedEventQueue:
+    """
+    Event queue spread over several shards, each the shared queue of one queue manager.
+
+    put() sends an event to the shard given by the CRC32 of its key: the coalesce_key if any,
+    so that duplicates meet in the same shard, otherwise the partition key, by default the file name,
+    otherwise the event id. put_many() sends one put_many() per shard.
+
+    get() and get_many() take from the home shard of this client first, default is by process id.
+    When the home shard is empty, events are stolen from the other shards, in turn.
+    While all shards are empty, the client waits on its home shard for the rest of the timeout,
+    or for steal_interval seconds at a time without timeout, then looks at the other shards once more.
+    An idle client therefore does not poll the queue managers.
+
+    The shard of each event taken by this client is remembered, so that discard(), ack_many(), renew()
+    and re_append() go to that shard only. Other ids are looked for in all shards.
+    Events are in order within a shard, not across shards.
+    """
+
+    # Seconds waited on the home shard before stealing from the other shards again, when waiting without timeout
+    steal_interval = 1.0
+
+    def __init__(self, shards, home=None):
+        self.shards = list(shards)
+        self.home = (os.getpid() if home is None else home) % len(self.shards)
+        self._lock = threading.Lock()
+        # event_id: index of the shard the event was taken from
+        self._owner = dict()
+
+    def shard_of(self, event):
+        """
+        Returns the index of the shard of an event.
+        """
+        key = getattr(event, "coalesce_key", None)
+        if key is None:
+            key = getattr(event, "key", None)
+        if key is None:
+            key = event.id
+        return zlib.crc32(str(key).encode()) % len(self.shards)
+
+    def _order(self):
+        n = len(self.shards)
+        return [(self.home + i) % n for i in range(n)]
+
+    def _group(self, values, shard_of):
+        groups = dict()
+        for value in values:
+            groups.setdefault(shard_of(value), []).append(value)
+        return groups
+
+    def _taken(self, index, events):
+        with self._lock:
+            for ev in events:
+                self._owner[ev.id] = index
+        return events
+
+    def _owned(self, event_ids):
+        """
+        Returns the ids grouped by the shard they were taken from, and the ids of unknown shard.
+        """
+        with self._lock:
+            groups = self._group(event_ids, lambda event_id: self._owner.pop(event_id, None))
+        return groups, groups.pop(None, [])
+
+    def put(self, value, priority=None, block=True, timeout=None):
+        self.shards[self.shard_of(value)].put(value, priority, block, timeout)
+
+    def put_many(self, values, priority=None, block=True, timeout=None):
+        """
+        Sends the events to their shards, with one put_many() per shard. Returns the number of events.
+        """
+        groups = self._group(values, self.shard_of)
+        return sum(self.shards[i].put_many(group, priority, block, timeout) for i, group in groups.items())
+
+    def backpressure(self, priority=None):
+        return any(shard.backpressure(priority) for shard in self.shards)
+
+    def get_many(self, max_n, block=True, timeout=0, lease=None):
+        """
+        Takes up to max_n events from the home shard, or else from another shard.
+        Waits for the first event as get(). Returns an empty list instead of raising queue.Empty.
+        """
+        if max_n <= 0:
+            return []
+        endtime = None if timeout is None else time.time() + timeout
+        while True:
+            for i in self._order():
+                events = self.shards[i].get_many(max_n, False, 0, lease)
+                if events:
+                    return self._taken(i, events)
+            remaining = None if endtime is None else endtime - time.time()
+            if not block or (remaining is not None and remaining <= 0):
+                return []
+            wait = self.steal_interval if remaining is None else remaining
+            events = self.shards[self.home].get_many(max_n, True, wait, lease)
+            if events:
+                return self._taken(self.home, events)
+
+    def get(self, block=True, timeout=0):
+        """
+        Returns the next event, see queue.Queue.get() for block and timeout.
+        """
+        events = self.get_many(1, block, timeout)
+        if not events:
+            raise queue.Empty
+        return events[0]
+
+    def get_matching(self, name, max_n):
+        out = []
+        for i in self._order():
+            if len(out) >= max_n:
+                break
+            out.extend(self._taken(i, self.shards[i].get_matching(name, max_n - len(out))))
+        return out
+
+    def wait_for_event(self, timeout=None):
+        """
+        Waits until a shard is not empty, at most timeout seconds.
+        Returns True if there are events in the queue.
+        """
+        endtime = None if timeout is None else time.time() + timeout
+        while True:
+            if any(shard.qsize() > 0 for shard in self.shards):
+                return True
+            remaining = None if endtime is None else endtime - time.time()
+            if remaining is not None and remaining <= 0:
+                return False
+            wait = self.steal_interval if remaining is None else remaining
+            if self.shards[self.home].wait_for_event(wait):
+                return True
+
+    def head(self):
+        for i in self._order():
+            event = self.shards[i].head()
+            if event is not None:
+                return event
+        return None
+
+    def peek(self, max_len=200):
+        for i in self._order():
+            desc = self.shards[i].peek(max_len)
+            if desc is not None:
+                return desc
+        return None
+
+    def qsize(self):
+        return sum(shard.qsize() for shard in self.shards)
+
+    def terminate(self):
+        """
+        Terminates the queue managers of all the shards.
+        """
+        for shard in self.shards:
+            try:
+                shard.terminate()
+            except Exception:
+                # The connection is lost when the queue manager exits
+                pass
+
+    def discard(self, event_id):
+        groups, unknown = self._owned([event_id])
+        for i in groups:
+            return self.shards[i].discard(event_id)
+        for shard in self.shards:
+            ev = shard.discard(event_id)
+            if ev is not None:
+                return ev
+        return None
+
+    def ack_many(self, event_ids):
+        """
+        Discards the events, with one ack_many() per shard. Returns the number of events discarded.
+        """
+        groups, unknown = self._owned(event_ids)
+        n = sum(self.shards[i].ack_many(ids) for i, ids in groups.items())
+        if unknown:
+            n += sum(shard.ack_many(unknown) for shard in self.shards)
+        return n
+
+    def renew(self, event_ids, lease=None):
+        """
+        Extends the leases of the events in their shards.
+        Returns the ids of the events that are no longer in progress in any shard.
+        """
+        with self._lock:
+            groups = self._group(event_ids, lambda event_id: self._owner.get(event_id))
+        unknown = groups.pop(None, [])
+        lost = []
+        for i, ids in groups.items():
+            lost.extend(self.shards[i].renew(ids, lease))
+        if unknown:
+            lost_everywhere = set(unknown)
+            for shard in self.shards:
+                lost_everywhere.intersection_update(shard.renew(unknown, lease))
+            lost.extend(event_id for event_id in unknown if event_id in lost_everywhere)
+        with self._lock:
+            for event_id in lost:
+                self._owner.pop(event_id, None)
+        return lost
+
+    def get_failed(self):
+        return [ev for shard in self.shards for ev in shard.get_failed()]
+
+    def exchange(self, values=(), event_ids=(), max_n=0, block=True, timeout=0, priority=None, lease=None):
+        """
+        put_many(values), ack_many(event_ids) and get_many(max_n).
+        This is one round trip per shard involved, see BatchingQueueClient.
+        """
+        if values:
+            self.put_many(values, priority)
+        if event_ids:
+            self.ack_many(event_ids)
+        return self.get_many(max_n, block, timeout, lease)
+
+    def re_append(self, event_id):
+        """
+        Re-appends event to the end of the shard it was taken from.
+        """
+        groups, unknown = self._owned([event_id])
+        for i in groups:
+            return self.shards[i].re_append(event_id)
+        for shard in self.shards:
+            ev = shard.re_append(event_id)
+            if ev is not None:
+                return ev
+        return None
+
+    def _page(self, start, count, sizes, fetch):
+        """
+        Returns count items from position start of the shards taken one after the other,
+        asking each shard only for the items of the page.
+        """
+        out = []
+        for i, size in enumerate(sizes):
+            if count is not None and len(out) >= count:
+                break
+            if start >= size:
+                start -= size
+                continue
+            out.extend(fetch(i, start, None if count is None else count - len(out)))
+            start = 0
+        return out
+
+    def get_pending(self, start=0, count=None):
+        """
+        Returns count pending events from position start, shard after shard.
+        """
+        sizes = [shard.qsize() for shard in self.shards]
+        return self._page(start, count, sizes, lambda i, s, c: self.shards[i].get_pending(s, c))
+
+    def get_pending_summary(self, start=0, count=100, max_len=200):
+        sizes = [shard.qsize() for shard in self.shards]
+        return self._page(start, count, sizes, lambda i, s, c: self.shards[i].get_pending_summary(s, c, max_len))
+
+    def get_in_progress(self):
+        """
+        Returns a dict of the events in progress in all the shards.
+        """
+        out = dict()
+        for shard in self.shards:
+            out.update(shard.get_in_progress())
+        return out
+
+    def in_progress_count(self):
+        return sum(shard.in_progress_count() for shard in self.shards)
+
+    def get_in_progress_summary(self, start=0, count=100, max_len=200):
+        out = []
+        for shard in self.shards:
+            out.extend(shard.get_in_progress_summary(0, start + count - len(out), max_len))
+            if len(out) >= start + count:
+                break
+        return out[start : start + count]
+
+    def get_counts(self):
+        pending, in_progress = Counter(), Counter()
+        for shard in self.shards:
+            counts = shard.get_counts()
+            pending.update(counts["pending"])
+            in_progress.update(counts["in_progress"])
+        return {"pending": dict(pending), "in_progress": dict(in_progress)}
+
 
 class QueueServer(BaseManager):
     pass
@@ -132,13 +2328,46 @@ def _get_queue_manager(hostname, portnr, auth_code):
         return None
 
 
-def _queue_manager_target(hostname, portnr, auth_code, logger):
+def create_event_queue(backend="memory", filename=None, **kwargs):
+    """
+    Returns a new event queue with one level.
+    backend is "memory" for a SimpleEventQueue or "sqlite" for a SqliteEventQueue stored in filename.
+    kwargs are maxsize, high_water, visibility_timeout and max_attempts.
+    """
+    if backend == "sqlite":
+        if filename is None:
+            raise ValueError("The sqlite event queue needs a file name")
+        return SqliteEventQueue(filename, **kwargs)
+    if backend not in (None, "memory"):
+        raise ValueError(f"Unknown event queue backend {backend}")
+    return SimpleEventQueue(**kwargs)
+
+
+def _queue_manager_target(
+    hostname,
+    portnr,
+    auth_code,
+    logger,
+    maxsize=None,
+    high_water=None,
+    visibility_timeout=None,
+    max_attempts=None,
+    backend="memory",
+    filename=None,
+):
     """
     This is the target method for the process that runs the queue manager.    
     This should be spawn as a process and run in the background.  
     """
     try:
-        queue = SimpleEventQueue()
+        queue = create_event_queue(
+            backend,
+            filename,
+            maxsize=maxsize,
+            high_water=high_water,
+            visibility_timeout=visibility_timeout,
+            max_attempts=max_attempts,
+        )
         QueueServer.register("get_queue", callable=lambda: queue)
 
         manager = QueueServer(address=(hostname, portnr), authkey=auth_code)
@@ -152,27 +2381,116 @@ def _queue_manager_target(hostname, portnr, auth_code, logger):
         logger.info("Queue manager process terminated")
 
 
-def start_queue_manager(hostname, portnr, auth_code, logger):
+def _shard_file(filename, index):
+    """
+    Returns the name of the SQLite file of a shard, the index is added before the extension.
+    """
+    if filename is None:
+        return None
+    root, ext = os.path.splitext(filename)
+    return f"{root}.{index}{ext}"
+
+
+def _sharded_manager_target(
+    hostname, portnr, auth_code, logger, shards, maxsize, high_water, visibility_timeout, max_attempts, backend, filename
+):
+    """
+    Target of the process that starts one queue manager process per shard, on consecutive ports,
+    and waits until they have all terminated.
+    """
+    options = (maxsize, high_water, visibility_timeout, max_attempts, backend)
+    processes = [
+        Process(
+            target=_queue_manager_target,
+            args=(hostname, portnr + i, auth_code, logger) + options + (_shard_file(filename, i),),
+        )
+        for i in range(shards)
+    ]
+    for p in processes:
+        p.start()
+    for p in processes:
+        p.join()
+
+
+def event_queue_file(cfg):
+    """
+    Returns the SQLite file of the event queue given by the configuration, see config.event_queue_file.
+    """
+    if cfg.event_queue_file:
+        return cfg.event_queue_file
+    return os.path.join(cfg.temp_directory, "event_queue.sqlite")
+
+
+def queue_manager_options(cfg):
+    """
+    Returns the keyword arguments of start_queue_manager() given by the configuration,
+    so that the framework and the tools start the same queue manager.
+    """
+    return dict(
+        maxsize=cfg.event_queue_maxsize,
+        high_water=cfg.event_queue_high_water,
+        visibility_timeout=cfg.event_visibility_timeout,
+        max_attempts=cfg.event_max_attempts,
+        backend=cfg.event_queue_backend,
+        filename=event_queue_file(cfg),
+        shards=cfg.queue_manager_shards or 1,
+    )
+
+
+def start_queue_manager(
+    hostname,
+    portnr,
+    auth_code,
+    logger,
+    maxsize=None,
+    high_water=None,
+    visibility_timeout=None,
+    max_attempts=None,
+    backend="memory",
+    filename=None,
+    shards=1,
+):
     """
     Starts the queue manager process.
+    maxsize and high_water bound the shared queue,
+    visibility_timeout and max_attempts control the re-queuing of events of dead workers, see PriorityEventQueue.
+    With backend "sqlite", the queue is stored in filename and the pending events survive a restart,
+    see create_event_queue().
+    With shards > 1, the process starts one queue manager per shard, on ports portnr to portnr + shards - 1,
+    maxsize and high_water apply to each shard, and shard i of the sqlite backend is stored in filename.i.
+    See ShardedEventQueue. portnr may be a string, as given on the command line of the tools.
     """
-    p = Process(target=_queue_manager_target, args=(hostname, portnr, auth_code, logger))
+    portnr = int(portnr)
+    args = (hostname, portnr, auth_code, logger, maxsize, high_water, visibility_timeout, max_attempts, backend, filename)
+    if shards > 1:
+        p = Process(target=_sharded_manager_target, args=args[:4] + (shards,) + args[4:])
+    else:
+        p = Process(target=_queue_manager_target, args=args)
     p.start()
     for i in range(10):
         time.sleep(2)
-        if get_event_queue(hostname, portnr, auth_code) is not None:
+        if get_event_queue(hostname, portnr, auth_code, shards) is not None:
             break
     else:
         logger.debug(f"Queue ready {i}")
     return p
 
 
-def get_event_queue(hostname, portnr, auth_code):
+def get_event_queue(hostname, portnr, auth_code, shards=1):
     """
     This functions gets the shared queue.
     First it connects to the manager, the process that contains the queue.
     Then it asks the manager for the queue by calling the registered function get_queue(). 
+    With shards > 1, connects to the managers on ports portnr to portnr + shards - 1,
+    and returns a ShardedEventQueue, or None if one of them is not running.
+    portnr may be a string, as given on the command line of the tools.
     """
+    portnr = int(portnr)
+    if shards > 1:
+        queues = [get_event_queue(hostname, portnr + i, auth_code) for i in range(shards)]
+        if any(q is None for q in queues):
+            return None
+        return ShardedEventQueue(queues)
     manager = _get_queue_manager(hostname, portnr, auth_code)
     if manager is None:
         return None
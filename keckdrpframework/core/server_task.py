@@ -48,7 +48,8 @@ class DRPFServerHandler(EasyHTTPHandler):
     def trigger_event(self, req, qstr):
         self._getParameters(qstr)
         event_name = self._http_event_name
-        self.DRPFramework.append_event(event_name, None)
+        # Repeated triggers are coalesced while pending
+        self.DRPFramework.append_event(event_name, None, coalesce_key=event_name)
         return json.dumps("OK"), self.jsonText
 
     def add_new_event(self, req, qstr):
@@ -60,31 +61,62 @@ class DRPFServerHandler(EasyHTTPHandler):
         state = self._http_state
         next = self._http_next
         print("updating event_table")
-        self.DRPFramework.pipeline.event_table[name] = (action, state, next)
+        self.DRPFramework.pipeline.set_event(name, (action, state, next))
         return json.dumps("OK"), self.jsonText
 
     def get_event_table(self, req, qstr):
         print(self.DRPFramework.pipeline.event_table)
         return json.dumps("OK"), self.jsonText
 
+    def metrics(self, req, qstr):
+        """
+        Returns the framework metrics in the Prometheus text format.
+        """
+        return self.DRPFramework.get_metrics_text(), "text/plain; version=0.0.4; charset=utf-8"
+
+    def trace(self, req, qstr):
+        """
+        Returns the recorded spans in the Chrome trace event format, optionally only those of trace_id.
+        """
+        self._getParameters(qstr)
+        trace_id = self.__dict__.get("_http_trace_id")
+        return json.dumps(self.DRPFramework.export_trace(trace_id=trace_id)), self.jsonText
+
     def get_pending_events(self, req, qstr):
+        """
+        Returns the counts by name and one page of the pending events, parameters start and count.
+        """
         self._getParameters(qstr)
-        events, events_hi = self.DRPFramework.getPendingEvents()
-        out = [str(e) for e in events]
-        out_hi = [str(e) for e in events_hi]
-        return json.dumps({"events": out, "events_hi": out_hi}), self.jsonText
+        start = self.__dict__.get("_http_start", 0)
+        count = self.__dict__.get("_http_count", 100)
+        summary = self.DRPFramework.get_queue_summary(start, count)
+        out = summary["event_queue"]
+        out_hi = summary["event_queue_hi"]
+        return (
+            json.dumps(
+                {
+                    "events": out["pending"],
+                    "events_hi": out_hi["pending"],
+                    "counts": out["counts"],
+                    "counts_hi": out_hi["counts"],
+                    "size": out["size"],
+                    "size_hi": out_hi["size"],
+                }
+            ),
+            self.jsonText,
+        )
 
     def add_next_file_event(self, req, qstr):
         self._getParameters(qstr)
         args = Arguments(name=self._http_file_name)
-        self.DRPFramework.append_event("next_file", args)
+        self.DRPFramework.append_event("next_file", args, coalesce_key=f"next_file:{self._http_file_name}")
         return json.dumps("OK"), self.jsonText
 
     def add_create_contact_sheet_event(self, req, qstr):
         self._getParameters(qstr)
         out_dir = self.DRPFramework.config.output_directory
         args = Arguments(dir_name=out_dir, pattern="*.png", out_name="contact_sheet.html", cnt=-1)
-        self.DRPFramework.append_event("contact_sheet", args)
+        self.DRPFramework.append_event("contact_sheet", args, coalesce_key="contact_sheet")
         return json.dumps("OK"), self.jsonText
 
     def _img_to_png(self, imgData):
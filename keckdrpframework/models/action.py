@@ -10,20 +10,25 @@ class Action:
     Action, represents action to pass to a primitive.
     Action Constructor:
         Action (eventt_info, args)
-        event_info: a tuple (action_name, state_name, next_event)
+        event_info: a tuple (action_name, state_name, next_event) or (action_name, state_name, next_event, executor)
         args: Arguments (key1=val1, key2=val2, ...)
     """
 
     def __init__(self, event, event_info, args):
         """
         Action Constructor:
-        event_info: a tuple (action_name, state_name, next_event)
+        event_info: a tuple (action_name, state_name, next_event), optionally followed by the executor name
         args: Arguments (key1=val1, key2=val2, ...)
         """
         self.event = event
-        self.name, self.next_state, self.new_event = event_info
+        self.name, self.next_state, self.new_event = event_info[:3]
+        self.executor = event_info[3] if len(event_info) > 3 else None
         self.args = args
         self.output = None
+        # Set by the framework when this action is sampled for profiling
+        self.profile = False
+        # Memory used by execute(), set by the framework when config.memory_accounting is True
+        self.memory = None
 
     def __str__(self):
         return f"{self.name}, {self.args}, {self.next_state}, {self.new_event}"
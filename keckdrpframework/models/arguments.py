@@ -23,6 +23,21 @@ treated as keywords.
 """
 
 
+def _summarize(value, width):
+    """
+    Returns a short text for value: arrays by shape and type, long sequences by length,
+    other values truncated to width characters.
+    """
+    if hasattr(value, "shape") and hasattr(value, "dtype"):
+        return f"{type(value).__name__}{tuple(value.shape)} {value.dtype}"
+    if isinstance(value, Arguments):
+        return "{" + value.summary(width) + "}"
+    if isinstance(value, (list, tuple, dict, set)) and len(value) > 8:
+        return f"{type(value).__name__}[{len(value)}]"
+    text = str(value)
+    return text if len(text) <= width else text[: width - 3] + "..."
+
+
 class Arguments:
     """
     Arguments class
@@ -51,6 +66,17 @@ class Arguments:
     def __repr__(self):
         return self.__str__()
 
+    def summary(self, max_len=200):
+        """
+        Returns a compact description of the arguments, at most max_len characters.
+        Unlike __str__, arrays are shown by their shape and type, not their content.
+        """
+        width = max(10, max_len // 4)
+        out = [f"{i}: {_summarize(arg, width)}" for i, arg in enumerate(self._pos_args)]
+        out.extend(f'"{k}": {_summarize(self.__dict__[k], width)}' for k in self.iter_kw())
+        text = ", ".join(out)
+        return text if len(text) <= max_len else text[: max_len - 3] + "..."
+
     def __getitem__(self, ix):
         if isinstance(ix, str):
             return self.__dict__.__getitem__(ix)
@@ -21,8 +21,16 @@ class DataSet:
     """
     Represents the data set
     Content is stored in self.data_table, which is a pandas data frame.
+
+    Ingestion pauses while the event queue signals backpressure, see PriorityEventQueue.backpressure().
+    The files not ingested yet are the backlog, they are ingested by the monitor loop
+    once the queue has drained. Files given to append_item() or append_items() are kept in pending_files
+    until they are ingested.
     """
 
+    # Polling interval in seconds while there is a backlog
+    backlog_interval = 1
+
     def __init__(self, dirname, logger, config, event_queue):
         """
         Constructor
@@ -33,8 +41,12 @@ class DataSet:
         self.data_table = pd.DataFrame()
         self.must_stop = False
         self.monitor_interval = config.monitor_interval
+        self.ingest_batch_size = max(1, config.ingest_batch_size or 1)
         self.file_type = config.file_type
         self.event_queue = event_queue
+        self.backlog = False
+        # Files given explicitly and not ingested yet, as an ordered set
+        self.pending_files = dict()
         self.update_data_set()
 
     def digest_new_item(self, filename):
@@ -56,47 +68,109 @@ class DataSet:
 
         return None
 
-    def append_item(self, filename):
+    def _add_item(self, filename):
         """
-        Appends item, if not already exists.
+        Appends item to the table, if not already exists.
+        Returns the ingestion event for that item, or None.
         """
         if filename is None:
             self.logger.warning(f"filename is defined")
-            return
+            return None
 
         if not os.path.isfile(filename):
             self.logger.warning(f"{filename} is not a file")
-            return
+            return None
 
         if filename in self.data_table.index:
             self.logger.warning(f"{filename} is already in the table")
-            return
+            return None
 
         row = self.digest_new_item(filename)
-        if not row is None:
-            short = os.path.basename(filename)
-            self.logger.debug(f"Appending {short} to the data set")
-            self.data_table = self.data_table._append(row)
-            try:
-                self.event_queue.put(Event(self.config.default_ingestion_event, Arguments(name=filename)))
-            except:
-                self.logger.warning("There is no default ingestion event in the configuration file")
+        if row is None:
+            return None
+        short = os.path.basename(filename)
+        self.logger.debug(f"Appending {short} to the data set")
+        self.data_table = self.data_table._append(row)
+        try:
+            return Event(self.config.default_ingestion_event, Arguments(name=filename))
+        except:
+            self.logger.warning("There is no default ingestion event in the configuration file")
+        return None
+
+    def append_item(self, filename):
+        """
+        Appends item, if not already exists.
+        """
+        self.append_items([filename])
+
+    def append_items(self, filenames):
+        """
+        Appends the items that do not already exist, in the same way as update_data_set() appends
+        the files of the directory. The items that do not fit in the event queue are in the backlog.
+        """
+        for filename in filenames:
+            if filename in self.data_table.index:
+                self.logger.warning(f"{filename} is already in the table")
+                continue
+            self.pending_files[filename] = None
+        self.backlog = False
+        self._ingest(list(self.pending_files))
+
+    def _put_events(self, events):
+        if events:
+            self.event_queue.put_many(events)
 
     def update_data_set(self):
         """
         Updates the content of this data set.
         Called by loop() when monitoring the directory.
         Or can be called on demand.
+        Stops early and sets backlog if the event queue signals backpressure.
+        The events are sent in batches of config.ingest_batch_size, backpressure is checked before each batch.
+        With config.event_queue_maxsize, a batch is no larger than the room left in the queue,
+        so that ingesting before the framework starts does not wait for a full queue.
         """
         self.logger.debug("Ingesting data from: %s" % self.dir_name)
-        if self.dir_name is None:
-            return
-        if not os.path.isdir(self.dir_name):
-            return
-        flist = glob.glob(self.dir_name + "/" + self.file_type)
-        flist = sorted(flist)
+        flist = list(self.pending_files)
+        if self.dir_name is not None and os.path.isdir(self.dir_name):
+            flist += sorted(glob.glob(self.dir_name + "/" + self.file_type))
+        self.backlog = False
+        self._ingest(flist)
+
+    def _ingest(self, flist):
+        """
+        Appends the files of flist that are not in the table yet and sends their events.
+        Stops early and sets backlog if the event queue signals backpressure or has no room left.
+        """
+        batch = []
+        batch_size = self.ingest_batch_size
         for f in flist:
-            self.append_item(f)
+            if f in self.data_table.index:
+                self.pending_files.pop(f, None)
+                continue
+            if not batch:
+                batch_size = self._batch_size()
+                if batch_size <= 0 or self.event_queue.backpressure():
+                    self.logger.debug(f"Event queue is full, pausing ingestion at {os.path.basename(f)}")
+                    self.backlog = True
+                    return
+            event = self._add_item(f)
+            self.pending_files.pop(f, None)
+            if event is not None:
+                batch.append(event)
+            if len(batch) >= batch_size:
+                self._put_events(batch)
+                batch = []
+        self._put_events(batch)
+
+    def _batch_size(self):
+        """
+        Returns the size of the next batch of events, at most the room left below config.event_queue_maxsize.
+        """
+        maxsize = self.config.event_queue_maxsize
+        if not maxsize:
+            return self.ingest_batch_size
+        return min(self.ingest_batch_size, maxsize - self.event_queue.qsize())
 
     def get_info(self, index):
         """
@@ -125,31 +199,36 @@ class DataSet:
         except Exception as e:
             self.logger.warning(f"Failed to set data_table[{index},{column}] to {value}")
 
-    def _loop(self):
+    def _loop(self, backlog_only=False):
         """
         Waits for changes in the directory, then digests the changes.
         Maybe needs to monitor other events also.
-        
+        If backlog_only is True, returns once the backlog is ingested.
         """
         ok = True
         last_time = 0
         while ok:
-            dir_state = os.stat(self.dir_name)
-            curr_time = dir_state.st_mtime
-            if curr_time > last_time:
+            if self.dir_name is not None and os.path.isdir(self.dir_name):
+                curr_time = os.stat(self.dir_name).st_mtime
+            else:
+                curr_time = last_time
+            if curr_time > last_time or self.backlog:
                 self.update_data_set()
                 last_time = curr_time
-            time.sleep(self.monitor_interval)
+            if backlog_only and not self.backlog:
+                break
+            time.sleep(self.backlog_interval if self.backlog else self.monitor_interval)
             if self.must_stop:
                 break
 
-    def start_monitor(self):
+    def start_monitor(self, backlog_only=False):
         """
         Monitors for changes in the given directory.
         
         This must be called separately in the framework main thread before the starting the processing loop.
+        With backlog_only, the monitor stops once the backlog is ingested.
         """
-        thr = threading.Thread(target=self._loop)
+        thr = threading.Thread(target=self._loop, args=(backlog_only,))
         thr.setDaemon(True)
         thr.start()
 
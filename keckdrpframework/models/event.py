@@ -7,6 +7,8 @@ Created on Jul 8, 2019
 import uuid
 import datetime
 
+from keckdrpframework.utils.tracing import current_trace_id
+
 
 class Event(object):
     """
@@ -16,7 +18,7 @@ class Event(object):
 
     counter = 0
 
-    def __init__(self, name, args, recurrent=False):
+    def __init__(self, name, args, recurrent=False, key=None, coalesce_key=None, debounce=0, trace_id=None):
         """
         This class represents the an event, which solicitates an action.
         The association of an event to the wanted action is defined somewhere,
@@ -25,10 +27,29 @@ class Event(object):
         An recurrent event is an event that is re-issued after it is handled.
         For example, a periodic tasks can be implemented using recurrent events.
 
+        The partition key groups events that must be processed in order.
+        Events with different keys can be processed concurrently by the framework,
+        events with the same key are processed one at a time, in the order they are taken from the queues.
+        The events pushed by an action inherit the key of the event of that action, see derive().
+
+        Events with the same coalesce_key are duplicates. A duplicate put in the queue while
+        the previous one is still pending updates the arguments of the pending event, see queues.PriorityEventQueue.
+        With debounce > 0, the event is queued only after no duplicate has been put for debounce seconds.
+
+        attempts counts how many times the event was taken from a queue, see queues.PriorityEventQueue.
+
+        The trace id identifies the chain of events started by an ingested file, see utils/tracing.py.
+        By default, an event created while an action is running gets the trace id of that action,
+        otherwise it starts a new trace.
+
         Args:
             name: name of the event
             args: user data passed to the event
             recurrent: indicates if this event is a recurrent event.
+            key: partition key, default is args.name. None means no ordering constraint.
+            coalesce_key: key to identify duplicate events, None means no coalescing.
+            debounce: delay in seconds, used only with coalesce_key.
+            trace_id: trace id, default is the current trace id or the id of this event.
 
         """
         self.id = uuid.uuid1(clock_seq=self.counter).hex
@@ -38,9 +59,23 @@ class Event(object):
 
         self._recurrent = recurrent
         self._timestamp = datetime.datetime.utcnow()
+        self.key = key if key is not None else getattr(args, "name", None)
+        self.coalesce_key = coalesce_key
+        self.debounce = debounce
+        self.attempts = 0
+        if trace_id is None:
+            trace_id = current_trace_id()
+        self.trace_id = self.id if trace_id is None else trace_id
 
     def __str__(self):
         return f"Event {self.name}, args={self.args}"
 
     def set_recurrent(self, recurrent=False):
         self._recurrent = recurrent
+
+    def derive(self, name, args):
+        """
+        Returns a new event that continues the chain of this event.
+        The new event has the same partition key and the same trace id.
+        """
+        return Event(name, args, key=self.key, trace_id=self.trace_id)
@@ -27,6 +27,10 @@ class ProcessingContext:
         self.config = config
         self.data_set = None
         self.debug = False
+        # ActionProfiler, set by the framework when config.profile_actions is True
+        self.profiler = None
+        # Tracer, set by the framework when config.trace_events is True
+        self.tracer = None
 
     def push_hi_event(self, event_name, args):
         """
@@ -42,9 +46,10 @@ class ProcessingContext:
         """
         self.push_hi_event(event_name, args)
 
-    def append_event(self, event_name, args, recurrent=False):
+    def append_event(self, event_name, args, recurrent=False, coalesce_key=None, debounce=0):
         """
         Creates a new event and appends it to the low priority event queue.
         The low priority queue is local to the current process.
+        See Event for coalesce_key and debounce.
         """
-        self.event_queue.put(Event(event_name, args, recurrent=recurrent))
+        self.event_queue.put(Event(event_name, args, recurrent=recurrent, coalesce_key=coalesce_key, debounce=debounce))
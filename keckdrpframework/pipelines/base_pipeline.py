@@ -6,6 +6,9 @@ This is the base pipeline.
 The event table (or event_table0) has entries like:
     event_name: ("action_name", "new_state", "next_event")
 
+An optional 4th element selects the executor of the action, "inline", "thread" or "process":
+    event_name: ("action_name", "new_state", "next_event", "process")
+
 action_name is a string. 
 if action_name is a simple name, ie no packages:
     
@@ -21,6 +24,13 @@ if action_name is a simple name, ie no packages:
 action_name is a class, and name has packages,
 then use the apply() method of that class.
 
+The resolved actions are cached by name.
+Use set_event() to modify the event table at run time, it invalidates the cache.
+
+compile_event_table() resolves all actions at start up, see config.compile_event_table.
+Unknown actions and executors then raise an exception instead of being replaced by not_found()
+or by the inline executor at run time.
+
 @author: skwok
 """
 
@@ -28,6 +38,7 @@ import sys
 import time
 import importlib
 from keckdrpframework.models.arguments import Arguments
+from keckdrpframework.core.executors import EXECUTORS
 
 
 class BasePipeline:
@@ -55,6 +66,15 @@ class BasePipeline:
         self.logger = context.logger
         self.config = context.config
 
+        # Resolved actions, key is (prefix, action_name)
+        self._action_cache = dict()
+        # (pre_condition, action, post_condition), key is action_name
+        self._methods_cache = dict()
+        # Event table and event_table0 merged by compile_event_table(), values are (event_info, methods)
+        self._compiled_events = None
+        # (pre_condition, action, post_condition) resolved by compile_event_table(), key is action_name
+        self._compiled_methods = None
+
     def true(self, *args, **kargs):
         return True
 
@@ -83,6 +103,8 @@ class BasePipeline:
             obj = klass(action, context)
             return obj.apply()
 
+        # Used by the executors to run the primitive in a process pool
+        f.primitive_class = klass
         return f
 
     def _find_import_action(self, module_name):
@@ -107,13 +129,19 @@ class BasePipeline:
             return "".join(out)
 
         def get_apply_method(mod_prefix, name):
+            if not mod_prefix:
+                return None
             self.context.logger.debug(f"Importing mod {mod_prefix}, name {name}")
             try:
                 mod = importlib.import_module(mod_prefix)
                 if hasattr(mod, name):
                     return self._get_action_apply_method(getattr(mod, name))
-            except:
-                pass
+            except ModuleNotFoundError as e:
+                # Expected when the module is not in this prefix, report missing dependencies
+                if e.name is None or not mod_prefix.startswith(e.name):
+                    self.logger.warning(f"Failed importing {mod_prefix}, {e}")
+            except Exception as e:
+                self.logger.warning(f"Failed importing {mod_prefix}, {e}")
             return None
 
         prefixes = self.context.config.primitive_path
@@ -144,7 +172,96 @@ class BasePipeline:
     def _get_action(self, prefix, action):
         """
         Helper function to find the given action.
-        Returns a function for the given action name or true() if not found
+        Returns a function for the given action name or None if not found.
+        The result, including None, is cached.
+        """
+        key = (prefix, action)
+        try:
+            return self._action_cache[key]
+        except KeyError:
+            pass
+
+        f = self._resolve_action(prefix, action)
+        self._action_cache[key] = f
+        return f
+
+    def invalidate_action_cache(self):
+        """
+        Clears the cache of resolved actions.
+        Needed when methods or primitives are replaced at run time.
+        A compiled event table is compiled again.
+        """
+        self._action_cache = dict()
+        self._methods_cache = dict()
+        if self._compiled_events is not None:
+            self.compile_event_table()
+
+    def set_event(self, event_name, event_info):
+        """
+        Adds or replaces an entry in the event table.
+        event_info is ("action_name", "new_state", "next_event").
+        If the event table is compiled, the new entry is checked first.
+        """
+        if self._compiled_events is not None:
+            error = self._check_event_info(event_name, event_info)
+            if error is not None:
+                raise Exception(f"Invalid event table entry, {error}")
+        self.event_table[event_name] = event_info
+        self.invalidate_action_cache()
+
+    def _check_event_info(self, event_name, event_info):
+        """
+        Checks an event table entry and resolves its action.
+        Returns an error message or None.
+        """
+        if not isinstance(event_info, tuple) or len(event_info) not in (3, 4):
+            return f"{event_name}: entry must be (action, state, next_event[, executor]), got {event_info}"
+        action_name = event_info[0]
+        if not isinstance(action_name, str):
+            return f"{event_name}: action name must be a string, got {action_name}"
+        if self._get_action("", action_name) is None:
+            return f"{event_name}: action {action_name} not found"
+        executor = event_info[3] if len(event_info) > 3 else None
+        if executor is not None and executor not in EXECUTORS:
+            return f"{event_name}: unknown executor {executor}, must be one of {', '.join(EXECUTORS)}"
+        return None
+
+    def compile_event_table(self):
+        """
+        Resolves the actions of all entries in event_table and event_table0.
+        Raises an exception listing the invalid entries, if any.
+        After this, event_to_action() and get_action_methods() are single dictionary lookups.
+        Returns the compiled table, values are (event_info, (pre_condition, action, post_condition)).
+        """
+        t0 = time.time()
+        compiled = dict()
+        methods = dict()
+        errors = []
+        event_table = getattr(self, "event_table", None) or dict()
+        for table in (self.event_table0, event_table):
+            for event_name, event_info in table.items():
+                t1 = time.time()
+                error = self._check_event_info(event_name, event_info)
+                if error is not None:
+                    errors.append(error)
+                    continue
+                action_name = event_info[0]
+                if action_name not in methods:
+                    methods[action_name] = self.get_action_methods(action_name)
+                compiled[event_name] = (event_info, methods[action_name])
+                self.logger.debug(f"Compiled {event_name}: {event_info}, {time.time() - t1:.3f} s")
+
+        if errors:
+            raise Exception("Invalid event table, " + "; ".join(errors))
+
+        self._compiled_events = compiled
+        self._compiled_methods = methods
+        self.logger.info(f"Compiled event table, {len(compiled)} events, {len(methods)} actions in {time.time() - t0:.3f} s")
+        return compiled
+
+    def _resolve_action(self, prefix, action):
+        """
+        Finds the given action, see _get_action().
         """
         parts = action.split(".")
         if len(parts) == 1:
@@ -207,6 +324,22 @@ class BasePipeline:
             return self.not_found(action)
         return f
 
+    def get_action_methods(self, action):
+        """
+        Returns the tuple (pre_condition, action, post_condition) for the given action name.
+        """
+        if self._compiled_methods is not None:
+            methods = self._compiled_methods.get(action)
+            if methods is not None:
+                return methods
+        try:
+            return self._methods_cache[action]
+        except KeyError:
+            pass
+        methods = (self.get_pre_action(action), self.get_action(action), self.get_post_action(action))
+        self._methods_cache[action] = methods
+        return methods
+
     def noop(self, action, context):
         """
         One of the default actions.
@@ -219,8 +352,8 @@ class BasePipeline:
         One of the default actions.
         Useful for testing.
         """
-        pending_events = context.event_queue.get_pending()
-        self.logger.info("Pending events " + str(pending_events))
+        counts = context.event_queue.get_counts()
+        self.logger.info(f"Pending events {counts['pending']}, next {context.event_queue.peek()}")
         return action.args
 
     def echo(self, action, context):
@@ -233,10 +366,15 @@ class BasePipeline:
     def no_event(self, action, context):
         """
         The no_event event.
+        Waits until a new event arrives in the event queue, at most no_event_wait_time seconds.
         """
         wait_time = min(30, max(5, self.context.config.no_event_wait_time))
-        self.logger.debug(f"No event in queue, waiting {wait_time} s before continuing")
-        time.sleep(wait_time)
+        self.logger.debug(f"No event in queue, waiting up to {wait_time} s for new events")
+        try:
+            context.event_queue.wait_for_event(wait_time)
+        except Exception:
+            # Queue without arrival notification
+            time.sleep(wait_time)
         return action.args
 
     def _event_to_action(self, event, context):
@@ -256,6 +394,11 @@ class BasePipeline:
         Checks the local event_table, 
         if no matching event found, then checks the default actions in table0.
         """
+        if self._compiled_events is not None:
+            entry = self._compiled_events.get(event.name)
+            if entry is not None:
+                return entry[0]
+            return self._event_to_action(event, context)
         try:
             event_info = self.event_table.get(event.name)
             if not event_info is None:
@@ -7,6 +7,7 @@ Created on Jul 31, 2019
 import numpy as np
 import astropy.io.fits as pf
 from keckdrpframework.primitives.base_primitive import BasePrimitive
+from keckdrpframework.primitives.simple_fits_reader import open_nowarning
 
 
 class BaseImg(BasePrimitive):
@@ -22,18 +22,44 @@ Subclassses should be defined like this:
         return result
         
 Recipes use apply()
+
+To run a primitive in the thread pool or in the process pool of the framework,
+set the class attribute executor to "thread" or "process". See core/executors.py.
+
+If batch_size is greater than 1, the framework collects up to batch_size queued events
+of the same name, waiting at most batch_wait seconds, and calls apply_batch() once for all of them.
+Primitives that can process many inputs at once, for example readers or stackers, override apply_batch().
+
+When the framework profiles an action, see utils/profiling.py, apply() is profiled
+even if it runs in the thread pool.
+When the framework traces events, see utils/tracing.py, apply() records a span.
+
+With AsyncFramework, primitives are run with async_apply(), which records the same span.
+The default async_perform() runs _perform() in the default executor, profiled there if the action is sampled.
+Primitives doing I/O can override async_perform() instead of _perform(), they are not profiled,
+their code runs in the event loop together with other actions.
         
         
 @author: skwok
 """
 
+import asyncio
 import traceback
 
+from keckdrpframework.utils.tracing import current_trace_id, use_trace
+
 class BasePrimitive:
     """
     This is the base primitive.
     """
 
+    # "inline", "thread" or "process", None means config.default_executor
+    executor = None
+
+    # Maximum number of events processed in one call to apply_batch(), and how long to wait for them, in seconds
+    batch_size = 1
+    batch_wait = 0
+
     def __init__(self, action, context):
         """
         Constructor
@@ -54,6 +80,26 @@ class BasePrimitive:
         raise Exception("Not yet implemented")
 
     def apply(self):
+        # In a thread pool, the trace is that of the action's event
+        trace_id = current_trace_id() or getattr(getattr(self.action, "event", None), "trace_id", None)
+        tracer = getattr(self.context, "tracer", None)
+        if tracer is not None:
+            with tracer.span(self.__class__.__name__, trace_id, cat="primitive"):
+                return self._profiled_apply()
+        with use_trace(trace_id):
+            return self._profiled_apply()
+
+    def _profiled_apply(self):
+        return self._profiled(self._apply)
+
+    def _profiled(self, method):
+        profiler = getattr(self.context, "profiler", None)
+        if profiler is not None and getattr(self.action, "profile", False) and not profiler.is_active():
+            with profiler.profile(self.action.name):
+                return method()
+        return method()
+
+    def _apply(self):
         try:
             if self._pre_condition():
                 self.output = self._perform()
@@ -63,7 +109,46 @@ class BasePrimitive:
             self.logger.error(f"Failed executing primitive {self.__class__.__name__}: {e}\n{traceback.format_exc()}")
             raise(e)
         return None
-    
+
+    async def async_perform(self):
+        """
+        Awaitable version of _perform().
+        The default runs _perform() in the default executor of the event loop.
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self._profiled, self._perform)
+
+    async def async_apply(self):
+        """
+        Same as apply(), but awaits async_perform().
+        """
+        trace_id = current_trace_id() or getattr(getattr(self.action, "event", None), "trace_id", None)
+        tracer = getattr(self.context, "tracer", None)
+        if tracer is not None:
+            with tracer.span(self.__class__.__name__, trace_id, cat="primitive"):
+                return await self._async_apply()
+        with use_trace(trace_id):
+            return await self._async_apply()
+
+    async def _async_apply(self):
+        try:
+            if self._pre_condition():
+                self.output = await self.async_perform()
+                if self._post_condition():
+                    return self.output
+        except Exception as e:
+            self.logger.error(f"Failed executing primitive {self.__class__.__name__}: {e}\n{traceback.format_exc()}")
+            raise(e)
+        return None
+
+    @classmethod
+    def apply_batch(cls, actions, context):
+        """
+        Runs this primitive for a list of actions, returns the list of outputs.
+        The default applies the primitive to each action in turn.
+        """
+        return [cls(action, context).apply() for action in actions]
+
     def __call__(self):
         """
         Makes objects of this calls callable.
@@ -22,16 +22,28 @@ from keckdrpframework.config.framework_config import ConfigClass
 
 def _parseArguments(in_args):
     description = "Append event to event"
-    usage = "\n{} config_file event_name event_argument\n".format(in_args[0])
-    epilog = "\nAppend event to event\nFor example: add_event next_file file_0000.fits"
+    usage = "\n{} config_file event_name event_argument [event_argument ...]\n".format(in_args[0])
+    epilog = (
+        "\nAppend event to event\nFor example: add_event next_file file_0000.fits"
+        "\nWith several arguments, one event per argument is appended, in a single call to the queue manager."
+    )
 
     parser = argparse.ArgumentParser(prog=f"{in_args[0]}", description=description, usage=usage, epilog=epilog)
     parser.add_argument("-c", "--config", dest="config_file", type=str, help="Configuration file")
 
     parser.add_argument("-H", "--host", dest="hostname", type=str, help="Host name")
     parser.add_argument("-p", "--port", dest="portnr", type=str, help="Port number")
+    parser.add_argument(
+        "-C", "--coalesce", dest="coalesce", action="store_true", help="Coalesce with the same pending event"
+    )
+    parser.add_argument(
+        "-d", "--debounce", dest="debounce", type=float, default=0, help="Wait time for duplicates in seconds"
+    )
+    parser.add_argument(
+        "-f", "--file", dest="argument_file", type=str, help="File with one event argument per line, - for stdin"
+    )
     parser.add_argument(dest="event_name", type=str, help="Event name")
-    parser.add_argument(dest="event_argument", type=str, help="Event argument")
+    parser.add_argument(dest="event_arguments", type=str, nargs="*", help="Event arguments")
     try:
         return parser.parse_args(in_args[1:])
     except:
@@ -47,14 +59,27 @@ if __name__ == "__main__":
     hostname = cfg.queue_manager_hostname if args.hostname is None else args.hostname
     portnr = cfg.queue_manager_portnr if args.portnr is None else args.portnr
     auth_code = cfg.queue_manager_auth_code
+    shards = cfg.queue_manager_shards or 1
 
-    queue = queues.get_event_queue(hostname, portnr, auth_code)
+    queue = queues.get_event_queue(hostname, portnr, auth_code, shards)
     print("Event queue:")
     print(f"Hostname = {hostname}\nPort nr = {portnr}\n")
 
     if queue is None:
         print("Failed to connect to Queue Manager")
     else:
-        event = Event(args.event_name, Arguments(name=args.event_argument))
-        queue.put(event)
-        print("Event added")
+        event_arguments = list(args.event_arguments)
+        if args.argument_file is not None:
+            with sys.stdin if args.argument_file == "-" else open(args.argument_file) as fh:
+                event_arguments.extend(line.strip() for line in fh if line.strip())
+
+        events = []
+        for event_argument in event_arguments:
+            coalesce_key = None
+            if args.coalesce or args.debounce:
+                coalesce_key = f"{args.event_name}:{event_argument}"
+            events.append(
+                Event(args.event_name, Arguments(name=event_argument), coalesce_key=coalesce_key, debounce=args.debounce)
+            )
+        queue.put_many(events)
+        print(f"{len(events)} event(s) added")
@@ -27,6 +27,9 @@ def _parseArguments(in_args):
     parser.add_argument("-c", "--config", dest="config_file", type=str, help="Configuration file")
     parser.add_argument("-H", "--host", dest="hostname", type=str, help="Host name")
     parser.add_argument("-p", "--port", dest="portnr", type=str, help="Port number")
+    parser.add_argument("-s", "--start", dest="start", type=int, default=0, help="First event to list")
+    parser.add_argument("-n", "--count", dest="count", type=int, default=20, help="Number of events to list")
+    parser.add_argument("-w", "--width", dest="width", type=int, default=200, help="Maximum length of arguments")
 
     try:
         return parser.parse_args(in_args[1:])
@@ -43,8 +46,9 @@ if __name__ == "__main__":
     hostname = cfg.queue_manager_hostname if args.hostname is None else args.hostname
     portnr = cfg.queue_manager_portnr if args.portnr is None else args.portnr
     auth_code = cfg.queue_manager_auth_code
+    shards = cfg.queue_manager_shards or 1
 
-    queue = queues.get_event_queue(hostname, portnr, auth_code)
+    queue = queues.get_event_queue(hostname, portnr, auth_code, shards)
     print("Event queue:")
     print(f"Hostname = {hostname}\nPort nr = {portnr}\n")
 
@@ -52,11 +56,16 @@ if __name__ == "__main__":
         print("Failed to connect to Queue Manager")
     else:
         print("Event queue size =", queue.qsize())
-        pending = queue.get_pending()
-        for i, elem in enumerate(pending):
-            print(f"Event #{i}: {elem}")
+        counts = queue.get_counts()
+        for state in ("pending", "in_progress"):
+            print(f"{state}: " + ", ".join(f"{name}={n}" for name, n in sorted(counts[state].items())))
+
+        print("Pending:")
+        pending = queue.get_pending_summary(args.start, args.count, args.width)
+        for i, desc in enumerate(pending, args.start):
+            print(f"Event #{i}: {desc['name']}, {desc['args']}")
 
         print("In progress:")
-        in_progress = queue.get_in_progress()
-        for i, (id, evt) in enumerate(in_progress.items()):
-            print(f"Event #{i}: {evt.name}, {evt.args}")
+        in_progress = queue.get_in_progress_summary(args.start, args.count, args.width)
+        for i, desc in enumerate(in_progress, args.start):
+            print(f"Event #{i}: {desc['name']}, {desc['args']}, attempts {desc['attempts']}")
@@ -46,7 +46,7 @@ class FrameworkInterface:
             hostname = cfg.queue_manager_hostname
             portnr = cfg.queue_manager_portnr
             auth_code = cfg.queue_manager_auth_code
-            self.queue = queues.get_event_queue(hostname, portnr, auth_code)
+            self.queue = queues.get_event_queue(hostname, portnr, auth_code, cfg.queue_manager_shards or 1)
         return self.queue is not None
 
     def start_event_queue(self):
@@ -60,7 +60,7 @@ class FrameworkInterface:
             hostname = cfg.queue_manager_hostname
             portnr = cfg.queue_manager_portnr
             auth_code = cfg.queue_manager_auth_code
-            queues.start_queue_manager(hostname, portnr, auth_code, logger=None)
+            queues.start_queue_manager(hostname, portnr, auth_code, None, **queues.queue_manager_options(cfg))
             return self._get_queue()
         return q_ok
 
@@ -92,13 +92,13 @@ class FrameworkInterface:
                 self.queue = None
         return None
 
-    def pending_events(self):
+    def pending_events(self, start=0, count=None):
         """
-        Returns a copy of the event queue, an empty tuple or None.
+        Returns a copy of the event queue, or count events from position start, an empty tuple or None.
         """
         if self._get_queue():
             try:
-                res = self.queue.get_pending()
+                res = self.queue.get_pending(start, count)
                 if res is None:
                     return tuple()
                 else:
@@ -108,6 +108,17 @@ class FrameworkInterface:
                 self.queue = None
         return None
 
+    def event_counts(self):
+        """
+        Returns the number of pending and in progress events by name, or None.
+        """
+        if self._get_queue():
+            try:
+                return self.queue.get_counts()
+            except:
+                self.queue = None
+        return None
+
     def in_progress_events(self):
         """
         Returns the in_progress dict, an empty dict or None
@@ -0,0 +1,73 @@
+"""
+Summary of action profiles
+
+Prints the top functions of the profiles written by the framework
+when profile_actions is enabled in the configuration.
+
+Created on 2026-10-18
+
+"""
+
+import os
+import sys
+import glob
+import pstats
+import argparse
+
+from interface import import_module
+
+import_module("keckdrpframework")
+
+from keckdrpframework.config.framework_config import ConfigClass
+from keckdrpframework.utils.profiling import ActionProfiler
+
+
+def _parseArguments(in_args):
+    description = "Summary of action profiles"
+    usage = "\n{} [-c config_file] [-d directory] [-s sort] [-n lines] [action ...]\n".format(in_args[0])
+    epilog = "\nPrints the profile of each action\nFor example: profile_summary -s tottime hist_equal2d"
+
+    parser = argparse.ArgumentParser(prog=f"{in_args[0]}", description=description, usage=usage, epilog=epilog)
+    parser.add_argument("-c", "--config", dest="config_file", type=str, help="Configuration file")
+    parser.add_argument("-d", "--directory", dest="directory", type=str, help="Profile directory, default temp_directory")
+    parser.add_argument("-s", "--sort", dest="sort", type=str, default="cumulative", help="Sort key, see pstats")
+    parser.add_argument("-n", "--lines", dest="lines", type=int, default=20, help="Number of functions to print")
+    parser.add_argument("--callers", dest="callers", action="store_true", help="Print callers of the top functions")
+    parser.add_argument(dest="actions", nargs="*", type=str, help="Action names, default all")
+    try:
+        return parser.parse_args(in_args[1:])
+    except:
+        sys.exit(0)
+
+
+def profile_files(directory, actions):
+    """
+    Returns the profile files for the given actions, or all profile files in the directory.
+    """
+    if actions:
+        profiler = ActionProfiler(directory)
+        return [profiler.get_file(a) for a in actions]
+    return sorted(glob.glob(os.path.join(directory, "profile_*.pstats")))
+
+
+if __name__ == "__main__":
+    args = _parseArguments(sys.argv)
+    cfg = ConfigClass(args.config_file)
+    directory = cfg.temp_directory if args.directory is None else args.directory
+
+    files = profile_files(directory, args.actions)
+    if not files:
+        print(f"No profiles in {directory}")
+
+    for fname in files:
+        name = os.path.basename(fname)[len("profile_") : -len(".pstats")]
+        print(f"\n=== Action {name} ===")
+        try:
+            stats = pstats.Stats(fname)
+        except Exception as e:
+            print(f"Failed to read {fname}, {e}")
+            continue
+        stats.strip_dirs().sort_stats(args.sort)
+        stats.print_stats(args.lines)
+        if args.callers:
+            stats.print_callers(args.lines)
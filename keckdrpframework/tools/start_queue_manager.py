@@ -44,11 +44,14 @@ if __name__ == "__main__":
     hostname = cfg.queue_manager_hostname if args.hostname is None else args.hostname
     portnr = cfg.queue_manager_portnr if args.portnr is None else args.portnr
     auth_code = cfg.queue_manager_auth_code
+    shards = cfg.queue_manager_shards or 1
 
-    if queues.get_event_queue(hostname, portnr, auth_code) is not None:
+    if queues.get_event_queue(hostname, portnr, auth_code, shards) is not None:
         print("Queue Manager is already running\n")
     else:
-        queue = queues.start_queue_manager(hostname, portnr, auth_code, logger=logging.getLogger())
+        queue = queues.start_queue_manager(
+            hostname, portnr, auth_code, logging.getLogger(), **queues.queue_manager_options(cfg)
+        )
 
         print(f"Hostname = {hostname}\nPort nr = {portnr}\n")
         print("Started Queue Manager.")
@@ -43,8 +43,9 @@ if __name__ == "__main__":
     hostname = cfg.queue_manager_hostname if args.hostname is None else args.hostname
     portnr = cfg.queue_manager_portnr if args.portnr is None else args.portnr
     auth_code = cfg.queue_manager_auth_code
+    shards = cfg.queue_manager_shards or 1
 
-    queue = queues.get_event_queue(hostname, portnr, auth_code)
+    queue = queues.get_event_queue(hostname, portnr, auth_code, shards)
     print(f"Hostname = {hostname}\nPort nr = {portnr}\n")
     if queue is None:
         print("Failed to connect to Queue Manager")
@@ -15,9 +15,18 @@ from keckdrpframework.models.data_set import DataSet
 
 from keckdrpframework.config.framework_config import ConfigClass
 from keckdrpframework.core.queues import SimpleEventQueue, get_event_queue, QueueServer, _get_queue_manager, start_queue_manager
+from keckdrpframework.core.queues import PriorityEventQueue, SharedArrayEventQueue, BatchingQueueClient
+from keckdrpframework.core.queues import SqliteEventQueue, SharedMemoryEventQueue, ShardedEventQueue
+from keckdrpframework.utils.shared_arrays import SharedArray
 
 import time
+import queue
+import threading
 import multiprocessing
+import sqlite3
+from multiprocessing import shared_memory
+
+import numpy as np
 
 #
 # Test queues
@@ -42,12 +51,495 @@ def test_simple_queue():
     assert e2.args.i == 1, "Wrong event argument"
 
 
+def test_priority_queue():
+    eq = PriorityEventQueue(levels=3)
+    eq.put(Event("low", None))
+    eq.put(Event("mid", None), 1)
+    eq.put(Event("high", None), 0)
+    assert eq.qsize() == 3, "Size mismatch"
+    assert eq.level(2).qsize() == 1, "Level size mismatch"
+
+    names = [eq.get().name for i in range(3)]
+    assert names == ["high", "mid", "low"], f"Wrong priority order {names}"
+    assert len(eq.get_in_progress()) == 3, "Events not in progress"
+    assert len(eq.level(0).get_in_progress()) == 1, "Level in progress mismatch"
+    assert eq.in_progress_count() == 3 and eq.level(0).in_progress_count() == 1, "In progress count mismatch"
+
+
+def test_priority_queue_aging():
+    eq = PriorityEventQueue(levels=2, aging_time=0.1)
+    eq.put(Event("old low", None), 1)
+    time.sleep(0.3)
+    eq.put(Event("new high", None), 0)
+    assert eq.get().name == "old low", "Low priority event did not age"
+
+
+def test_priority_queue_wakeup():
+    eq = PriorityEventQueue(levels=2)
+
+    def put_later():
+        time.sleep(0.2)
+        eq.level(0).put(Event("high", None))
+
+    threading.Thread(target=put_later).start()
+    t0 = time.time()
+    ev = eq.get(block=True, timeout=10)
+    assert ev.name == "high" and time.time() - t0 < 5, "Consumer not woken up"
+
+
+def test_coalesce_events():
+    eq = PriorityEventQueue(levels=2)
+    for i in range(5):
+        eq.put(Event("next_file", Arguments(name=f"file{i}"), coalesce_key="next_file"))
+    eq.put(Event("other", None))
+    assert eq.qsize() == 2, "Events not coalesced"
+
+    ev = eq.get(block=False)
+    assert ev.name == "next_file" and ev.args.name == "file4", "Pending event not updated"
+    # Once taken, a new event with the same key is queued again
+    eq.put(Event("next_file", Arguments(name="file5"), coalesce_key="next_file"))
+    assert eq.qsize() == 2
+
+
+def test_debounce_events():
+    eq = PriorityEventQueue(levels=2)
+    for i in range(3):
+        eq.put(Event("contact_sheet", Arguments(name=f"sheet{i}"), coalesce_key="sheet", debounce=0.3))
+        time.sleep(0.1)
+    with pytest.raises(Exception):
+        eq.get(block=False)
+    assert eq.qsize() == 1
+
+    t0 = time.time()
+    ev = eq.get(block=True, timeout=10)
+    assert ev.args.name == "sheet2" and time.time() - t0 < 5, "Debounced event not released"
+    assert eq.qsize() == 0
+
+
+def test_bounded_queue():
+    eq = PriorityEventQueue(levels=2, maxsize=[None, 2], high_water=[3, None])
+    eq.put(Event("a", None))
+    eq.put(Event("b", None))
+    with pytest.raises(queue.Full):
+        eq.put(Event("c", None), block=False)
+    with pytest.raises(queue.Full):
+        eq.put(Event("c", None), timeout=0.1)
+    # The high priority level has no limit
+    for i in range(5):
+        eq.level(0).put(Event(f"hi{i}", None))
+    assert eq.backpressure(0) and not eq.backpressure(1), "Unexpected backpressure"
+
+    def get_later():
+        time.sleep(0.2)
+        for i in range(6):
+            eq.get(block=False)
+
+    threading.Thread(target=get_later).start()
+    eq.put(Event("c", None), timeout=10)
+    assert eq.level(1).qsize() == 2
+
+
+def test_backpressure():
+    eq = SimpleEventQueue(high_water=4)
+    for i in range(4):
+        eq.put(Event(f"e{i}", None))
+    assert eq.backpressure(), "No backpressure at high water mark"
+    eq.get(block=False)
+    assert eq.backpressure(), "Backpressure released above low water mark"
+    eq.get(block=False)
+    assert not eq.backpressure(), "Backpressure not released"
+
+
+def test_shared_array_queue():
+    eq = SharedArrayEventQueue(SimpleEventQueue(), min_bytes=1024)
+    img = np.arange(100 * 100, dtype=np.float32).reshape(100, 100)
+    small = np.arange(4)
+    eq.put(Event("next_file", Arguments(img, name="f1", small=small)))
+
+    sent = eq.queue.head()
+    handle = sent.args[0]
+    assert isinstance(handle, SharedArray) and sent.args.small is small, "Array not moved to shared memory"
+
+    ev = eq.get(block=False)
+    assert np.array_equal(ev.args[0], img), "Array not restored"
+    eq.discard(ev.id)
+    with pytest.raises(FileNotFoundError):
+        shared_memory.SharedMemory(name=handle.name)
+
+    # Coalesced duplicates replace the arguments in the queue, their arrays are not exported
+    for i in range(2):
+        eq.put(Event("next_file", Arguments(img, name="f2"), coalesce_key="f2"))
+    assert eq.queue.qsize() == 1 and eq.queue.head().args[0] is img, "Coalesced event exported"
+
+
+def test_shared_array_queue_lease(tmp_path):
+    # Each get() returns a copy of the event, as with the queue manager
+    shared = SqliteEventQueue(str(tmp_path / "queue.sqlite"), visibility_timeout=0.2, max_attempts=2)
+    worker1 = SharedArrayEventQueue(shared, min_bytes=1024, max_attempts=2)
+    worker2 = SharedArrayEventQueue(shared, min_bytes=1024, max_attempts=2)
+    img = np.arange(100 * 100, dtype=np.float32).reshape(100, 100)
+    worker1.put(Event("next_file", Arguments(img, name="f1")))
+    handle = shared.head().args[0]
+
+    ev1 = worker1.get(block=False)
+    time.sleep(0.3)
+    # The lease has expired, the event is queued again with the same segment
+    assert worker1.renew([ev1.id]) == [ev1.id] and worker1.discard(ev1.id) is None
+    ev2 = worker2.get(block=False)
+    assert ev2.attempts == 2 and np.array_equal(ev2.args[0], img), "Array removed by the late discard"
+
+    # Taken max_attempts times, the segment is removed by the last worker
+    time.sleep(0.3)
+    assert [e.name for e in shared.get_failed()] == ["next_file"]
+    assert worker2.ack_many([ev2.id]) == 0
+    with pytest.raises(FileNotFoundError):
+        shared_memory.SharedMemory(name=handle.name)
+    shared.close()
+
+
+def test_batched_queue():
+    eq = PriorityEventQueue(levels=2)
+    assert eq.put_many([Event(f"lo{i}", None) for i in range(3)]) == 3
+    eq.put_many([Event("hi", None)], priority=0)
+
+    events = eq.get_many(3, block=False)
+    assert [ev.name for ev in events] == ["hi", "lo0", "lo1"], "Wrong order"
+    assert len(eq.get_in_progress()) == 3, "Events not in progress"
+    assert eq.ack_many([ev.id for ev in events]) == 3 and not eq.get_in_progress(), "Events not acknowledged"
+
+    events = eq.exchange([Event("lo3", None)], [], 5, block=False)
+    assert [ev.name for ev in events] == ["lo2", "lo3"], "Exchange failed"
+    assert eq.get_many(5, block=True, timeout=0.1) == [], "Empty queue returned events"
+
+
+def test_batching_client():
+    eq = SimpleEventQueue()
+    client = BatchingQueueClient(eq, batch_size=3, batch_puts=True)
+    client.put(Event("e0", None))
+    client.put(Event("e1", None))
+    assert eq.qsize() == 0, "Events sent before the batch is full"
+    client.put(Event("e2", None))
+    assert eq.qsize() == 3, "Full batch not sent"
+
+    ev = client.get(block=False)
+    client.discard(ev.id)
+    assert ev.id in eq.get_in_progress(), "Acknowledgement not buffered"
+    events = client.get_many(5, block=False)
+    assert [e.name for e in events] == ["e1", "e2"] and ev.id not in eq.get_in_progress(), "Acknowledgement not sent"
+
+    client.put(Event("e3", None))
+    assert client.qsize() == 1, "Buffer not flushed"
+
+    # Without batch_puts, events are sent at once with the buffered acknowledgements
+    client = BatchingQueueClient(eq, batch_size=3)
+    ev = client.get(block=False)
+    client.discard(ev.id)
+    client.put(Event("e4", None))
+    assert eq.qsize() == 1 and ev.id not in eq.get_in_progress(), "Event not sent"
+    with pytest.raises(queue.Full):
+        BatchingQueueClient(SimpleEventQueue(maxsize=1), batch_size=3).put_many([Event("e5", None)] * 2, block=False)
+
+
+def test_lease_expiry():
+    eq = SimpleEventQueue()
+    eq.put_many([Event(f"e{i}", None) for i in range(3)])
+    events = eq.get_many(3, block=False, lease=0.1)
+    eq.discard(events[0].id)
+    assert eq.qsize() == 0, "Leased events still pending"
+    time.sleep(0.2)
+    assert [ev.name for ev in eq.get_pending()] == ["e1", "e2"], "Expired events not re-queued in order"
+    assert not eq.get_in_progress(), "Expired events still in progress"
+
+
+def test_visibility_timeout():
+    eq = SimpleEventQueue(visibility_timeout=0.5, max_attempts=2)
+    eq.put(Event("e", None))
+    ev = eq.get(block=False)
+    time.sleep(0.25)
+    assert eq.renew([ev.id]) == [], "Lease not renewed"
+    time.sleep(0.35)
+    assert eq.qsize() == 0 and ev.id in eq.get_in_progress(), "Renewed lease expired"
+
+    time.sleep(0.25)
+    ev = eq.get(block=False)
+    assert ev.attempts == 2, "Attempts not counted"
+    time.sleep(0.6)
+    assert eq.qsize() == 0 and [e.id for e in eq.get_failed()] == [ev.id], "Event not given up after max_attempts"
+    assert eq.renew([ev.id]) == [ev.id], "Lost lease not reported"
+
+
+def test_prefetch_client():
+    eq = SimpleEventQueue()
+    eq.put_many([Event(f"e{i}", None) for i in range(4)])
+    client = BatchingQueueClient(eq, prefetch=3, lease=0.2)
+    ev = client.get(block=False)
+    assert ev.name == "e0" and eq.qsize() == 1 and len(eq.get_in_progress()) == 3, "Events not prefetched"
+    client.discard(ev.id)
+    client.flush()
+    assert client.get(block=False).name == "e1", "Prefetched event not returned"
+
+    # e1 is not discarded in time, e2 expires in the buffer
+    time.sleep(0.3)
+    events = client.get_many(4, block=False)
+    assert [ev.name for ev in events] == ["e1", "e2", "e3"], "Expired events not returned"
+    client.ack_many([ev.id for ev in events])
+
+    eq.put_many([Event("e4", None), Event("e5", None)])
+    ev = client.get(block=False)
+    client.close()
+    assert [e.name for e in eq.get_pending()] == ["e5"], "Prefetched event not returned at close"
+    assert list(eq.get_in_progress()) == [ev.id], "Acknowledgements not sent"
+
+    # renew() sends the buffered acknowledgements first
+    client = BatchingQueueClient(eq, prefetch=2, lease=0.2)
+    client.discard(ev.id)
+    assert client.renew([]) == [] and not eq.get_in_progress(), "Acknowledgements not sent before renewal"
+
+
+def test_sqlite_queue(tmp_path):
+    fname = str(tmp_path / "queue.sqlite")
+    eq = SqliteEventQueue(fname, levels=2)
+    eq.put_many([Event(f"lo{i}", None) for i in range(3)])
+    eq.put(Event("hi", None), priority=0)
+    eq.put(Event("dup", Arguments(name="a"), coalesce_key="dup"))
+    eq.put(Event("dup", Arguments(name="b"), coalesce_key="dup"))
+    assert eq.qsize() == 5 and eq.head().name == "hi"
+
+    ev = eq.get(block=False)
+    assert ev.name == "hi" and ev.attempts == 1 and list(eq.get_in_progress()) == [ev.id]
+    assert eq.discard(ev.id).name == "hi" and not eq.get_in_progress()
+    ev = eq.get(block=False)
+    eq.re_append(ev.id)
+    assert [e.name for e in eq.get_pending()] == ["lo1", "lo2", "dup", "lo0"], "Event not re-appended at the end"
+    assert eq.get_pending()[2].args.name == "b", "Events not coalesced"
+    assert [e.name for e in eq.get_matching("lo2", 5)] == ["lo2"]
+    assert eq.get_counts() == {"pending": {"lo1": 1, "dup": 1, "lo0": 1}, "in_progress": {"lo2": 1}}
+    assert [e.name for e in eq.get_pending(1, 1)] == ["dup"] and eq.peek()["name"] == "lo1"
+    assert eq.get_in_progress_summary()[0]["name"] == "lo2"
+    eq.close()
+
+    # Pending and in progress events are kept
+    eq = SqliteEventQueue(fname, levels=2)
+    assert [e.name for e in eq.get_pending()] == ["lo1", "lo2", "dup", "lo0"], "Events lost"
+    events = eq.get_many(10, block=True, timeout=0.1)
+    assert len(events) == 4 and eq.ack_many([e.id for e in events]) == 4 and eq.qsize() == 0
+    with pytest.raises(queue.Empty):
+        eq.get(block=True, timeout=0.1)
+    eq.close()
+
+
+def test_sqlite_queue_lease(tmp_path):
+    eq = SqliteEventQueue(str(tmp_path / "queue.sqlite"), visibility_timeout=0.2, max_attempts=2, maxsize=2)
+    eq.put(Event("e0", None))
+    eq.put(Event("e1", Arguments(name="f"), debounce=0.2, coalesce_key="f"))
+    with pytest.raises(queue.Full):
+        eq.put(Event("e2", None), block=False)
+    assert [e.name for e in eq.get_many(5, block=False)] == ["e0"], "Debounced event taken"
+    time.sleep(0.3)
+    events = eq.get_many(5, block=False)
+    assert [e.name for e in events] == ["e0", "e1"] and events[0].attempts == 2, "Lease not expired"
+    assert eq.renew([events[1].id]) == []
+    time.sleep(0.3)
+    assert [e.name for e in eq.get_failed()] == ["e0"] and eq.qsize() == 1
+    eq.close()
+
+
+def test_sqlite_queue_reads(tmp_path):
+    fname = str(tmp_path / "queue.sqlite")
+    eq = SqliteEventQueue(fname, visibility_timeout=10)
+    eq.put(Event("e0", None))
+    eq.get(block=False)
+
+    # Reading and waiting on the queue do not take the write lock while another process writes
+    other = sqlite3.connect(fname, timeout=0, isolation_level=None)
+    other.execute("BEGIN IMMEDIATE")
+    start = time.time()
+    assert eq.qsize() == 0 and eq.head() is None and len(eq.get_in_progress()) == 1 == eq.in_progress_count()
+    assert not eq.wait_for_event(0.3) and eq.get_many(5, block=True, timeout=0.3) == []
+    assert time.time() - start < 2, "Waited for the write lock"
+    other.execute("ROLLBACK")
+    other.close()
+    eq.close()
+
+
+def test_queue_introspection():
+    eq = PriorityEventQueue(levels=2, visibility_timeout=0.2)
+    eq.put_many([Event("a", Arguments(i)) for i in range(5)])
+    eq.put(Event("b", Arguments(img=np.zeros((100, 100)))), priority=0)
+    eq.put(Event("c", None, coalesce_key="c", debounce=10))
+    assert eq.peek()["name"] == "b" and "ndarray(100, 100) float64" in eq.peek()["args"]
+    assert [e.args[0] for e in eq.get_pending(2, 2)] == [1, 2], "Wrong page"
+    assert [d["name"] for d in eq.get_pending_summary(5, 10)] == ["a", "c"]
+
+    taken = eq.get_many(3, block=False)
+    assert eq.get_counts() == {"pending": {"a": 3, "c": 1}, "in_progress": {"b": 1, "a": 2}}
+    assert eq.level(0).get_counts() == {"pending": {}, "in_progress": {"b": 1}}
+    eq.discard(taken[0].id)
+    eq.re_append(taken[1].id)
+    assert eq.get_counts() == {"pending": {"a": 4, "c": 1}, "in_progress": {"a": 1}}
+    time.sleep(0.3)
+    assert eq.get_counts() == {"pending": {"a": 5, "c": 1}, "in_progress": {}}, "Expired lease not counted"
+    assert eq.get_counts()["pending"]["a"] == len([e for e in eq.get_pending() if e.name == "a"])
+
+
+def _shm_consumer(eq, results):
+    names = []
+    while True:
+        try:
+            ev = eq.get(block=True, timeout=0.5)
+        except queue.Empty:
+            break
+        names.append(ev.args.name)
+        eq.discard(ev.id)
+    results.put(names)
+
+
+def test_shared_memory_queue():
+    eq = SharedMemoryEventQueue(capacity=4096, maxsize=20)
+    try:
+        eq.put_many([Event(f"e{i % 2}", Arguments(name=i)) for i in range(6)])
+        with pytest.raises(ValueError):
+            eq.put(Event("big", Arguments(img=np.zeros(1000))))
+        assert eq.get_counts()["pending"] == {"e0": 3, "e1": 3} and eq.peek()["name"] == "e0"
+
+        events = eq.get_matching("e1", 2)
+        assert [e.args.name for e in events] == [1, 3] and eq.in_progress_total() == 2
+        assert [e.args.name for e in eq.get_pending()] == [0, 2, 4, 5], "Wrong order after get_matching"
+        eq.re_append(events[0].id)
+        eq.discard(events[1].id)
+        assert not eq.get_in_progress() and eq.in_progress_total() == 0
+        assert [e.args.name for e in eq.get_pending(3, 5)] == [5, 1], "Event not re-appended"
+
+        # Wraps around the ring
+        for i in range(50):
+            eq.put(Event("w", Arguments(name=100 + i)))
+            eq.discard(eq.get().id)
+        assert [e.args.name for e in eq.get_pending()] == list(range(145, 150))
+
+        results = multiprocessing.Queue()
+        workers = [multiprocessing.Process(target=_shm_consumer, args=(eq, results)) for i in range(3)]
+        for w in workers:
+            w.start()
+        eq.put_many([Event("x", Arguments(name=i)) for i in range(100)])
+        names = [n for w in workers for n in results.get()]
+        for w in workers:
+            w.join()
+        assert sorted(names) == list(range(100)) + list(range(145, 150)), "Events lost or taken twice"
+    finally:
+        eq.unlink()
+
+
+def test_sharded_queue():
+    shards = [SimpleEventQueue() for i in range(3)]
+    eq = ShardedEventQueue(shards, home=0)
+    eq.put_many([Event("e", Arguments(name=f"file{i % 6}")) for i in range(30)])
+    assert eq.qsize() == 30 and all(s.qsize() > 0 for s in shards), "Events not spread over the shards"
+    for s in shards:
+        assert len(set(ev.args.name for ev in s.get_pending())) == len(s.get_pending()) // 5, "Key in several shards"
+    assert [ev.args.name for ev in eq.get_pending(8, 4)] == [ev.args.name for ev in eq.get_pending()[8:12]]
+    assert eq.get_counts()["pending"] == {"e": 30}
+
+    # Takes from the home shard, then steals
+    events = eq.get_many(100, block=False)
+    assert len(events) == len(shards[0].get_in_progress()) and shards[0].qsize() == 0 and shards[1].qsize() > 0
+    events += [eq.get(block=True, timeout=0.5) for i in range(30 - len(events))]
+    assert eq.in_progress_count() == 30
+    with pytest.raises(queue.Empty):
+        eq.get(block=True, timeout=0.2)
+    assert eq.re_append(events[-1].id) is not None and eq.qsize() == 1
+    assert eq.renew([events[0].id, "unknown"]) == ["unknown"]
+    assert eq.ack_many([ev.id for ev in events[:-1]]) == 29 and not eq.get_in_progress()
+
+
+class CountingQueue(SimpleEventQueue):
+    def __init__(self):
+        SimpleEventQueue.__init__(self)
+        self.calls = 0
+
+    def get_many(self, *args, **kwargs):
+        self.calls += 1
+        return SimpleEventQueue.get_many(self, *args, **kwargs)
+
+
+def test_sharded_queue_idle():
+    """
+    An idle client waits on its home shard instead of polling all shards
+    """
+    shards = [CountingQueue() for i in range(3)]
+    eq = ShardedEventQueue(shards, home=0)
+    start = time.time()
+    assert eq.get_many(1, block=True, timeout=0.5) == []
+    assert time.time() - start >= 0.5
+    assert sum(s.calls for s in shards) <= 2 * len(shards) + 1, "Shards polled while waiting"
+
+    # An event put in the home shard ends the wait
+    home = [ev for ev in [Event("e", None, key=f"k{i}") for i in range(20)] if eq.shard_of(ev) == 0][0]
+    threading.Timer(0.2, lambda: eq.put(home)).start()
+    start = time.time()
+    events = eq.get_many(1, block=True, timeout=5)
+    assert events and events[0].id == home.id and time.time() - start < 2, "Wait not ended by the event"
+
+
+def test_sharded_queue_manager():
+    portnr = QueuePortNr + 3
+    manager = start_queue_manager(QueueHost, portnr, QueueAuthCode, logging.getLogger(), shards=2)
+    # As given on the command line of the tools
+    queue = get_event_queue(QueueHost, str(portnr), QueueAuthCode, shards=2)
+    try:
+        assert isinstance(queue, ShardedEventQueue), "Failed to connect to the shards"
+        queue.put_many([Event(f"Item {cnt}", Arguments(name=cnt)) for cnt in range(NItems)])
+        assert [s.qsize() for s in queue.shards] != [NItems, 0] and queue.qsize() == NItems
+        events = queue.get_many(NItems, block=True, timeout=1)
+        events += queue.get_many(NItems, block=True, timeout=1)
+        assert sorted(ev.args.name for ev in events) == list(range(NItems))
+        assert queue.ack_many([ev.id for ev in events]) == NItems
+    finally:
+        queue.terminate()
+        manager.join(5)
+
+
 def test_start_queue_server():
     # Start Queue manager process, which will host the shared queue
     res = start_queue_manager(QueueHost, QueuePortNr, QueueAuthCode, logger=logging.getLogger())
     assert res, "Could not create queue manager"
 
 
+def test_shared_queue_batched():
+    queue = get_event_queue(QueueHost, QueuePortNr, QueueAuthCode)
+    assert queue is not None, "Failed to connect to queue manager"
+
+    with BatchingQueueClient(queue, batch_size=NItems, batch_puts=True) as client:
+        for cnt in range(NItems):
+            client.put(Event(f"Item {cnt}", None))
+    events = client.get_many(NItems * 2, block=False)
+    assert len(events) == NItems, f"{NItems} expected, got {len(events)}"
+    assert queue.ack_many([ev.id for ev in events]) == NItems and queue.qsize() == 0
+
+
+def test_sqlite_queue_manager(tmp_path):
+    # Pending events survive a restart of the queue manager.
+    # The restarted manager uses another port, proxies keep a connection per address.
+    fname = str(tmp_path / "queue.sqlite")
+    for restart in range(2):
+        portnr = QueuePortNr + 1 + restart
+        manager = start_queue_manager(
+            QueueHost, portnr, QueueAuthCode, logging.getLogger(), backend="sqlite", filename=fname
+        )
+        queue = get_event_queue(QueueHost, portnr, QueueAuthCode)
+        try:
+            assert queue is not None, "Failed to connect to queue manager"
+            if restart == 0:
+                queue.put_many([Event(f"Item {cnt}", None) for cnt in range(NItems)])
+            else:
+                assert [ev.name for ev in queue.get_pending()] == [f"Item {cnt}" for cnt in range(NItems)]
+        finally:
+            try:
+                queue.terminate()
+            except Exception:
+                pass
+            manager.join(5)
+
+
 def test_shared_queue_producer():
     # Append items to the shared queue
     queue = get_event_queue(QueueHost, QueuePortNr, QueueAuthCode)
@@ -5,15 +5,72 @@
 #
 import pytest
 import sys
+import os
+import time
+import asyncio
+import random
+import json
+import socket
+import pstats
+import logging
+import threading
+import tracemalloc
+import types
+import copy
+import numpy as np
 
 sys.path.append("../..")
 
 from keckdrpframework.config.framework_config import ConfigClass
 from keckdrpframework.core.framework import Framework
+from keckdrpframework.core.async_framework import AsyncFramework
+from keckdrpframework.core.executors import ActionExecutors
+from keckdrpframework.core import queues
 from keckdrpframework.utils.drpf_logger import getLogger
+from keckdrpframework.utils.profiling import ActionProfiler
+from keckdrpframework.utils.tracing import Tracer
+from keckdrpframework.benchmarks import bench_dispatch, bench_primitives
 from keckdrpframework.models.processing_context import ProcessingContext
 from keckdrpframework.examples.pipelines import fits2png_pipeline
 from keckdrpframework.examples.pipelines.fits2png_pipeline import Fits2pngPipeline
+from keckdrpframework.models.arguments import Arguments
+from keckdrpframework.models.event import Event
+from keckdrpframework.pipelines.base_pipeline import BasePipeline
+from keckdrpframework.primitives.base_primitive import BasePrimitive
+
+QUEUE_AUTH_CODE = b"test framework"
+
+
+def make_config(**kwargs):
+    """
+    Returns a configuration without tracing of actions and with a short event timeout.
+    """
+    config = ConfigClass()
+    config.properties.update(print_trace=False, event_timeout=0.2, no_event_event=None, worker_threads=1)
+    config.properties.update(kwargs)
+    return config
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("localhost", 0))
+        return s.getsockname()[1]
+
+
+class CountPipeline(BasePipeline):
+    event_table = {
+        "noop": ("noop", None, None),
+    }
+
+    def __init__(self, context):
+        BasePipeline.__init__(self, context)
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def noop(self, action, context):
+        with self.lock:
+            self.count += 1
+        return None
 
 
 #
@@ -86,3 +143,769 @@ def test_as_object():
     obj = fits2png_pipeline.Fits2pngPipeline(context)
     f = Framework(obj, "example_config.cfg")
     assert f is not None, "Could not create framework using instance of class"
+
+
+#
+# Test executors
+#
+
+
+class Square(BasePrimitive):
+    def __init__(self, action, context):
+        BasePrimitive.__init__(self, action, context)
+
+    def _perform(self):
+        args = self.action.args
+        return Arguments(name=args.name, value=args.value * args.value, pid=os.getpid())
+
+
+class ExecutorPipeline(BasePipeline):
+    event_table = {
+        "square_inline": ("Square", None, "collect"),
+        "square_thread": ("Square", None, "collect", "thread"),
+        "square_process": ("Square", None, "collect", "process"),
+        "spawn_thread": ("spawn", None, None, "thread"),
+        "collect": ("collect", None, None),
+    }
+
+    def __init__(self, context):
+        BasePipeline.__init__(self, context)
+        self.results = {}
+
+    def collect(self, action, context):
+        self.results[action.args.name] = action.args
+        return action.args
+
+    def spawn(self, action, context):
+        context.append_event("collect", Arguments(name="spawned"))
+        return action.args
+
+
+def test_executors():
+    """
+    The same primitive runs inline, in the thread pool and in the process pool
+    """
+    f = Framework(ExecutorPipeline, "example_config.cfg")
+    f.config.no_event_event = None
+    for i, name in enumerate(("square_inline", "square_thread", "square_process")):
+        f.append_event(name, Arguments(name=name, value=i + 2))
+
+    f.main_loop()
+    f.end()
+
+    results = f.pipeline.results
+    assert results["square_inline"].value == 4, "Inline action failed"
+    assert results["square_thread"].value == 9, "Thread pool action failed"
+    assert results["square_process"].value == 16, "Process pool action failed"
+    assert results["square_process"].pid != os.getpid(), "Action did not run in another process"
+    assert len(f.event_queue.get_in_progress()) == 0, "Unexpected events in progress"
+
+
+def test_executors_bounded():
+    """
+    submit() waits for a free worker, so that the pool holds no backlog of actions
+    """
+    config = ConfigClass("example_config.cfg")
+    config.properties.update(thread_pool_size=2)
+    executors = ActionExecutors(config, logging.getLogger())
+    action = types.SimpleNamespace(name="slow", executor="thread")
+    futures = []
+    for i in range(6):
+        futures.append(executors.submit(action, lambda action, context: time.sleep(0.05), None))
+        assert sum(1 for fut in futures if not fut.done()) <= 2, "More actions submitted than workers"
+    executors.shutdown()
+
+
+def test_recurrent_full_queue():
+    """
+    A recurrent event is queued again without waiting, even when the queue is full
+    """
+    config = ConfigClass("example_config.cfg")
+    config.properties.update(event_queue_maxsize=1)
+    f = Framework(ExecutorPipeline, config)
+    f.append_event("collect", Arguments(name="recurrent"), recurrent=True)
+    event = f.event_queue.get(block=False)
+    f.append_event("collect", Arguments(name="other"))
+    f._requeue_recurrent(event)
+    assert f.event_queue.qsize() == 2 and not f.event_queue.get_in_progress(), "Recurrent event not re-appended"
+    f.end()
+
+
+def test_ingest_data_full_queue():
+    """
+    Ingesting data before start() does not wait for a full queue, the rest is a backlog
+    """
+    for high_water in (None, 2):
+        config = ConfigClass("example_config.cfg")
+        config.properties.update(event_queue_maxsize=3, event_queue_high_water=high_water)
+        f = Framework(Fits2pngPipeline, config)
+        f.ingest_data("test_files")
+        data_set = f.context.data_set
+        data_set.stop_monitor()
+        assert f.event_queue.qsize() == 3 and data_set.get_size() == 3 and data_set.backlog, "Ingestion not paused"
+        f.end()
+
+
+def test_ingest_files_full_queue():
+    """
+    Files given to ingest_data() that do not fit in the queue before start() are in the backlog
+    """
+    config = ConfigClass("example_config.cfg")
+    config.properties.update(event_queue_maxsize=2)
+    f = Framework(Fits2pngPipeline, config)
+    files = sorted(os.path.join("test_files", name) for name in os.listdir("test_files"))
+    f.ingest_data(files=files)
+    data_set = f.context.data_set
+    data_set.stop_monitor()
+    assert f.event_queue.qsize() == 2 and data_set.get_size() == 2, "Ingestion not paused"
+    assert data_set.backlog and list(data_set.pending_files) == files[2:], "Files not in the backlog"
+
+    f.event_queue.get(block=False)
+    f.event_queue.get(block=False)
+    data_set.update_data_set()
+    assert data_set.get_size() == 4 and list(data_set.pending_files) == files[4:], "Ingestion not resumed"
+    f.end()
+
+
+def test_sqlite_backend(tmp_path):
+    """
+    The low priority events are stored in a SQLite file
+    """
+    config = ConfigClass("example_config.cfg")
+    config.properties.update(event_queue_backend="sqlite", event_queue_file=str(tmp_path / "queue.sqlite"))
+    config.no_event_event = None
+    f = Framework(ExecutorPipeline, config)
+    assert isinstance(f.event_queue, queues.SqliteEventQueue)
+    for i, name in enumerate(("square_inline", "square_thread")):
+        f.append_event(name, Arguments(name=name, value=i + 2))
+
+    f.main_loop()
+    f.end()
+    assert f.pipeline.results["square_inline"].value == 4 and f.pipeline.results["square_thread"].value == 9
+
+
+#
+# Test AsyncFramework
+#
+
+
+class SlowRead(BasePrimitive):
+    def __init__(self, action, context):
+        BasePrimitive.__init__(self, action, context)
+
+    async def async_perform(self):
+        await asyncio.sleep(0.5)
+        return Arguments(name=self.action.args.name, value=self.action.args.value + 1)
+
+
+class AsyncPipeline(BasePipeline):
+    event_table = {
+        "read": ("SlowRead", None, "add"),
+        "add": ("add", None, None),
+    }
+
+    def __init__(self, context):
+        BasePipeline.__init__(self, context)
+        self.total = 0
+
+    async def add(self, action, context):
+        await asyncio.sleep(0.5)
+        self.total += action.args.value
+        return action.args
+
+
+def test_async_framework():
+    """
+    20 events taking 1 s each are processed concurrently
+    """
+    f = AsyncFramework(AsyncPipeline, "example_config.cfg")
+    f.config.no_event_event = None
+    for i in range(20):
+        f.append_event("read", Arguments(name=f"file{i}", value=i))
+
+    t0 = time.time()
+    f.main_loop()
+    elapsed = time.time() - t0
+
+    assert f.pipeline.total == sum(range(1, 21)), "Unexpected result"
+    assert elapsed < 10, f"Events were not processed concurrently, took {elapsed:.1f} s"
+    assert len(f.event_queue.get_in_progress()) == 0, "Unexpected events in progress"
+
+
+def test_async_completion():
+    """
+    An event is completed while the fetching thread waits for the next event
+    """
+    f = AsyncFramework(AsyncPipeline, "example_config.cfg")
+    f.config.no_event_event = None
+    f.config.event_timeout = 3
+    f.append_event("add", Arguments(name="file", value=1))
+
+    thread = threading.Thread(target=f.main_loop)
+    thread.start()
+    time.sleep(1.5)
+    in_progress = len(f.event_queue.get_in_progress())
+    thread.join()
+
+    assert f.pipeline.total == 1, "Unexpected result"
+    assert in_progress == 0, "Completion waited for the fetching thread"
+
+
+#
+# Test partition keys
+#
+
+
+class StagePipeline(BasePipeline):
+    event_table = {
+        "stage1": ("stage", None, "stage2"),
+        "stage2": ("stage", None, "stage3"),
+        "stage3": ("stage", None, None),
+    }
+
+    def __init__(self, context):
+        BasePipeline.__init__(self, context)
+        self.stages = {}
+        self.running = 0
+        self.max_running = 0
+        self.lock = threading.Lock()
+
+    def stage(self, action, context):
+        with self.lock:
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        time.sleep(random.uniform(0.01, 0.1))
+        with self.lock:
+            self.running -= 1
+            self.stages.setdefault(action.event.key, []).append(action.event.name)
+        # Output with another name, the key of the chain is kept
+        return Arguments(name=f"{action.args.name}.out")
+
+
+def test_partition_keys():
+    """
+    Chains of different files run concurrently, stages of one file run in order
+    """
+    f = Framework(StagePipeline, "example_config.cfg")
+    f.config.no_event_event = None
+    f.config.worker_threads = 4
+    names = [f"file{i}" for i in range(8)]
+    for name in names:
+        f.append_event("stage1", Arguments(name=name))
+
+    f.main_loop()
+
+    stages = f.pipeline.stages
+    assert sorted(stages.keys()) == names, "Unexpected partition keys"
+    for name in names:
+        assert stages[name] == ["stage1", "stage2", "stage3"], f"Stages out of order for {name}, {stages[name]}"
+    assert f.pipeline.max_running > 1, "Chains did not run concurrently"
+
+
+class FailingStagePipeline(StagePipeline):
+    def event_to_action(self, event, context):
+        if event.name == "bad":
+            raise ValueError("No action for bad")
+        return StagePipeline.event_to_action(self, event, context)
+
+
+def test_event_to_action_failed():
+    """
+    An event without action is dropped, its partition key is released
+    """
+    config = make_config(worker_threads=2)
+    f = Framework(FailingStagePipeline, config)
+    f.append_event("bad", Arguments(name="x"))
+    f.append_event("stage1", Arguments(name="x"))
+
+    f.main_loop()
+
+    assert f.pipeline.stages == {"x": ["stage1", "stage2", "stage3"]}, "Events of the key not run"
+    assert not f._active_keys and len(f.event_queue.get_in_progress()) == 0
+
+
+def test_async_event_to_action_failed():
+    config = make_config()
+    f = AsyncFramework(FailingStagePipeline, config)
+    f.append_event("bad", Arguments(name="x"))
+    f.append_event("stage1", Arguments(name="x"))
+
+    f.main_loop()
+
+    assert f.pipeline.stages == {"x": ["stage1", "stage2", "stage3"]}, "Events of the key not run"
+    assert not f._active_keys and len(f.event_queue.get_in_progress()) == 0
+
+
+#
+# Test action resolution
+#
+
+
+def test_action_cache():
+    """
+    Actions are resolved once, set_event() invalidates the cache
+    """
+    f = Framework(ExecutorPipeline, "example_config.cfg")
+    p = f.pipeline
+
+    a1 = p.get_action("noop")
+    assert p.get_action("noop") is a1, "Action not cached"
+    a2 = p.get_action("Square")
+    assert a2.primitive_class is Square, "Primitive not found"
+    assert p.get_action("Square") is a2, "Primitive not cached"
+
+    p.set_event("echo_file", ("echo", None, None))
+    assert p.event_to_action(Event("echo_file", None), f.context)[0] == "echo", "Event table not updated"
+    assert p.get_action("noop") is not a1, "Cache not invalidated"
+    del p.event_table["echo_file"]
+
+
+def test_compile_event_table():
+    """
+    Compiled event table, unknown actions fail when the framework is created
+    """
+    cfg = ConfigClass("example_config.cfg")
+    cfg.compile_event_table = True
+    f = Framework(ExecutorPipeline, cfg)
+    p = f.pipeline
+    assert p.event_to_action(Event("square_process", None), f.context)[3] == "process", "Unexpected event info"
+    assert p.event_to_action(Event("noop", None), f.context)[0] == "noop", "Default actions not compiled"
+
+    class BadPipeline(ExecutorPipeline):
+        event_table = {"bad": ("no_such_action", None, None)}
+
+    with pytest.raises(Exception, match="no_such_action"):
+        Framework(BadPipeline, cfg)
+
+    class TypoPipeline(ExecutorPipeline):
+        event_table = {"typo": ("Square", None, None, "proces")}
+
+    with pytest.raises(Exception, match="unknown executor proces"):
+        Framework(TypoPipeline, cfg)
+
+    # The compiled table holds the resolved actions
+    p._resolve_action = lambda prefix, action: pytest.fail(f"Action {prefix}{action} resolved again")
+    p._action_cache = dict()
+    p._methods_cache = dict()
+    assert p.get_action_methods("Square")[1].primitive_class is Square
+
+
+#
+# Test batches
+#
+
+
+class BatchSquare(Square):
+    batch_size = 4
+    batch_wait = 0.1
+    batches = []
+
+    @classmethod
+    def apply_batch(cls, actions, context):
+        cls.batches.append(len(actions))
+        return super().apply_batch(actions, context)
+
+
+class BatchPipeline(ExecutorPipeline):
+    event_table = {
+        "square": ("BatchSquare", None, "collect"),
+        "collect": ("collect", None, None),
+    }
+
+
+def test_batches():
+    """
+    Queued events of a batch-capable primitive are processed in batches
+    """
+    BatchSquare.batches = []
+    f = Framework(BatchPipeline, "example_config.cfg")
+    f.config.no_event_event = None
+    for i in range(10):
+        f.append_event("square", Arguments(name=f"value{i}", value=i))
+
+    f.main_loop()
+
+    assert BatchSquare.batches == [4, 4, 2], f"Unexpected batches {BatchSquare.batches}"
+    assert [f.pipeline.results[f"value{i}"].value for i in range(10)] == [i * i for i in range(10)], "Wrong results"
+    assert len(f.event_queue.get_in_progress()) == 0, "Unexpected events in progress"
+
+
+#
+# Test metrics
+#
+
+
+def test_metrics():
+    """
+    Action timings, event counts and queue depths are recorded
+    """
+    f = Framework(ExecutorPipeline, "example_config.cfg")
+    f.config.no_event_event = None
+    for i in range(3):
+        f.append_event("square_inline", Arguments(name=f"sq{i}", value=i))
+
+    f.main_loop()
+    f.end()
+
+    assert f._events_done.get(action="Square", status="completed") == 3, "Events not counted"
+    count, total = f._action_time.get(action="Square", phase="action")
+    assert count == 3 and total >= 0, "Action times not recorded"
+    assert f._action_time.get(action="collect", phase="post")[0] == 3, "Post condition times not recorded"
+
+    snapshot = f.get_metrics()
+    depths = {v["labels"]["queue"]: v["value"] for v in snapshot["drpf_queue_depth"]["values"]}
+    assert depths == {"event_queue": 0, "event_queue_hi": 0}, "Unexpected queue depths"
+
+    text = f.get_metrics_text()
+    assert "# TYPE drpf_action_seconds histogram" in text
+    assert 'drpf_action_seconds_count{action="Square",phase="action"} 3' in text
+    assert 'drpf_action_seconds_bucket{action="Square",phase="action",le="+Inf"} 3' in text
+
+
+class SlowPipeline(BasePipeline):
+    event_table = {"slow": ("slow", None, None)}
+
+    def __init__(self, context):
+        BasePipeline.__init__(self, context)
+        self.count = 0
+
+    def slow(self, action, context):
+        self.count += 1
+        time.sleep(1.2)
+        return action.args
+
+
+def test_prefetch_lease_renewed():
+    """
+    The leases of prefetched events are renewed while their actions run longer than the lease
+    """
+    # The other worker thread takes the event again if its lease expires
+    config = make_config(worker_threads=2)
+    eq = queues.BatchingQueueClient(queues.SimpleEventQueue(), prefetch=2, lease=0.6)
+    f = Framework(SlowPipeline, config, event_queue=eq)
+    eq.put(Event("slow", Arguments(name="slow")))
+    f.main_loop()
+    f.end()
+    assert f.pipeline.count == 1, "Event run again after its lease expired"
+    assert eq.qsize() == 0 and not eq.get_in_progress()
+
+
+def test_buffered_acks_flushed():
+    """
+    Acknowledgements buffered by a BatchingQueueClient are sent while no events are running
+    """
+    config = make_config()
+    eq = queues.BatchingQueueClient(queues.SimpleEventQueue(), prefetch=2, lease=0.3)
+    f = Framework(SlowPipeline, config, event_queue=eq)
+    eq.put(Event("slow", Arguments(name="slow")))
+    ev = eq.get(block=False)
+    eq.discard(ev.id)
+    f.keep_going = True
+    f._start_heartbeat()
+    time.sleep(0.25)
+    f.keep_going = False
+    # Not through the client, which would send the buffers
+    assert not eq.queue.get_in_progress(), "Acknowledgement not sent before the lease expired"
+    f.end()
+
+
+def test_lease_recovery():
+    """
+    The event of a dead worker is re-queued when its lease expires and processed by another worker
+    """
+    portnr = free_port()
+    auth_code = QUEUE_AUTH_CODE
+    manager = queues.start_queue_manager("localhost", portnr, auth_code, logging.getLogger(), visibility_timeout=1)
+    queue = queues.get_event_queue("localhost", portnr, auth_code)
+    try:
+        queue.put(Event("noop", Arguments(name="lost")))
+        lost = queue.get(block=False)
+        assert lost.attempts == 1
+
+        config = make_config(
+            want_multiprocessing=True,
+            queue_manager_hostname="localhost",
+            queue_manager_portnr=portnr,
+            queue_manager_auth_code=auth_code,
+            event_visibility_timeout=1,
+        )
+        f = Framework(CountPipeline, config)
+        f.main_loop()
+        f.end()
+        assert f.pipeline.count == 1, "Event of the dead worker not processed"
+        assert f._events_retried.get(event="noop") == 1, "Retry not counted"
+        assert queue.qsize() == 0 and not queue.get_in_progress()
+    finally:
+        try:
+            queue.terminate()
+        except Exception:
+            pass
+        manager.join(5)
+
+
+#
+# Test profiling
+#
+
+
+def test_profile_actions(tmp_path):
+    """
+    Sampled actions are profiled, including primitives running in the thread pool
+    """
+    f = Framework(ExecutorPipeline, "example_config.cfg")
+    f.config.no_event_event = None
+    f.profiler = ActionProfiler(str(tmp_path), every_n=2)
+    f.context.profiler = f.profiler
+    for i in range(4):
+        f.append_event("square_inline", Arguments(name=f"sq{i}", value=i))
+    f.append_event("square_thread", Arguments(name="thr", value=5))
+
+    f.main_loop()
+    f.end()
+
+    stats = pstats.Stats(f.profiler.get_file("Square"))
+    perform = [v for k, v in stats.stats.items() if k[2] == "_perform"]
+    # 2 of 4 inline events and the event in the thread pool
+    assert perform and perform[0][1] == 3, "Unexpected number of profiled calls"
+    assert os.path.isfile(f.profiler.get_file("collect")), "Missing profile"
+
+
+def test_profile_dump(tmp_path):
+    """
+    Profiles are merged in memory and written every dump_every profiles or by dump()
+    """
+    profiler = ActionProfiler(str(tmp_path), every_n=1, dump_every=2)
+    fname = profiler.get_file("a")
+    with profiler.profile("a"):
+        sum(range(10))
+    assert not os.path.exists(fname), "Profile written after each sample"
+    with profiler.profile("a"):
+        sum(range(10))
+    assert os.path.isfile(fname)
+
+    with profiler.profile("a"):
+        sum(range(10))
+    profiler.dump()
+    calls = [v for k, v in pstats.Stats(fname).stats.items() if k[2] == "<built-in method builtins.sum>"]
+    assert calls and calls[0][1] == 3, "Profiles not merged"
+
+
+#
+# Test tracing
+#
+
+
+def test_trace_events(tmp_path):
+    """
+    Events of a chain share the trace id of the first event, spans are exported in Chrome trace format
+    """
+    f = Framework(ExecutorPipeline, "example_config.cfg")
+    f.config.no_event_event = None
+    f.tracer = Tracer()
+    f.context.tracer = f.tracer
+    for name in ("square_inline", "square_thread"):
+        f.append_event(name, Arguments(name=name, value=3))
+    first_trace = f.event_queue.head().trace_id
+
+    f.main_loop()
+    f.end()
+
+    trace_file = tmp_path / "trace.json"
+    out = f.export_trace(str(trace_file))
+    assert json.loads(trace_file.read_text()) == out
+
+    spans = f.tracer.get_spans(first_trace)
+    names = {(s["cat"], s["name"], s["ph"]) for s in spans}
+    assert ("action", "Square", "X") in names and ("primitive", "Square", "X") in names
+    assert ("action", "collect", "X") in names, "Next event not in the same trace"
+    assert ("queue", "collect", "b") in names and ("queue", "collect", "e") in names
+
+    # The chain that ran in the thread pool has its own trace
+    traces = {s["args"]["trace_id"] for s in out["traceEvents"] if s["ph"] == "X" and s["name"] == "collect"}
+    assert len(traces) == 2 and first_trace in traces
+    other = f.tracer.get_spans((traces - {first_trace}).pop())
+    assert ("primitive", "Square") in {(s["cat"], s["name"]) for s in other}
+
+
+def test_trace_thread_method():
+    """
+    An event created by a method running in the thread pool continues the trace of its event
+    """
+    f = Framework(ExecutorPipeline, "example_config.cfg")
+    f.config.no_event_event = None
+    f.tracer = Tracer()
+    f.context.tracer = f.tracer
+    f.append_event("spawn_thread", Arguments(name="spawn"))
+    trace = f.event_queue.head().trace_id
+
+    f.main_loop()
+    f.end()
+
+    assert "spawned" in f.pipeline.results, "Event not created"
+    names = {(s["cat"], s["name"]) for s in f.tracer.get_spans(trace)}
+    assert ("action", "collect") in names, "Created event not in the same trace"
+
+
+def test_async_trace_and_profile(tmp_path):
+    """
+    Primitives run by AsyncFramework record their spans and are profiled
+    """
+    f = AsyncFramework(ExecutorPipeline, "example_config.cfg")
+    f.config.no_event_event = None
+    f.tracer = f.context.tracer = Tracer()
+    f.profiler = f.context.profiler = ActionProfiler(str(tmp_path))
+    f.append_event("square_inline", Arguments(name="sq", value=3))
+    trace_id = f.event_queue.head().trace_id
+
+    f.main_loop()
+    f.end()
+
+    names = {(s["cat"], s["name"]) for s in f.tracer.get_spans(trace_id)}
+    assert ("action", "Square") in names and ("primitive", "Square") in names, "Missing primitive span"
+    stats = pstats.Stats(f.profiler.get_file("Square"))
+    assert [v for k, v in stats.stats.items() if k[2] == "_perform"], "Primitive not profiled"
+
+
+#
+# Test benchmarks
+#
+
+
+def test_bench_dispatch():
+    out = bench_dispatch.run_benchmarks(["noop", "mix", "recurrent"], 20, repeat=1, hi_per_low=2)
+    events = {r["scenario"]: r["events"] for r in out["results"]}
+    assert events == {"noop": 20, "mix": 60, "recurrent": 20}
+    assert all(r["events_per_second"] > 0 for r in out["results"])
+
+
+def test_bench_dispatch_prefetch():
+    out = bench_dispatch.run_benchmarks(["shared"], 20, repeat=1, processes=[2], prefetch=[5])
+    assert out["results"][0]["events"] == 20 and out["results"][0]["prefetch"] == 5
+
+
+def test_bench_dispatch_local():
+    """
+    Forked workers share a SharedMemoryEventQueue, passed to Framework(..., event_queue=queue)
+    """
+    out = bench_dispatch.run_benchmarks(["local"], 50, repeat=1, processes=[2])
+    assert out["results"][0]["events"] == 50 and out["results"][0]["processes"] == 2
+
+
+def test_shared_memory_queue_idle():
+    config = make_config()
+    eq = queues.SharedMemoryEventQueue(capacity=4096)
+    # Handle of another worker process, with its own in_progress dict
+    other = copy.copy(eq)
+    other._in_progress = dict()
+    f = Framework(BasePipeline, config, event_queue=eq)
+    try:
+        assert f._is_idle()
+        eq.put(Event("e", None))
+        assert not f._is_idle(), "Pending event ignored"
+        other.get(block=False)
+        # Without leases, the other process may have died with the event
+        assert f._is_idle(), "Waiting for an event in progress in another process"
+        f.config.event_visibility_timeout = 10
+        assert not f._is_idle(), "Leased event in progress in another process ignored"
+        other.ack_many(list(other.get_in_progress()))
+        assert f._is_idle()
+
+        # An event taken by this process counts until it is completed
+        f.config.event_visibility_timeout = None
+        eq.put(Event("e", None))
+        ev = f.get_event()
+        assert not f._is_idle(), "Running event ignored"
+        f._discard_event(ev, False)
+        assert f._is_idle()
+    finally:
+        f.end()
+        eq.close()
+        eq.unlink()
+
+
+def test_bench_primitives():
+    out = bench_primitives.run_benchmarks(sizes=[64], dtypes=["uint16", "float32"], repeat=1)
+    assert len(out["results"]) == len(bench_primitives.BENCHMARKS) * 2
+    assert all(r["peak_bytes"] > 0 and r["pixels_per_second"] > 0 for r in out["results"])
+
+
+#
+# Test memory accounting
+#
+
+
+class MakeImage(BasePrimitive):
+    def _perform(self):
+        return Arguments(name=self.action.args.name, img=np.zeros((512, 512)))
+
+
+class MemoryPipeline(BasePipeline):
+    event_table = {
+        "make_image": ("MakeImage", None, "collect"),
+        "make_image_thread": ("MakeImage", None, "collect", "thread"),
+        "collect": ("collect", None, None),
+    }
+
+    def collect(self, action, context):
+        return Arguments(name=action.args.name)
+
+
+def test_memory_accounting():
+    config = ConfigClass("example_config.cfg")
+    config.properties["memory_accounting"] = True
+    f = Framework(MemoryPipeline, config)
+    f.config.no_event_event = None
+    for i in range(2):
+        f.append_event("make_image", Arguments(name=f"img{i}"))
+
+    f.main_loop()
+    f.end()
+
+    stats = f.get_memory_stats()
+    image_size = 512 * 512 * 8
+    assert stats["MakeImage"]["count"] == 2
+    assert stats["MakeImage"]["max_peak_bytes"] >= image_size, "Peak allocation not recorded"
+    assert stats["MakeImage"]["max_output_bytes"] >= image_size, "Output size not recorded"
+    assert stats["collect"]["max_output_bytes"] < image_size
+    assert "drpf_action_peak_bytes_count" in f.get_metrics_text()
+
+
+def test_memory_accounting_pool():
+    """
+    For an action running in a pool, only the retained size is recorded
+    """
+    config = ConfigClass("example_config.cfg")
+    config.properties["memory_accounting"] = True
+    f = Framework(MemoryPipeline, config)
+    f.config.no_event_event = None
+    f.append_event("make_image_thread", Arguments(name="img"))
+
+    f.main_loop()
+    f.end()
+
+    stats = f.get_memory_stats()
+    assert stats["MakeImage"]["count"] == 1 and stats["MakeImage"]["max_peak_bytes"] == 0, "Peak of submit recorded"
+    assert stats["MakeImage"]["max_output_bytes"] >= 512 * 512 * 8, "Output size not recorded"
+
+
+def test_memory_accounting_without_reset_peak(monkeypatch):
+    # Python 3.8 has no tracemalloc.reset_peak()
+    monkeypatch.delattr(tracemalloc, "reset_peak")
+    # Tracing started by the user is neither restarted nor stopped
+    stop = tracemalloc.stop
+    tracemalloc.start()
+    monkeypatch.setattr(tracemalloc, "stop", lambda: pytest.fail("tracemalloc stopped"))
+    config = ConfigClass("example_config.cfg")
+    config.properties["memory_accounting"] = True
+    try:
+        f = Framework(MemoryPipeline, config)
+        f.config.no_event_event = None
+        f.append_event("make_image", Arguments(name="img"))
+
+        f.main_loop()
+        f.end()
+        assert tracemalloc.is_tracing()
+    finally:
+        stop()
+
+    assert f.get_memory_stats()["MakeImage"]["max_peak_bytes"] >= 512 * 512 * 8, "Peak allocation not recorded"
@@ -20,6 +20,8 @@ from keckdrpframework.core.queues import SimpleEventQueue
 
 import time
 
+import numpy as np
+
 
 #
 # Arguments tests
@@ -40,6 +42,14 @@ def test_arguments_2():
     assert s == '"name": test, "a": 1, "b": 2, "c": 3', "Arguments str() failed"
 
 
+def test_arguments_summary():
+    args = Arguments("x" * 500, img=np.zeros((64, 32), dtype=np.uint16), files=list(range(100)), a=1)
+    s = args.summary(100)
+    assert len(s) <= 100, "Summary too long"
+    assert "ndarray(64, 32) uint16" in s and "list[100]" in s and "xxx..." in s, f"Wrong summary {s}"
+    assert Arguments(name="test", a=1).summary() == '"name": test, "a": 1'
+
+
 def test_arguments_3():
     args = Arguments(4, 7, 19, name="test", a=1, c="3")
     assert args[0] == 4 and args[2] == 19 and args["a"] == 1, "Arguments: constructor failed"
@@ -168,6 +178,31 @@ def test_data_set_get_info(init_data_set):
     assert targname0 == targname1, "Target names do not match"
 
 
+def test_data_set_backlog():
+    config = ConfigClass()
+    logger = getLogger(config.logger_config_file, name="DRPF")
+    config.properties["ingest_batch_size"] = 1
+    eq = SimpleEventQueue(high_water=2)
+
+    data_set = DataSet("test_files", logger, config, eq)
+    assert data_set.get_size() == 2 and data_set.backlog, "Ingestion not paused"
+
+    eq.get(block=False)
+    eq.get(block=False)
+    data_set.update_data_set()
+    assert data_set.get_size() == 4, "Ingestion not resumed"
+
+
+def test_data_set_batches():
+    config = ConfigClass()
+    logger = getLogger(config.logger_config_file, name="DRPF")
+    config.properties["ingest_batch_size"] = 3
+    eq = SimpleEventQueue(high_water=2)
+
+    data_set = DataSet("test_files", logger, config, eq)
+    assert data_set.get_size() == 3 and eq.qsize() == 3 and data_set.backlog, "Ingestion not paused after one batch"
+
+
 def test_data_set_stop(init_data_set):
     data_set = init_data_set
     time.sleep(2)
@@ -8,6 +8,7 @@ import sys
 import glob
 import time
 import os
+import threading
 
 sys.path.extend(("../", "../..", "../examples"))
 
@@ -88,6 +89,50 @@ def test_run_example_3(init_framework):
     assert len(in_progress) == 0, f"Unexpected events in progress, should be none"
 
 
+def test_run_example_worker_threads(init_framework):
+    """
+    Same as test_run_example_3, but with several action loops running concurrently.
+    """
+    f = init_framework
+    f.config.worker_threads = 4
+
+    for fn in glob.glob("output/*.jpg"):
+        os.unlink(fn)
+
+    flist = glob.glob("test_files/*.fits")
+    for fn in flist:
+        f.append_event("next_file", Arguments(name=fn))
+
+    f.main_loop()
+
+    flist = glob.glob("output/*.jpg")
+    assert len(flist) == 6, f"Unexpected number of files, expected {6}, got {len(flist)}"
+    assert len(f.event_queue.get_in_progress()) == 0, "Unexpected events in progress, should be none"
+    assert len(f.event_queue_hi.get_in_progress()) == 0, "Unexpected high priority events in progress"
+
+
+def test_no_event_wakeup(init_framework):
+    """
+    In continuous mode, an event queued while the no_event action is waiting is processed right away.
+    """
+    f = init_framework
+    f.config.no_event_wait_time = 30
+    f.config.no_event_event = Event("no_event", None)
+
+    def stop(action, context):
+        if action.name == "noop":
+            context.state = "stop"
+
+    f.on_state = stop
+    ingest = threading.Timer(1.5, f.append_event, args=("noop", Arguments(name="wake up")))
+    ingest.start()
+
+    t0 = time.time()
+    f.main_loop()
+    elapsed = time.time() - t0
+    assert elapsed < 10, f"New event waited {elapsed:.1f} s"
+
+
 def test_run_example_error_handling(init_framework):
     """
     Tests the error handling
@@ -0,0 +1,187 @@
+"""
+Created on Oct 18, 2026
+
+Memory accounting of actions.
+
+When config.memory_accounting is True, the framework records for each action:
+    - the peak of memory allocated during execute(), traced with tracemalloc
+    - the change of the resident set size (RSS) of the process during execute()
+    - the retained size of the output of the action, ie. the arguments of the next event,
+      and of Framework.store_arguments
+
+The values are aggregated per action name, logged when the action completes and exported as metrics.
+
+tracemalloc slows down the allocations, this mode is meant for investigations.
+Tracing is started by the tracker unless it is already running, and is never restarted.
+On Python 3.8, which has no tracemalloc.reset_peak(), the peak of an action is only known
+when it exceeds the previous peak of the process, otherwise the change of the traced memory is recorded.
+With several worker threads, the peak of an action includes the allocations of the other actions running at the same time.
+For actions running in a pool, only the retained size is recorded.
+The process pool is not traced.
+A batch of actions, see Framework.execute_batch(), is recorded once, as its first action.
+AsyncFramework records only the retained size, the peak of concurrent tasks cannot be told apart.
+
+The RSS is read with psutil if it is installed, otherwise from /proc/self/statm.
+
+"""
+
+import os
+import sys
+import threading
+import tracemalloc
+
+import numpy as np
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+# Bucket upper bounds in bytes
+BYTE_BUCKETS = tuple(2**n for n in range(20, 36, 2))
+
+MB = 1024 * 1024
+
+
+def rss_bytes():
+    """
+    Returns the resident set size of this process in bytes, or None if not available.
+    """
+    if psutil is not None:
+        return psutil.Process().memory_info().rss
+    try:
+        with open("/proc/self/statm") as fh:
+            return int(fh.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def retained_size(obj, depth=2, _seen=None):
+    """
+    Estimates the memory held by obj.
+    Counts the data of numpy arrays, and looks into Arguments, lists, tuples and dicts up to the given depth.
+    A view counts as the whole array it is a view of, each array is counted once.
+    """
+    if _seen is None:
+        _seen = set()
+    if isinstance(obj, np.ndarray):
+        while isinstance(obj.base, np.ndarray):
+            obj = obj.base
+        if id(obj) in _seen:
+            return 0
+        _seen.add(id(obj))
+        return obj.nbytes
+    size = sys.getsizeof(obj)
+    if depth <= 0:
+        return size
+    if hasattr(obj, "_pos_args"):
+        items = list(obj._pos_args) + [v for k, v in obj.__dict__.items() if k != "_pos_args"]
+    elif isinstance(obj, dict):
+        items = obj.values()
+    elif isinstance(obj, (list, tuple)):
+        items = obj
+    else:
+        return size
+    return size + sum(retained_size(v, depth - 1, _seen) for v in items)
+
+
+class MemoryTracker:
+    """
+    Records the memory used by actions and keeps the aggregates per action name.
+    """
+
+    def __init__(self, metrics, logger=None):
+        self.logger = logger
+        self._lock = threading.Lock()
+        # action name: dict of aggregates, see get_stats()
+        self._stats = dict()
+        self._peak = metrics.histogram("drpf_action_peak_bytes", "Peak traced allocation during execute()", BYTE_BUCKETS)
+        self._retained = metrics.histogram("drpf_action_output_bytes", "Retained size of the output", BYTE_BUCKETS)
+        self._rss_delta = metrics.gauge("drpf_action_rss_delta_bytes", "Sum of RSS changes during execute()")
+        self._rss = metrics.gauge("drpf_process_rss_bytes", "Resident set size of the process")
+        self._store = metrics.gauge("drpf_store_arguments_bytes", "Retained size of Framework.store_arguments")
+        self._started = not tracemalloc.is_tracing()
+        if self._started:
+            tracemalloc.start()
+
+    def _entry(self, name):
+        entry = self._stats.get(name)
+        if entry is None:
+            entry = self._stats[name] = {
+                "count": 0,
+                "max_peak_bytes": 0,
+                "rss_delta_bytes": 0,
+                "max_output_bytes": 0,
+            }
+        return entry
+
+    def start(self):
+        """
+        Returns the state before an action, to be passed to stop().
+        """
+        if hasattr(tracemalloc, "reset_peak"):
+            tracemalloc.reset_peak()
+        current, peak = tracemalloc.get_traced_memory()
+        return current, peak, rss_bytes()
+
+    def stop(self, action, state):
+        """
+        Records the peak allocation and the RSS change since start().
+        These are also stored in action.memory, until the action is completed.
+        """
+        current0, peak0, rss0 = state
+        current, peak = tracemalloc.get_traced_memory()
+        # Without reset_peak(), a peak not above the previous one is unknown
+        peak = max(0, (peak if peak > peak0 else current) - current0)
+        rss = rss_bytes()
+        rss_delta = None if rss is None or rss0 is None else rss - rss0
+
+        self._peak.observe(peak, action=action.name)
+        if rss is not None:
+            self._rss.set(rss)
+        with self._lock:
+            entry = self._entry(action.name)
+            entry["max_peak_bytes"] = max(entry["max_peak_bytes"], peak)
+            if rss_delta is not None:
+                entry["rss_delta_bytes"] += rss_delta
+                self._rss_delta.set(entry["rss_delta_bytes"], action=action.name)
+        action.memory = {"peak_bytes": peak, "rss_delta_bytes": rss_delta}
+
+    def record_output(self, action, store_arguments):
+        """
+        Records the retained size of the output of a completed action and logs the memory used by the action.
+        """
+        output = retained_size(action.output) if action.output is not None else 0
+        store = retained_size(store_arguments)
+        self._retained.observe(output, action=action.name)
+        self._store.set(store)
+        with self._lock:
+            entry = self._entry(action.name)
+            entry["count"] += 1
+            entry["max_output_bytes"] = max(entry["max_output_bytes"], output)
+
+        if self.logger is not None:
+            usage = action.memory or {}
+            peak, rss_delta = usage.get("peak_bytes"), usage.get("rss_delta_bytes")
+            msg = f"Memory: action {action.name}, output {output / MB:.1f} MB, store_arguments {store / MB:.1f} MB"
+            if peak is not None:
+                msg += f", peak {peak / MB:.1f} MB"
+            if rss_delta is not None:
+                msg += f", RSS delta {rss_delta / MB:+.1f} MB"
+            self.logger.info(msg)
+
+    def close(self):
+        """
+        Stops tracemalloc if it was started by this tracker.
+        """
+        if self._started:
+            tracemalloc.stop()
+            self._started = False
+
+    def get_stats(self):
+        """
+        Returns the aggregates per action name:
+        count, max_peak_bytes, rss_delta_bytes (sum) and max_output_bytes.
+        """
+        with self._lock:
+            return {k: dict(e) for k, e in self._stats.items()}
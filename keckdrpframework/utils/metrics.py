@@ -0,0 +1,200 @@
+"""
+Created on Oct 18, 2026
+
+A lightweight in-process metrics registry.
+
+Metrics are counters, gauges and histograms. Each metric has a name, a help text,
+and one value per combination of labels, for example:
+
+    registry = MetricsRegistry()
+    done = registry.counter("drpf_events_total", "Completed events")
+    done.inc(action="hist_equal2d", status="completed")
+
+    print(registry.to_prometheus())
+
+to_prometheus() returns the Prometheus text exposition format.
+snapshot() returns the same content as a dictionary.
+
+"""
+
+import bisect
+import threading
+
+# Bucket upper bounds in seconds, for latencies
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300)
+
+
+def _label_key(labels):
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(key, extra=()):
+    items = list(key) + list(extra)
+    if not items:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in items) + "}"
+
+
+def _format_number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """
+    Base class of the metrics.
+    Values are stored by label key, a sorted tuple of (label, value).
+    """
+
+    type_name = "untyped"
+
+    def __init__(self, name, help_text=""):
+        self.name = name
+        self.help = help_text
+        self._lock = threading.Lock()
+        self._values = dict()
+
+    def _lines(self):
+        return [f"{self.name}{_format_labels(key)} {_format_number(value)}" for key, value in self._values.items()]
+
+    def to_prometheus(self):
+        with self._lock:
+            lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type_name}"]
+            lines.extend(self._lines())
+            return "\n".join(lines)
+
+    def snapshot(self):
+        with self._lock:
+            return [{"labels": dict(key), "value": value} for key, value in self._values.items()]
+
+    def get(self, **labels):
+        """
+        Returns the current value for the given labels, or None.
+        """
+        with self._lock:
+            return self._values.get(_label_key(labels))
+
+
+class Counter(Metric):
+    type_name = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    type_name = "gauge"
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[_label_key(labels)] = value
+
+
+class Histogram(Metric):
+    """
+    Counts observations in buckets, Prometheus style.
+    Values are [bucket counts, sum, count]. Bucket counts are not cumulative, they are accumulated on output.
+    """
+
+    type_name = "histogram"
+
+    def __init__(self, name, help_text="", buckets=DEFAULT_BUCKETS):
+        Metric.__init__(self, name, help_text)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = _label_key(labels)
+        ix = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][ix] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def _cumulative(self, counts):
+        out, total = [], 0
+        for le, n in zip(self.buckets + (float("inf"),), counts):
+            total += n
+            out.append((le, total))
+        return out
+
+    def _lines(self):
+        lines = []
+        for key, (counts, total, count) in self._values.items():
+            for le, n in self._cumulative(counts):
+                lines.append(f"{self.name}_bucket{_format_labels(key, (('le', _format_number(le)),))} {n}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {_format_number(total)}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {count}")
+        return lines
+
+    def snapshot(self):
+        with self._lock:
+            return [
+                {"labels": dict(key), "count": count, "sum": total, "buckets": dict(self._cumulative(counts))}
+                for key, (counts, total, count) in self._values.items()
+            ]
+
+    def get(self, **labels):
+        """
+        Returns (count, sum) for the given labels, or None.
+        """
+        with self._lock:
+            entry = self._values.get(_label_key(labels))
+            return None if entry is None else (entry[2], entry[1])
+
+
+class MetricsRegistry:
+    """
+    Holds the metrics by name.
+    counter(), gauge() and histogram() return the existing metric if the name is already registered.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = dict()
+
+    def _register(self, klass, name, *args):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = klass(name, *args)
+            elif not isinstance(metric, klass):
+                raise ValueError(f"Metric {name} is already registered as a {metric.type_name}")
+            return metric
+
+    def counter(self, name, help_text=""):
+        return self._register(Counter, name, help_text)
+
+    def gauge(self, name, help_text=""):
+        return self._register(Gauge, name, help_text)
+
+    def histogram(self, name, help_text="", buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram, name, help_text, buckets)
+
+    def get_metric(self, name):
+        return self._metrics.get(name)
+
+    def snapshot(self):
+        """
+        Returns a dictionary {name: {"type": type, "help": help, "values": [...]}}.
+        """
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return {m.name: {"type": m.type_name, "help": m.help, "values": m.snapshot()} for m in metrics}
+
+    def to_prometheus(self):
+        """
+        Returns the metrics in the Prometheus text format.
+        """
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return "\n".join(m.to_prometheus() for m in metrics) + "\n"
@@ -0,0 +1,135 @@
+"""
+Created on Oct 18, 2026
+
+Deterministic profiling of actions with cProfile.
+
+When config.profile_actions is True, the framework profiles one event out of every config.profile_every_n
+events of each action. Framework.execute() is profiled, and so is BasePrimitive.apply() when the primitive
+runs in the thread pool. Primitives running in the process pool are not profiled.
+With AsyncFramework, the _perform() of sampled primitives is profiled in the default executor,
+see BasePrimitive.async_apply().
+
+The profiles of an action are merged in memory and written to temp_directory/profile_<action>.pstats
+every dump_every profiles of that action and when the framework ends, see Framework.end().
+The files can be read with pstats or with tools/profile_summary.py.
+
+Only one profiler can be active at a time, events that would overlap with a running profile are not profiled.
+
+"""
+
+import os
+import re
+import cProfile
+import pstats
+import threading
+from contextlib import contextmanager
+
+
+class ActionProfiler:
+    """
+    Profiles sampled actions and merges the results per action name.
+    """
+
+    def __init__(self, directory, every_n=10, logger=None, dump_every=100):
+        self.directory = directory
+        self.every_n = max(1, every_n or 1)
+        self.dump_every = max(1, dump_every or 1)
+        self.logger = logger
+        self._lock = threading.Lock()
+        # Held while a profiler is enabled
+        self._busy = threading.Lock()
+        self._local = threading.local()
+        self._counts = dict()
+        self._stats = dict()
+        # Action name: number of profiles merged since the last dump
+        self._unsaved = dict()
+
+    def get_file(self, name):
+        """
+        Returns the pstats file of the given action.
+        """
+        safe_name = re.sub(r"[^\w.-]", "_", name)
+        return os.path.join(self.directory, f"profile_{safe_name}.pstats")
+
+    def sample(self, name):
+        """
+        Counts one event for the given action, returns True if this event is to be profiled.
+        """
+        with self._lock:
+            n = self._counts.get(name, 0)
+            self._counts[name] = n + 1
+            return n % self.every_n == 0
+
+    def is_active(self):
+        """
+        Returns True if the current thread is being profiled.
+        """
+        return getattr(self._local, "active", False)
+
+    @contextmanager
+    def profile(self, name):
+        """
+        Profiles the enclosed code and merges the result into the profile of the given action.
+        Does nothing if the current thread is already profiled or another profile is running.
+        """
+        if self.is_active() or not self._busy.acquire(blocking=False):
+            yield
+            return
+
+        prof = cProfile.Profile()
+        self._local.active = True
+        try:
+            prof.enable()
+            try:
+                yield
+            finally:
+                prof.disable()
+        finally:
+            self._local.active = False
+            self._busy.release()
+            self._merge(name, prof)
+
+    def _merge(self, name, prof):
+        with self._lock:
+            try:
+                stats = self._stats.get(name)
+                if stats is None:
+                    stats = self._stats[name] = pstats.Stats(prof)
+                else:
+                    stats.add(prof)
+            except Exception as e:
+                if self.logger is not None:
+                    self.logger.warning(f"Failed to merge profile of {name}, {e}")
+                return
+            self._unsaved[name] = self._unsaved.get(name, 0) + 1
+            if self._unsaved[name] < self.dump_every:
+                return
+            stats = self._take_unsaved(name)
+        self._dump(name, stats)
+
+    def _take_unsaved(self, name):
+        """
+        Returns a copy of the merged profile of the action, to be written without the lock held.
+        Must be called with the lock held.
+        """
+        self._unsaved.pop(name, None)
+        stats = pstats.Stats()
+        stats.add(self._stats[name])
+        return stats
+
+    def _dump(self, name, stats):
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            stats.dump_stats(self.get_file(name))
+        except Exception as e:
+            if self.logger is not None:
+                self.logger.warning(f"Failed to save profile of {name}, {e}")
+
+    def dump(self):
+        """
+        Writes the profiles merged since the last dump.
+        """
+        with self._lock:
+            unsaved = [(name, self._take_unsaved(name)) for name in list(self._unsaved)]
+        for name, stats in unsaved:
+            self._dump(name, stats)
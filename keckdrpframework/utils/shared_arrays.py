@@ -0,0 +1,199 @@
+"""
+Created on Oct 18, 2026
+
+Transport of large numpy arrays in shared memory.
+
+With a shared event queue, events are pickled on their way to the queue manager and again on their way to the consumer.
+Instead, the large arrays in the arguments of an event can be copied once into multiprocessing.shared_memory segments,
+so that only a small SharedArray handle is pickled. The consumer maps the segments without copying the data.
+
+Only the arrays that are direct keyword or positional arguments are moved, not arrays nested in other objects.
+Events with a coalesce_key are sent as they are: a duplicate replaces the arguments of the pending event
+in the queue manager, the segments of the replaced arguments would never be released.
+
+The segments of an event belong to that event. They are unlinked when the consumer discards the event,
+ie. when its action is completed, see queues.SharedArrayEventQueue.
+Segments of events that are never consumed stay in /dev/shm until removed.
+
+"""
+
+import copy
+import threading
+
+import numpy as np
+from multiprocessing import shared_memory, resource_tracker
+
+
+def _untrack(shm):
+    """
+    Segments outlive the process that creates or attaches them.
+    They must not be unlinked by the resource tracker when that process exits.
+    """
+    try:
+        resource_tracker.unregister(shm._name, "shared_memory")
+    except Exception:
+        pass
+
+
+class SharedArray:
+    """
+    Pickleable handle of an array stored in a shared memory segment.
+    """
+
+    def __init__(self, name, shape, dtype):
+        self.name = name
+        self.shape = shape
+        self.dtype = dtype
+
+    def __str__(self):
+        return f"SharedArray {self.name}, shape={self.shape}, dtype={self.dtype}"
+
+    def __repr__(self):
+        return self.__str__()
+
+
+def _to_shared(array, names):
+    """
+    Copies the array into a new segment and returns its handle.
+    """
+    shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    _untrack(shm)
+    view = np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)
+    view[...] = array
+    del view
+    shm.close()
+    names.append(shm.name)
+    return SharedArray(shm.name, array.shape, array.dtype.str)
+
+
+def _is_large(value, min_bytes):
+    return isinstance(value, np.ndarray) and not value.dtype.hasobject and value.nbytes >= min_bytes
+
+
+def export_event(event, min_bytes):
+    """
+    Returns the event to be sent, and the list of the names of the new segments.
+    If the arguments of the event contain arrays of at least min_bytes,
+    the returned event is a copy where these arrays are replaced by SharedArray handles.
+    The original event is not modified.
+    Events with a coalesce_key are not exported, see above.
+    """
+    args = event.args
+    names = []
+    if not min_bytes or getattr(event, "coalesce_key", None) is not None or not hasattr(args, "_pos_args"):
+        return event, names
+
+    kw = {k: v for k, v in args.__dict__.items() if _is_large(v, min_bytes)}
+    pos = [i for i, v in enumerate(args._pos_args) if _is_large(v, min_bytes)]
+    if not kw and not pos:
+        return event, names
+
+    new_args = copy.copy(args)
+    new_args.__dict__ = dict(args.__dict__)
+    new_args._pos_args = list(args._pos_args)
+    try:
+        for k, v in kw.items():
+            new_args.__dict__[k] = _to_shared(v, names)
+        for i in pos:
+            new_args._pos_args[i] = _to_shared(args._pos_args[i], names)
+    except Exception:
+        unlink(names)
+        raise
+
+    new_event = copy.copy(event)
+    new_event.args = new_args
+    return new_event, names
+
+
+def unlink(names):
+    """
+    Removes the given segments.
+    """
+    for name in names:
+        try:
+            shm = shared_memory.SharedMemory(name=name)
+            _untrack(shm)
+            shm.close()
+            shm.unlink()
+        except FileNotFoundError:
+            pass
+
+
+class SharedSegments:
+    """
+    Segments attached by this process, with a reference count.
+    A segment is closed when its count drops to zero.
+    Closing fails with BufferError while arrays still use the segment,
+    those segments are closed later, see _close_pending().
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # name: [SharedMemory, refcount]
+        self._segments = dict()
+        self._closing = []
+
+    def attach(self, handle):
+        """
+        Returns an array mapped on the segment of the given SharedArray handle.
+        """
+        with self._lock:
+            entry = self._segments.get(handle.name)
+            if entry is None:
+                shm = shared_memory.SharedMemory(name=handle.name)
+                _untrack(shm)
+                entry = self._segments[handle.name] = [shm, 0]
+            entry[1] += 1
+            return np.ndarray(handle.shape, dtype=np.dtype(handle.dtype), buffer=entry[0].buf)
+
+    def import_event(self, event):
+        """
+        Replaces the SharedArray handles in the arguments of the event by arrays, in place.
+        Returns the list of the names of the attached segments.
+        """
+        args = event.args
+        names = []
+        if not hasattr(args, "_pos_args"):
+            return names
+        for k, v in list(args.__dict__.items()):
+            if isinstance(v, SharedArray):
+                args.__dict__[k] = self.attach(v)
+                names.append(v.name)
+        for i, v in enumerate(args._pos_args):
+            if isinstance(v, SharedArray):
+                args._pos_args[i] = self.attach(v)
+                names.append(v.name)
+        return names
+
+    def release(self, names, unlink=False):
+        """
+        Decrements the counts of the given segments.
+        If unlink is True, the segments are also removed, they can no longer be attached.
+        """
+        with self._lock:
+            for name in names:
+                entry = self._segments.get(name)
+                if entry is None:
+                    continue
+                entry[1] -= 1
+                if unlink:
+                    try:
+                        entry[0].unlink()
+                    except FileNotFoundError:
+                        pass
+                if entry[1] <= 0:
+                    del self._segments[name]
+                    self._closing.append(entry[0])
+            self._close_pending()
+
+    def _close_pending(self):
+        """
+        Closes the released segments that are no longer used by any array.
+        """
+        still_open = []
+        for shm in self._closing:
+            try:
+                shm.close()
+            except BufferError:
+                still_open.append(shm)
+        self._closing = still_open
@@ -0,0 +1,135 @@
+"""
+Created on Oct 18, 2026
+
+Tracing of event chains.
+
+Every event has a trace_id. An event created while an action runs gets the trace id of that action's event,
+so that all the events following from one ingested file share the same trace id, also across the queue manager.
+Other events start a new trace, their trace id is their own id.
+
+When config.trace_events is True, the framework records spans in a Tracer:
+    - one span per action, category "action"
+    - one span per BasePrimitive.apply(), including nested primitives, category "primitive"
+    - the time each event waited in the queues, category "queue"
+
+export_chrome_trace() writes the spans in the Chrome trace event format,
+which can be loaded in chrome://tracing or https://ui.perfetto.dev.
+
+"""
+
+import os
+import json
+import time
+import datetime
+import threading
+import contextvars
+from collections import deque
+from contextlib import contextmanager
+
+# Trace id of the action running in the current thread or asyncio task
+_current_trace = contextvars.ContextVar("drpf_current_trace", default=None)
+
+
+def current_trace_id():
+    """
+    Returns the trace id of the running action, or None.
+    """
+    return _current_trace.get()
+
+
+@contextmanager
+def use_trace(trace_id):
+    """
+    Makes trace_id the current trace id while the enclosed code runs.
+    """
+    token = _current_trace.set(trace_id)
+    try:
+        yield
+    finally:
+        _current_trace.reset(token)
+
+
+def _timestamp_us(dt):
+    """
+    Converts Event._timestamp, a naive UTC datetime, to microseconds since the epoch.
+    """
+    return dt.replace(tzinfo=datetime.timezone.utc).timestamp() * 1e6
+
+
+class Tracer:
+    """
+    Records spans, keeping the last max_spans of them.
+    """
+
+    def __init__(self, max_spans=100000):
+        self._lock = threading.Lock()
+        self._spans = deque(maxlen=max_spans)
+        self._pid = os.getpid()
+
+    def _add(self, record):
+        with self._lock:
+            self._spans.append(record)
+
+    @contextmanager
+    def span(self, name, trace_id=None, cat="action", **args):
+        """
+        Records a span for the enclosed code.
+        While the code runs, trace_id is the current trace id, see current_trace_id().
+        """
+        if trace_id is None:
+            trace_id = _current_trace.get()
+        start = time.time()
+        try:
+            with use_trace(trace_id):
+                yield
+        finally:
+            end = time.time()
+            args["trace_id"] = trace_id
+            self._add(
+                {
+                    "name": name,
+                    "cat": cat,
+                    "ph": "X",
+                    "ts": start * 1e6,
+                    "dur": (end - start) * 1e6,
+                    "pid": self._pid,
+                    "tid": threading.get_ident(),
+                    "args": args,
+                }
+            )
+
+    def record_wait(self, event):
+        """
+        Records the time the event waited in the queues, from its creation until now.
+        Queue waits overlap, they are recorded as async spans, one track per trace.
+        """
+        start = _timestamp_us(event._timestamp)
+        common = {"name": event.name, "cat": "queue", "id": event.trace_id, "pid": self._pid, "tid": 0}
+        args = {"trace_id": event.trace_id, "event_id": event.id}
+        with self._lock:
+            self._spans.append(dict(common, ph="b", ts=start, args=args))
+            self._spans.append(dict(common, ph="e", ts=time.time() * 1e6))
+
+    def get_spans(self, trace_id=None):
+        """
+        Returns a copy of the recorded spans, all of them or those of the given trace.
+        """
+        with self._lock:
+            spans = list(self._spans)
+        if trace_id is None:
+            return spans
+        return [s for s in spans if s.get("id") == trace_id or s.get("args", {}).get("trace_id") == trace_id]
+
+    def export_chrome_trace(self, filename=None, trace_id=None):
+        """
+        Returns the spans in the Chrome trace event format, and writes them to filename if given.
+        """
+        out = {"traceEvents": self.get_spans(trace_id), "displayTimeUnit": "ms"}
+        if filename is not None:
+            with open(filename, "w") as fh:
+                json.dump(out, fh)
+        return out
+
+    def clear(self):
+        with self._lock:
+            self._spans.clear()